@@ -0,0 +1,204 @@
+# benchmarks/e2e.py
+"""
+End-to-end benchmark on local stand-ins (benchmarks/fakes.py) with the emails/ archive as corpus.
+
+Measures, for every batch size x concurrency combination:
+- ingest: list → get → normalize → embed → insert throughput (msgs/sec)
+- search: vector search latency p50/p99 (query vectors embedded up front)
+- reply:  generate_reply_with_ollama time-to-first-token and total time p50/p99
+
+Results are written as JSON so runs can be compared for regressions.
+
+Usage:
+    python benchmarks/e2e.py --copies 20 --batch-sizes 1,10,50 --concurrency 1,4,8
+    python benchmarks/e2e.py --embed-latency 0.02 --token-latency 0.01 --out results.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fakes import FakeGmailService, FakeOllamaServer  # noqa: E402
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile (values need not be sorted)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def _summary(values):
+    return {
+        "n": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "mean_ms": round(statistics.mean(values) * 1000, 3),
+    }
+
+
+def _open_store(backend, dim, workdir):
+    from vector_store import open_vector_store
+    if backend == "local":
+        return open_vector_store("local", dim=dim, path=tempfile.mkdtemp(dir=workdir))
+    return open_vector_store(backend, dim=dim)
+
+
+def bench_ingest(gmail, backend, batch_size, concurrency, workdir, dim):
+    from embedder import OllamaEmbedder
+    from read_gmail_to_milvus import parse_message, index_email
+
+    embedder = OllamaEmbedder()
+    store = _open_store(backend, dim, workdir)
+
+    def one(msg_id):
+        index_email(parse_message(gmail.users().messages().get(userId="me", id=msg_id).execute()),
+                    embedder, store)
+
+    count = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        page_token = None
+        while True:
+            page = gmail.users().messages().list(userId="me", maxResults=batch_size,
+                                                 pageToken=page_token).execute()
+            ids = [m["id"] for m in page.get("messages", [])]
+            list(pool.map(one, ids))
+            count += len(ids)
+            page_token = page.get("nextPageToken")
+            if not page_token:
+                break
+    elapsed = time.perf_counter() - start
+    return store, {"batch_size": batch_size, "concurrency": concurrency, "messages": count,
+                   "seconds": round(elapsed, 3), "msgs_per_sec": round(count / elapsed, 2)}
+
+
+def bench_search(store, queries, concurrency, top_k=3):
+    latencies = []
+    lock = threading.Lock()
+
+    def one(qvec):
+        t0 = time.perf_counter()
+        store.search_similar(qvec, limit=top_k)
+        dt = time.perf_counter() - t0
+        with lock:
+            latencies.append(dt)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, queries))
+    return dict({"concurrency": concurrency, "top_k": top_k}, **_summary(latencies))
+
+
+def bench_reply(emails, concurrency):
+    from smart_reply import format_email_text, generate_reply_with_ollama
+
+    ttft, total = [], []
+    lock = threading.Lock()
+
+    def one(email):
+        t0 = time.perf_counter()
+        first = []
+
+        def on_chunk(chunk):
+            if not first:
+                first.append(time.perf_counter() - t0)
+
+        generate_reply_with_ollama(format_email_text(email), "", echo=False, raise_errors=True,
+                                   on_chunk=on_chunk)
+        with lock:
+            ttft.append(first[0])
+            total.append(time.perf_counter() - t0)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, emails))
+    return {"concurrency": concurrency, "ttft": _summary(ttft), "total": _summary(total)}
+
+
+def _ints(s):
+    return [int(x) for x in s.split(",") if x]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmark on local fakes")
+    parser.add_argument("--copies", type=int, default=5, help="repeat the emails/ archive N times")
+    parser.add_argument("--batch-sizes", type=_ints, default=[1, 10, 50])
+    parser.add_argument("--concurrency", type=_ints, default=[1, 4])
+    parser.add_argument("--backend", default="local", help="vector backend: local or milvus")
+    parser.add_argument("--gmail-latency", type=float, default=0.02)
+    parser.add_argument("--embed-latency", type=float, default=0.005)
+    parser.add_argument("--prefill-latency", type=float, default=0.05)
+    parser.add_argument("--token-latency", type=float, default=0.005)
+    parser.add_argument("--reply-tokens", type=int, default=48)
+    parser.add_argument("--replies", type=int, default=8, help="replies generated per concurrency level")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--out", default=None, help="JSON output path (default benchmarks/results/e2e-<time>.json)")
+    args = parser.parse_args(argv)
+
+    fake = FakeOllamaServer(embed_latency=args.embed_latency, prefill_latency=args.prefill_latency,
+                            token_latency=args.token_latency, reply_tokens=args.reply_tokens, dim=args.dim)
+    os.environ["OLLAMA_HOST"] = fake.start()
+    gmail = FakeGmailService(copies=args.copies, latency=args.gmail_latency)
+
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {k: v for k, v in vars(args).items() if k != "out"},
+        "corpus_messages": len(gmail.corpus),
+        "ingest": [], "search": [], "reply": [],
+    }
+
+    from embedder import OllamaEmbedder
+    from read_gmail_to_milvus import parse_messages
+
+    with tempfile.TemporaryDirectory() as workdir:
+        store = None
+        for batch_size in args.batch_sizes:
+            for concurrency in args.concurrency:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    store, row = bench_ingest(gmail, args.backend, batch_size, concurrency, workdir, args.dim)
+                results["ingest"].append(row)
+                print(f"ingest  batch={batch_size:<4} conc={concurrency:<3} {row['msgs_per_sec']:>9.1f} msgs/s")
+
+        emails = parse_messages(gmail.corpus)
+        embedder = OllamaEmbedder()
+        queries = [embedder.embed(f"{e['subject']}\n{e['body']}") for e in emails]
+        for concurrency in args.concurrency:
+            row = bench_search(store, queries, concurrency)
+            results["search"].append(row)
+            print(f"search  conc={concurrency:<3} p50={row['p50_ms']:.2f}ms p99={row['p99_ms']:.2f}ms")
+
+    for concurrency in args.concurrency:
+        row = bench_reply(emails[:max(args.replies, concurrency)], concurrency)
+        results["reply"].append(row)
+        print(f"reply   conc={concurrency:<3} ttft p50={row['ttft']['p50_ms']:.1f}ms "
+              f"p99={row['ttft']['p99_ms']:.1f}ms total p50={row['total']['p50_ms']:.1f}ms")
+
+    fake.stop()
+
+    out = args.out or os.path.join(ROOT, "benchmarks", "results", f"e2e-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    if os.path.dirname(out):
+        os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"📝 Wrote {out}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
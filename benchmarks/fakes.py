@@ -0,0 +1,216 @@
+# benchmarks/fakes.py
+"""
+Local stand-ins for the external services, with configurable latency:
+
+- FakeOllamaServer: real HTTP server speaking the Ollama /api/embeddings and /api/generate
+  (streaming NDJSON) protocol, so the production clients are exercised unchanged.
+  Embeddings are deterministic hashed bag-of-words vectors, so similar emails stay similar.
+- FakeGmailService: in-process object with the googleapiclient call chain
+  (service.users().messages().list/get(...).execute()) serving the local emails/ archive.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ARCHIVE = os.path.join(ROOT, "emails")
+
+_WORD = re.compile(r"\w+")
+
+
+def hashed_embedding(text: str, dim: int = 768):
+    vec = [0.0] * dim
+    for word in _WORD.findall(text.lower())[:512]:
+        h = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=4).digest(), "big")
+        vec[h % dim] += 1.0 if h & 0x80000000 else -1.0
+    return vec
+
+
+class FakeOllamaServer:
+    """
+    embed_latency: seconds per /api/embeddings call
+    prefill_latency: seconds before the first generated token
+    token_latency: seconds between generated tokens
+    fail_requests: answer this many upcoming requests with HTTP 503 (retry tests)
+    break_after: drop the connection after this many streamed tokens (None: never)
+    """
+
+    def __init__(self, embed_latency=0.005, prefill_latency=0.05, token_latency=0.005,
+                 reply_tokens=48, dim=768, host="127.0.0.1", port=0):
+        self.embed_latency = embed_latency
+        self.prefill_latency = prefill_latency
+        self.token_latency = token_latency
+        self.reply_tokens = reply_tokens
+        self.dim = dim
+        self.fail_requests = 0
+        self.break_after = None
+        self.calls = {"embeddings": 0, "generate": 0}
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _json(self, obj):
+                body = json.dumps(obj).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == "/api/tags":
+                    self._json({"models": [{"name": "mistral:instruct"}, {"name": "nomic-embed-text"}]})
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                req = json.loads(self.rfile.read(length) or b"{}")
+                if fake.fail_requests > 0:
+                    fake.fail_requests -= 1
+                    self.send_error(503)
+                    return
+                if self.path == "/api/embeddings":
+                    fake.calls["embeddings"] += 1
+                    time.sleep(fake.embed_latency)
+                    self._json({"embedding": hashed_embedding(req.get("prompt", ""), fake.dim)})
+                elif self.path == "/api/generate":
+                    fake.calls["generate"] += 1
+                    tokens = [f"word{i} " for i in range(fake.reply_tokens)]
+                    time.sleep(fake.prefill_latency)
+                    if not req.get("stream", True):
+                        time.sleep(fake.token_latency * len(tokens))
+                        self._json({"model": req.get("model"), "response": "".join(tokens), "done": True})
+                        return
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/x-ndjson")
+                    self.send_header("Transfer-Encoding", "chunked")
+                    self.end_headers()
+                    for i, token in enumerate(tokens):
+                        if i == fake.break_after:
+                            self.close_connection = True
+                            return  # no terminating chunk: the client sees a broken stream
+                        if i:
+                            time.sleep(fake.token_latency)
+                        self._chunk({"model": req.get("model"), "response": token, "done": False})
+                    self._chunk({"model": req.get("model"), "response": "", "done": True})
+                    self.wfile.write(b"0\r\n\r\n")
+                else:
+                    self.send_error(404)
+
+            def _chunk(self, obj):
+                line = (json.dumps(obj) + "\n").encode("utf-8")
+                self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+                self.wfile.flush()
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _load_archive(archive):
+    """emails/<folder>/{metadata.json, body.txt} → Gmail messages.get resources"""
+    messages = []
+    for folder in sorted(os.listdir(archive)):
+        meta_path = os.path.join(archive, folder, "metadata.json")
+        body_path = os.path.join(archive, folder, "body.txt")
+        if not os.path.exists(meta_path):
+            continue
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        body = ""
+        if os.path.exists(body_path):
+            with open(body_path, "r", encoding="utf-8") as f:
+                body = f.read()
+        try:
+            internal_date = str(int(parsedate_to_datetime(meta.get("date", "")).timestamp() * 1000))
+        except (TypeError, ValueError):
+            internal_date = "0"
+        headers = [{"name": name.title() if name != "message-id" else "Message-ID", "value": meta[name]}
+                   for name in ("from", "to", "subject", "date", "message-id") if meta.get(name)]
+        messages.append({
+            "id": meta["id"],
+            "threadId": meta.get("threadId", meta["id"]),
+            "labelIds": meta.get("labelIds", ["INBOX"]),
+            "snippet": meta.get("snippet", ""),
+            "internalDate": meta.get("internalDate") or internal_date,
+            "payload": {
+                "mimeType": "text/plain",
+                "headers": headers,
+                "body": {"data": base64.urlsafe_b64encode(body.encode("utf-8")).decode("ascii")},
+            },
+        })
+    return messages
+
+
+class _Call:
+    def __init__(self, fn, latency):
+        self.fn = fn
+        self.latency = latency
+
+    def execute(self):
+        time.sleep(self.latency)
+        return self.fn()
+
+
+class FakeGmailService:
+    """
+    Serves the emails/ archive through the googleapiclient call chain.
+    copies > 1 repeats the archive with distinct ids ("<id>-<n>") to get a larger corpus;
+    latency is added to every execute().
+    """
+
+    def __init__(self, archive=ARCHIVE, copies=1, latency=0.02):
+        base = _load_archive(archive)
+        self.corpus = []
+        for n in range(copies):
+            for msg in base:
+                self.corpus.append(dict(msg, id=f"{msg['id']}-{n}" if copies > 1 else msg["id"]))
+        self.by_id = {m["id"]: m for m in self.corpus}
+        self.latency = latency
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def list(self, userId="me", maxResults=100, pageToken=None, **kwargs):
+        start = int(pageToken or 0)
+        page = self.corpus[start:start + maxResults]
+        resp = {"messages": [{"id": m["id"], "threadId": m["threadId"]} for m in page],
+                "resultSizeEstimate": len(self.corpus)}
+        if start + maxResults < len(self.corpus):
+            resp["nextPageToken"] = str(start + maxResults)
+        return _Call(lambda: resp, self.latency)
+
+    def get(self, userId="me", id=None, **kwargs):
+        return _Call(lambda: self.by_id[id], self.latency)
@@ -0,0 +1,94 @@
+# benchmarks/startup.py
+"""
+Cold-start benchmark for the CLI and pipeline modules.
+
+For every module it measures, in a fresh interpreter each run:
+- import time (wall clock of `python -c "import <module>"` minus a bare interpreter start)
+- the modules whose import took longest (`python -X importtime`)
+and the wall time of `python cli.py <command> -h`.
+
+Usage:
+    python benchmarks/startup.py --runs 5 --out bench_startup.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = ["cli", "read_gmail", "read_gmail_to_milvus", "smart_reply", "reply_service",
+           "gmail_push", "vector_store", "embedder", "gmail_client"]
+COMMANDS = ["fetch", "ingest", "reply", "serve", "push"]
+
+
+def _wall(cmd, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        proc = subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True)
+        times.append(time.perf_counter() - start)
+        if proc.returncode != 0:
+            return None, proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "failed"
+    return statistics.median(times), None
+
+
+def _top_level_imports(code):
+    """Parse `-X importtime` output into [(cumulative_us, module)] for top-level imports."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          cwd=ROOT, capture_output=True, text=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        # "import time:  self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        if not name.startswith("  "):  # top-level imports only (nested ones are indented further)
+            rows.append((int(cumulative_us), name.strip()))
+    return rows
+
+
+def _slowest_imports(module, top=5):
+    """The slowest imports triggered by `import module`, ignoring interpreter startup (site, encodings...)."""
+    startup = {name for _, name in _top_level_imports("pass")}
+    rows = sorted((r for r in _top_level_imports(f"import {module}") if r[1] not in startup), reverse=True)
+    return [{"module": n, "cumulative_ms": round(us / 1000, 1)} for us, n in rows[:top]]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure CLI / module cold-start time")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--out", help="write results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    baseline, _ = _wall([sys.executable, "-c", "pass"], args.runs)
+    results = {"python": sys.version.split()[0], "runs": args.runs,
+               "interpreter_ms": round(baseline * 1000, 1), "imports": {}, "commands": {}}
+
+    for module in MODULES:
+        t, err = _wall([sys.executable, "-c", f"import {module}"], args.runs)
+        entry = {"error": err} if err else {
+            "import_ms": round(max(0.0, t - baseline) * 1000, 1),
+            "slowest": _slowest_imports(module),
+        }
+        results["imports"][module] = entry
+        print(f"import {module:<22} " + (f"{entry['import_ms']:>8.1f} ms" if not err else f"error: {err}"))
+
+    for command in COMMANDS:
+        t, err = _wall([sys.executable, "cli.py", command, "-h"], args.runs)
+        results["commands"][command] = {"error": err} if err else {"help_ms": round(t * 1000, 1)}
+        print(f"cli.py {command:<6} -h              " + (f"{t * 1000:>8.1f} ms" if not err else f"error: {err}"))
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"📝 Wrote {args.out}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
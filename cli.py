@@ -0,0 +1,53 @@
+# cli.py
+"""
+Single entry point for the pipeline scripts:
+
+    python cli.py fetch  [--max N]          save newest emails + attachments under emails/
+    python cli.py ingest [--max N]          embed newest emails into the vector store
+    python cli.py reply                     draft a reply to the latest email
+    python cli.py serve  [--workers N ...]  run the reply worker pool
+    python cli.py pregen [--threshold X]    pre-generate replies for likely-to-need-reply mail
+    python cli.py push   watch|publish ...  Gmail push helpers
+    python cli.py inspect [summary|export|duplicates|probe]  vector store stats and export
+    python cli.py api    [--port N]         run the FastAPI app
+
+Only the module behind the chosen command is imported, and those modules load their
+heavy dependencies (pymilvus, OCR/PDF extractors, Google client libraries) on first use,
+so a cron-driven `ingest` does not pay for Tesseract and `--help` imports nothing at all.
+Arguments after the command are passed to that module's main(); use `cli.py <command> -h`.
+"""
+
+import argparse
+import importlib
+import sys
+
+# command -> (module, help)
+COMMANDS = {
+    "fetch": ("read_gmail", "save the newest emails (metadata, body, attachments, OCR) under emails/"),
+    "ingest": ("read_gmail_to_milvus", "embed the newest emails into the vector store"),
+    "reply": ("smart_reply", "draft a reply to the latest email"),
+    "serve": ("reply_service", "run the reply worker pool"),
+    "pregen": ("pregen", "pre-generate replies for messages likely to need one"),
+    "inspect": ("inspect_milvus_data", "vector store stats, export, duplicate and latency checks"),
+    "push": ("gmail_push", "start the Gmail watch or publish a local test notification"),
+    "api": ("ollamaconnect", "run the FastAPI app"),
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="cli.py",
+        description="Gmail AI assistant pipeline",
+        epilog="commands:\n" + "\n".join(f"  {name:<8}{help}" for name, (_, help) in COMMANDS.items()),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("command", choices=COMMANDS, metavar="command")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="arguments for the command")
+    args = parser.parse_args(argv)
+
+    module = importlib.import_module(COMMANDS[args.command][0])
+    return module.main(args.args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+# dedup.py
+"""
+Near-duplicate detection for the ingest pipeline (SimHash + LSH banding).
+
+Newsletters, notifications and reply-all chains produce many near-identical bodies. Each
+normalized body gets a 64-bit SimHash over word 3-shingles; bodies within MAX_DISTANCE bits
+of an already indexed representative are not embedded or stored again, they are only added
+to that representative's member list.
+
+Lookup is LSH banding: the fingerprint is split into BANDS bands, and by the pigeonhole
+principle two fingerprints within MAX_DISTANCE < BANDS bits share at least one band exactly,
+so only the few representatives in matching buckets are compared.
+"""
+
+import hashlib
+import json
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+BITS = 64
+BANDS = 8
+BAND_BITS = BITS // BANDS
+MAX_DISTANCE = 5
+# Very short bodies ("Thanks!", "See you at 4") are never collapsed: they are similar by
+# nature but belong to different conversations.
+MIN_WORDS = 20
+
+DEFAULT_PATH = "data/dedup_index.json"
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def _hash64(s: str) -> int:
+    return int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def simhash(text: str, shingle: int = 3) -> Optional[int]:
+    """64-bit SimHash of the word shingles in text, or None if text is too short to fingerprint."""
+    words = _WORD.findall(text.lower())
+    if len(words) < MIN_WORDS:
+        return None
+    counts = [0] * BITS
+    for i in range(len(words) - shingle + 1):
+        h = _hash64(" ".join(words[i:i + shingle]))
+        for bit in range(BITS):
+            counts[bit] += 1 if (h >> bit) & 1 else -1
+    return sum(1 << bit for bit in range(BITS) if counts[bit] > 0)
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _bands(fingerprint: int):
+    mask = (1 << BAND_BITS) - 1
+    return [(i, (fingerprint >> (i * BAND_BITS)) & mask) for i in range(BANDS)]
+
+
+class NearDuplicateIndex:
+    """
+    Persistent representative → members map with an in-memory LSH bucket index.
+    Stored as JSON: {"representatives": {rep_id: {"simhash": int, "members": [ids]}}}.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH, max_distance: int = MAX_DISTANCE):
+        if max_distance >= BANDS:
+            raise ValueError(f"max_distance must be < {BANDS} for banded lookup to be exact")
+        self.path = path
+        self.max_distance = max_distance
+        self.reps: Dict[str, dict] = {}
+        self.member_of: Dict[str, str] = {}
+        self.buckets: Dict[Tuple[int, int], List[str]] = {}
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for rep_id, entry in json.load(f)["representatives"].items():
+                    self._add_rep(rep_id, entry["simhash"], entry["members"])
+
+    def _add_rep(self, rep_id: str, fingerprint: int, members: List[str]):
+        self.reps[rep_id] = {"simhash": fingerprint, "members": members}
+        for member in members:
+            self.member_of[member] = rep_id
+        for band in _bands(fingerprint):
+            self.buckets.setdefault(band, []).append(rep_id)
+
+    def find(self, fingerprint: int) -> Optional[str]:
+        """Closest representative within max_distance bits, or None."""
+        best, best_dist = None, self.max_distance + 1
+        seen = set()
+        for band in _bands(fingerprint):
+            for rep_id in self.buckets.get(band, ()):
+                if rep_id in seen:
+                    continue
+                seen.add(rep_id)
+                dist = hamming(fingerprint, self.reps[rep_id]["simhash"])
+                if dist < best_dist:
+                    best, best_dist = rep_id, dist
+        return best
+
+    def add(self, message_id: str, text: str) -> Tuple[str, bool]:
+        """
+        Register a message. Returns (representative_id, is_new): is_new is True when the
+        message became its own representative and should be embedded and stored.
+        """
+        if message_id in self.member_of:
+            return self.member_of[message_id], False
+        fingerprint = simhash(text)
+        if fingerprint is None:
+            return message_id, True
+        rep_id = self.find(fingerprint)
+        if rep_id is None:
+            self._add_rep(message_id, fingerprint, [message_id])
+            return message_id, True
+        self.reps[rep_id]["members"].append(message_id)
+        self.member_of[message_id] = rep_id
+        return rep_id, False
+
+    def forget(self, message_id: str):
+        """
+        Undo add() for a message that could not be stored (embedding or insert failed), so a
+        retry is not skipped as a near-duplicate of itself.
+        """
+        rep_id = self.member_of.get(message_id)
+        if rep_id is None:
+            return
+        if rep_id != message_id:
+            self.reps[rep_id]["members"].remove(message_id)
+            del self.member_of[message_id]
+            return
+        entry = self.reps.pop(rep_id)
+        for member in entry["members"]:  # nothing of this group was stored
+            del self.member_of[member]
+        for band in _bands(entry["simhash"]):
+            self.buckets[band].remove(rep_id)
+
+    def members(self, rep_id: str) -> List[str]:
+        entry = self.reps.get(rep_id)
+        return list(entry["members"]) if entry else [rep_id]
+
+    def stats(self) -> dict:
+        messages = sum(len(e["members"]) for e in self.reps.values())
+        return {"representatives": len(self.reps), "messages": messages,
+                "collapsed": messages - len(self.reps)}
+
+    def save(self):
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"representatives": self.reps}, f)
+        os.replace(tmp, self.path)
+
+
+def collapse_hits(hits, limit: int, field: str = "body"):
+    """Drop search hits whose text is a near-duplicate of a better-ranked hit; keep at most limit."""
+    kept, fingerprints = [], []
+    for hit in hits:
+        fp = simhash(hit.entity.get(field) or "")
+        if fp is not None and any(hamming(fp, other) <= MAX_DISTANCE for other in fingerprints):
+            continue
+        if fp is not None:
+            fingerprints.append(fp)
+        kept.append(hit)
+        if len(kept) == limit:
+            break
+    return kept
@@ -0,0 +1,164 @@
+# draft_writer.py
+"""
+Draft-writer stage: saves a generated reply to Gmail as a draft *while* it streams.
+
+The draft is created as soon as the first tokens arrive (threaded under the original
+message with In-Reply-To/References) and then replaced with the text so far at most every
+`min_interval` seconds. Uploads run on a background thread and always send the latest
+snapshot, so a slow Gmail call never stalls token streaming and intermediate snapshots that
+were superseded are simply skipped.
+
+    writer = DraftWriter(email)          # email from smart_reply.get_email
+    reply = generate_reply_with_ollama(text, context, on_chunk=writer.write)
+    writer.close(reply)                  # final, complete draft
+
+Passing the draft_id of an earlier attempt (reply_service.py stores it with the job) makes
+the writer update that draft instead of creating a second one.
+
+Needs the gmail.compose scope (gmail_client.COMPOSE_SCOPES).
+"""
+
+import base64
+import threading
+import time
+from email.message import EmailMessage
+
+from gmail_client import COMPOSE_SCOPES, get_gmail_service
+from tracing import span
+
+
+def reply_subject(subject: str) -> str:
+    subject = (subject or "").strip()
+    return subject if subject.lower().startswith("re:") else f"Re: {subject}".rstrip()
+
+
+def build_reply_message(email: dict, text: str) -> dict:
+    """Gmail message resource (raw RFC 822 + threadId) replying to `email`."""
+    msg = EmailMessage()
+    msg["To"] = email.get("reply_to") or email["from_email"]
+    msg["Subject"] = reply_subject(email.get("subject", ""))
+    rfc_id = email.get("rfc_message_id")
+    if rfc_id:
+        msg["In-Reply-To"] = rfc_id
+        msg["References"] = " ".join(filter(None, [email.get("references", ""), rfc_id]))
+    msg.set_content(text)
+    message = {"raw": base64.urlsafe_b64encode(msg.as_bytes()).decode("ascii")}
+    if email.get("thread_id"):
+        message["threadId"] = email["thread_id"]
+    return message
+
+
+class DraftWriter:
+    """
+    Collects streamed chunks (list + join, no repeated string concatenation) and keeps a
+    Gmail draft in sync with them. service is used only from the upload thread; by default
+    that thread builds its own (googleapiclient services are not thread-safe).
+    """
+
+    def __init__(self, email: dict, service=None, min_interval: float = 1.0, min_chars: int = 80,
+                 draft_id: str = None, on_draft=None):
+        self.email = email
+        self.service = service
+        self.min_interval = min_interval
+        self.min_chars = min_chars
+        self.draft_id = draft_id
+        self.on_draft = on_draft   # called with the new draft id once the draft is created
+        self.updates = 0
+        self._parts = []
+        self._chars = 0
+        self._sent_chars = 0
+        self._pending = None       # latest snapshot not yet uploaded
+        self._error = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="draft-writer", daemon=True)
+        self._thread.start()
+
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def write(self, chunk: str):
+        """on_chunk callback: buffer the chunk and schedule an upload when enough text arrived."""
+        if not chunk:
+            return
+        self._parts.append(chunk)
+        self._chars += len(chunk)
+        # The first chunk is uploaded right away so the draft shows up at time-to-first-token;
+        # after that the upload thread batches by min_interval.
+        if self._sent_chars == 0 or self._chars - self._sent_chars >= self.min_chars:
+            self._schedule(self.text())
+
+    def _schedule(self, snapshot: str):
+        with self._cond:
+            self._pending = snapshot
+            self._sent_chars = len(snapshot)
+            self._cond.notify()
+
+    def _run(self):
+        last = 0.0
+        while True:
+            with self._cond:
+                while self._pending is None and not self._closed:
+                    self._cond.wait()
+                if self._pending is None:
+                    return
+                wait = last + self.min_interval - time.monotonic()
+                if wait > 0 and self.draft_id is not None and not self._closed:
+                    self._cond.wait(wait)  # let more text accumulate (or close() wake us)
+                    continue
+                snapshot, self._pending = self._pending, None
+            try:
+                self._upload(snapshot)
+                self._error = None
+            except Exception as e:
+                self._error = e
+                print(f"⚠️ Draft update failed: {e}")
+            last = time.monotonic()
+
+    def _upload(self, text: str):
+        if self.service is None:
+            self.service = get_gmail_service(COMPOSE_SCOPES)
+        body = {"message": build_reply_message(self.email, text)}
+        drafts = self.service.users().drafts()
+        with span("gmail.draft." + ("update" if self.draft_id else "create"),
+                  **{"gmail.message_id": self.email.get("id"), "draft.chars": len(text)}):
+            if self.draft_id is not None:
+                from googleapiclient.errors import HttpError
+                try:
+                    drafts.update(userId="me", id=self.draft_id, body=dict(body, id=self.draft_id)).execute()
+                except HttpError as e:
+                    if e.resp.status != 404:
+                        raise
+                    self.draft_id = None  # deleted (or sent) in the meantime: start a new one
+            if self.draft_id is None:
+                self.draft_id = drafts.create(userId="me", body=body).execute()["id"]
+                print(f"📝 Created draft {self.draft_id} for {self.email.get('id')}")
+                if self.on_draft is not None:
+                    self.on_draft(self.draft_id)
+        self.updates += 1
+
+    def close(self, final_text: str = None, timeout: float = 60) -> str:
+        """Upload the final text, wait for the upload thread, and return the draft id."""
+        text = self.text() if final_text is None else final_text
+        if text.strip():
+            self._schedule(text)
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout)
+        if self._error is not None and text.strip():
+            raise self._error
+        return self.draft_id
+
+    def discard(self):
+        """Stop uploading and delete the draft (e.g. generation failed and will be retried)."""
+        with self._cond:
+            self._pending = None
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        if self.draft_id is not None:
+            if self.service is None:
+                self.service = get_gmail_service(COMPOSE_SCOPES)
+            self.service.users().drafts().delete(userId="me", id=self.draft_id).execute()
+            self.draft_id = None
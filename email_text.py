@@ -0,0 +1,211 @@
+# email_text.py
+"""
+Email body normalization used before embedding and prompting:
+
+1. pick the best MIME alternative (text/plain unless it is missing or a stub, else text/html)
+   instead of concatenating every part; other text/* parts (calendar invites, vCards,
+   CSV) are never treated as body text
+2. HTML → text in one streaming pass (entities decoded; script/style/head and Gmail/Outlook
+   quote containers dropped)
+3. strip quoted history ("On ... wrote:", "-----Original Message-----", "> " lines) and signatures
+4. collapse whitespace, keeping paragraph breaks
+
+normalize_bodies() runs the stage over a batch of Gmail payloads (ingest, push ingest); a
+body that occurs several times in the batch (newsletters, repeated quote chains) is only
+normalized once.
+"""
+
+import base64
+import re
+from html.parser import HTMLParser
+from typing import List, Optional, Tuple
+
+# A text/plain part shorter than this while the HTML part is much longer is treated as a stub
+# ("View this email in your browser") and the HTML alternative is used instead.
+MIN_PLAIN_CHARS = 40
+
+_SKIP_TAGS = {"script", "style", "head", "title", "noscript", "template"}
+_BLOCK_TAGS = {"p", "div", "br", "tr", "li", "ul", "ol", "table", "h1", "h2", "h3", "h4", "h5", "h6",
+               "section", "article", "header", "footer", "hr", "pre", "center"}
+_VOID_TAGS = {"br", "hr", "img", "meta", "link", "input", "col", "area", "base", "wbr", "source"}
+_QUOTE_CLASSES = ("gmail_quote", "gmail_extra", "yahoo_quoted", "moz-cite-prefix", "OutlookMessageHeader")
+
+# An "On ... wrote:" line is only a reply header with evidence of one: an address, a time
+# or a date ("As Jane wrote:" in prose is not).
+_HEADER_EVIDENCE = r"(?:\S@\S|\d:\d\d|\d/\d|\b(?:19|20)\d\d\b)"
+
+# Start of quoted history in plain text: everything from the first match on is dropped.
+_QUOTE_HEADER = re.compile(
+    r"^(?:"
+    r"On (?=[^\n]{0,300}?(?:\n[^\n]{0,300}?)?wrote:[ \t]*$)"     # Gmail / Apple Mail (may wrap once)
+    r"(?:[^\n]{0,300}?" + _HEADER_EVIDENCE + r"|[^\n]{0,300}?\n[^\n]{0,300}?" + _HEADER_EVIDENCE + r")"
+    r"[^\n]{0,300}?(?:\n[^\n]{0,300}?)?wrote:[ \t]*$"
+    r"|-{2,}\s*Original Message\s*-{2,}\s*$"              # Outlook
+    r"|_{10,}[ \t]*\n\s*From: "                           # Outlook web separator + header block
+    r"|From: .+\n(?:Sent|Date): .+\n(?:To|Subject): "     # Outlook header block
+    r")",
+    re.MULTILINE | re.IGNORECASE,
+)
+_SIGNATURE = re.compile(
+    r"^(?:-- ?$|Sent from my \w+|Get Outlook for \w+)",
+    re.MULTILINE,
+)
+_QUOTED_LINE = re.compile(r"^[ \t]*>.*(?:\n|$)", re.MULTILINE)
+_SPACES = re.compile(r"[ \t\r\f\v\u00a0\u200b\u200c\u034f]+")  # incl. nbsp / zero-width preheader padding
+_HTML_SNIFF = re.compile(r"<(?:html|body|div|p|br|table|span)\b", re.IGNORECASE)
+_BLANK_LINES = re.compile(r"\n\s*\n\s*(?:\n\s*)+")
+
+
+class _HTMLToText(HTMLParser):
+    """Single-pass HTML → text. Entities are decoded by the parser (convert_charrefs)."""
+
+    def __init__(self, drop_quotes: bool = False):
+        super().__init__(convert_charrefs=True)
+        self.drop_quotes = drop_quotes
+        self.out = []
+        self.skip_depth = 0    # inside script/style/head...
+        self.quote_depth = 0   # inside blockquote / quote container
+        self.stack = []        # (tag, opened_skip, opened_quote) for non-void tags
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _BLOCK_TAGS:
+            self.out.append("\n")
+        if tag in _VOID_TAGS:
+            return
+        classes = dict(attrs).get("class") or ""
+        skip = tag in _SKIP_TAGS
+        quote = self.drop_quotes and (tag == "blockquote" or any(c in classes for c in _QUOTE_CLASSES))
+        self.skip_depth += skip
+        self.quote_depth += quote
+        self.stack.append((tag, skip, quote))
+
+    def handle_endtag(self, tag):
+        if tag in _VOID_TAGS:
+            return
+        # Pop up to the matching open tag; tolerates unclosed <p>/<li> in real-world mail HTML.
+        for i in range(len(self.stack) - 1, -1, -1):
+            if self.stack[i][0] == tag:
+                for _, skip, quote in self.stack[i:]:
+                    self.skip_depth -= skip
+                    self.quote_depth -= quote
+                del self.stack[i:]
+                break
+        if tag in _BLOCK_TAGS:
+            self.out.append("\n")
+
+    def handle_data(self, data):
+        if not self.skip_depth and not self.quote_depth:
+            self.out.append(data)
+
+    def text(self):
+        return "".join(self.out)
+
+
+def html_to_text(html: str, drop_quotes: bool = False) -> str:
+    parser = _HTMLToText(drop_quotes)
+    parser.feed(html)
+    parser.close()
+    return parser.text()
+
+
+def _decode(data: str) -> str:
+    return base64.urlsafe_b64decode(data.encode("UTF-8")).decode("utf-8", errors="replace")
+
+
+def _is_attachment(part) -> bool:
+    return bool(part.get("filename")) or "attachmentId" in part.get("body", {})
+
+
+def _collect_text_parts(payload, plain: List[str], html: List[str]):
+    """
+    Depth-first walk over inline text/plain and text/html parts (attachments are handled by
+    the OCR/extract path; other text/* types such as text/calendar are not body text).
+    """
+    mime = payload.get("mimeType", "")
+    if payload.get("parts"):
+        for part in payload["parts"]:
+            _collect_text_parts(part, plain, html)
+        return
+    if _is_attachment(payload) or not payload.get("body", {}).get("data"):
+        return
+    if mime == "text/html":
+        html.append(_decode(payload["body"]["data"]))
+    elif mime == "text/plain":
+        plain.append(_decode(payload["body"]["data"]))
+
+
+def pick_best_alternative(payload) -> Tuple[str, str]:
+    """
+    Return (raw_text, mime_type) for the most useful body of a Gmail payload.
+    text/plain wins unless it is missing or a stub next to a real HTML alternative.
+    """
+    plain, html = [], []
+    _collect_text_parts(payload or {}, plain, html)
+    # first part of each kind: later ones are forwarded/attached messages, not this body
+    plain_text = plain[0].strip() if plain else ""
+    html_text = html[0] if html else ""
+    if plain_text and (len(plain_text) >= MIN_PLAIN_CHARS or len(html_text) < 4 * MIN_PLAIN_CHARS):
+        return plain_text, "text/plain"
+    if html_text:
+        return html_text, "text/html"
+    return plain_text, "text/plain"
+
+
+def strip_quoted(text: str) -> str:
+    """Drop quoted history: everything after a reply header, plus '>'-prefixed lines."""
+    match = _QUOTE_HEADER.search(text)
+    if match:
+        text = text[:match.start()]
+    return _QUOTED_LINE.sub("", text)
+
+
+def strip_signature(text: str) -> str:
+    match = _SIGNATURE.search(text)
+    return text[:match.start()] if match else text
+
+
+def collapse_whitespace(text: str) -> str:
+    text = _SPACES.sub(" ", text)
+    text = "\n".join(line.strip() for line in text.split("\n"))
+    return _BLANK_LINES.sub("\n\n", text).strip()
+
+
+def body_text(payload) -> str:
+    """Best alternative as readable text (HTML converted), quotes and signature kept."""
+    raw, mime = pick_best_alternative(payload)
+    if mime == "text/html":
+        raw = html_to_text(raw)
+    return collapse_whitespace(raw)
+
+
+def normalize_text(text: str, is_html: Optional[bool] = None) -> str:
+    """
+    Normalize a body string. is_html=None sniffs for markup.
+    If stripping quotes leaves nothing (a bare forward), the unstripped text is kept instead.
+    """
+    if is_html is None:
+        is_html = bool(_HTML_SNIFF.search(text[:2000]))
+    plain = html_to_text(text, drop_quotes=True) if is_html else text
+    result = collapse_whitespace(strip_signature(strip_quoted(plain)))
+    if result:
+        return result
+    return collapse_whitespace(html_to_text(text) if is_html else text)
+
+
+def normalize_body(payload) -> str:
+    """Gmail payload → text ready for embedding / prompting."""
+    raw, mime = pick_best_alternative(payload)
+    return normalize_text(raw, is_html=mime == "text/html")
+
+
+def normalize_bodies(payloads) -> List[str]:
+    """normalize_body over a batch; identical bodies are normalized once."""
+    done = {}
+    out = []
+    for payload in payloads:
+        key = pick_best_alternative(payload)
+        if key not in done:
+            done[key] = normalize_text(key[0], is_html=key[1] == "text/html")
+        out.append(done[key])
+    return out
+
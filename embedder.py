@@ -1,19 +1,25 @@
 # embedder.py
 from typing import List
-import requests
+
+from ollama_client import OllamaClient, HostPool, get_client
+from tracing import span
+
 
 class OllamaEmbedder:
     """
     Simple Ollama embeddings client.
     Requires: ollama pull nomic-embed-text
-    Ollama must be running (http://localhost:11434)
+    Ollama must be running (http://localhost:11434, or set OLLAMA_HOST / OLLAMA_HOSTS)
+    Requests go through the shared ollama_client (pooled connections, retries, circuit breaker);
+    host pins this embedder to a single server instead.
     """
-    def __init__(self, host: str = "http://localhost:11434", model: str = "nomic-embed-text"):
-        self.host = host.rstrip("/")
+    def __init__(self, host: str = None, model: str = "nomic-embed-text"):
+        self.client = OllamaClient(HostPool([host])) if host else get_client()
+        self.host = self.client.pool.hosts[0]
         self.model = model
 
     def embed(self, text: str) -> List[float]:
-        url = f"{self.host}/api/embeddings"
-        r = requests.post(url, json={"model": self.model, "prompt": text}, timeout=60)
-        r.raise_for_status()
-        return r.json()["embedding"]
+        with span("ollama.embed", **{"llm.model": self.model, "input.bytes": len(text.encode("utf-8"))}) as s:
+            embedding = self.client.embed(text, self.model)
+            s.set_attribute("embedding.dim", len(embedding))
+        return embedding
@@ -0,0 +1,126 @@
+# gmail_client.py
+"""
+Shared authenticated Gmail client used by every script.
+
+- One token format: token.json holds authorized-user JSON. Old pickle tokens written by
+  earlier versions of read_gmail_to_milvus.py are migrated on first load.
+- Credentials are loaded once per process and refreshed proactively (a few minutes before
+  expiry) under a lock; the refreshed token is written back so the next run starts valid.
+- The Gmail discovery document is parsed once per process (the copy bundled with
+  google-api-python-client, so no network round trip).
+- Each thread gets its own service object over a keep-alive HTTP connection:
+  googleapiclient/httplib2 objects are not thread-safe, but they are cheap to reuse.
+"""
+
+import datetime
+import json
+import os
+import pickle
+import threading
+
+# google-auth / oauthlib / googleapiclient are imported inside the functions that need them,
+# so importing this module (and every script that uses it) stays cheap.
+
+SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
+# Writing reply drafts (draft_writer.py) additionally needs gmail.compose; the first run with
+# these scopes re-runs the OAuth consent and the wider token then serves both.
+COMPOSE_SCOPES = SCOPES + ['https://www.googleapis.com/auth/gmail.compose']
+
+TOKEN_PATH = os.environ.get("GMAIL_TOKEN", "token.json")
+CREDENTIALS_PATH = os.environ.get("GMAIL_CREDENTIALS", "credentials.json")
+DISCOVERY_URL = "https://gmail.googleapis.com/$discovery/rest?version=v1"
+
+REFRESH_MARGIN = datetime.timedelta(minutes=5)
+HTTP_TIMEOUT = 60
+
+_lock = threading.RLock()
+_creds = None
+_discovery = None
+_local = threading.local()
+
+
+def _load_token():
+    from google.oauth2.credentials import Credentials
+    if not os.path.exists(TOKEN_PATH):
+        return None
+    try:
+        # No scopes argument: keep the scopes recorded in the file so has_scopes() is meaningful
+        return Credentials.from_authorized_user_file(TOKEN_PATH)
+    except (ValueError, UnicodeDecodeError):
+        pass
+    # Legacy pickle token → rewrite it in the JSON format
+    with open(TOKEN_PATH, 'rb') as f:
+        creds = pickle.load(f)
+    _save_token(creds)
+    print("🔁 Migrated pickle token.json to JSON format")
+    return creds
+
+
+def _save_token(creds):
+    tmp = TOKEN_PATH + ".tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(creds.to_json())
+    os.replace(tmp, TOKEN_PATH)
+
+
+def _needs_refresh(creds) -> bool:
+    if not creds.valid:
+        return True
+    if creds.expiry is None:
+        return False
+    # google-auth keeps expiry as a naive UTC datetime
+    return creds.expiry - datetime.datetime.utcnow() < REFRESH_MARGIN
+
+
+def get_credentials(scopes=SCOPES):
+    """Return process-wide credentials, running the OAuth flow only when there is no usable token."""
+    global _creds
+    with _lock:
+        creds = _creds
+        if creds is None or not creds.has_scopes(scopes):
+            creds = _load_token()
+            if creds is not None and not creds.has_scopes(scopes):
+                creds = None  # token was granted for fewer scopes; ask again
+        if creds is not None and creds.refresh_token and _needs_refresh(creds):
+            from google.auth.transport.requests import Request
+            creds.refresh(Request())
+            _save_token(creds)
+        if creds is None or not creds.valid:
+            from google_auth_oauthlib.flow import InstalledAppFlow
+            flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_PATH, scopes)
+            creds = flow.run_local_server(port=0)
+            _save_token(creds)
+        _creds = creds
+        return creds
+
+
+def _discovery_document():
+    global _discovery
+    with _lock:
+        if _discovery is None:
+            from googleapiclient.discovery_cache import get_static_doc
+            doc = get_static_doc("gmail", "v1")
+            if doc is None:
+                import requests
+                doc = requests.get(DISCOVERY_URL, timeout=HTTP_TIMEOUT).text
+            _discovery = json.loads(doc)
+        return _discovery
+
+
+def get_gmail_service(scopes=SCOPES):
+    """
+    Return this thread's Gmail API service, building it on first use.
+    Safe to call per request: after the first call it only checks the token expiry.
+    """
+    import google_auth_httplib2
+    import httplib2
+    from googleapiclient.discovery import build_from_document
+
+    creds = get_credentials(scopes)
+    service = getattr(_local, "service", None)
+    if service is None or _local.creds is not creds:
+        http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+        service = build_from_document(_discovery_document(), http=http)
+        _local.service = service
+        _local.creds = creds
+    return service
@@ -0,0 +1,240 @@
+# gmail_push.py
+"""
+Push-driven ingestion: Gmail users.watch → Pub/Sub push → POST /gmail/push (ollamaconnect.py)
+→ history delta since the last seen historyId → extract → embed → index.
+
+Only INBOX messages added since the previous notification are fetched, so a notification costs
+one history.list call plus one messages.get per new email instead of re-listing the mailbox.
+Sent mail and drafts (including the snapshots draft_writer.py saves while a reply streams) are
+never indexed. If the stored historyId has expired, INBOX is re-listed since the last
+successful sync; messages already in the vector store are skipped, so a notification that
+failed half-way can simply be processed again.
+
+Usage:
+    python gmail_push.py watch --topic projects/<project>/topics/<topic>   # (re)start the watch, ~weekly
+    python gmail_push.py publish --history-id 12345                        # local stand-in for Pub/Sub
+"""
+
+import argparse
+import base64
+import json
+import os
+import threading
+import time
+
+from tracing import span, current_traceparent
+
+DEFAULT_CURSOR = "data/gmail_history.json"
+PUSH_URL = "http://127.0.0.1:8000/gmail/push"
+SKIP_LABELS = {"DRAFT", "SENT"}
+RESYNC_MAX = 500  # messages re-listed when the history cursor has expired
+
+
+class HistoryCursor:
+    """Persists the last processed Gmail historyId and when it was saved."""
+
+    def __init__(self, path: str = DEFAULT_CURSOR):
+        self.path = path
+
+    def _read(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def load(self):
+        return self._read().get("historyId")
+
+    def updated(self):
+        """Unix time of the last save (None for cursors written before it was recorded)."""
+        return self._read().get("updated")
+
+    def save(self, history_id):
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"historyId": str(history_id), "updated": int(time.time())}, f)
+        os.replace(tmp, self.path)
+
+
+def start_watch(service, topic_name: str, label_ids=("INBOX",), cursor: HistoryCursor = None):
+    """Register (or renew) the mailbox watch. Watches expire after 7 days."""
+    resp = service.users().watch(userId="me", body={
+        "topicName": topic_name,
+        "labelIds": list(label_ids),
+        "labelFilterBehavior": "INCLUDE",
+    }).execute()
+    cursor = cursor or HistoryCursor()
+    if cursor.load() is None:
+        cursor.save(resp["historyId"])
+    return resp
+
+
+def fetch_new_message_ids(service, start_history_id, label_id: str = "INBOX"):
+    """
+    Return (message_ids, latest_history_id) for messages added to label_id after
+    start_history_id; drafts and sent mail are left out.
+    Raises googleapiclient.errors.HttpError 404 if start_history_id is too old.
+    """
+    ids, seen = [], set()
+    latest = start_history_id
+    page_token = None
+    while True:
+        with span("gmail.history.list", **{"gmail.history_id": str(start_history_id)}):
+            resp = service.users().history().list(
+                userId="me", startHistoryId=start_history_id, historyTypes=["messageAdded"],
+                labelId=label_id, pageToken=page_token).execute()
+        for record in resp.get("history", []):
+            for added in record.get("messagesAdded", []):
+                msg_id = added["message"]["id"]
+                if SKIP_LABELS.intersection(added["message"].get("labelIds", [])):
+                    continue
+                if msg_id not in seen:
+                    seen.add(msg_id)
+                    ids.append(msg_id)
+        latest = resp.get("historyId", latest)
+        page_token = resp.get("nextPageToken")
+        if not page_token:
+            return ids, latest
+
+
+def resync_message_ids(service, since_ts=None, label_id: str = "INBOX", max_results: int = RESYNC_MAX):
+    """
+    Full listing fallback for an expired historyId: ids of label_id messages received after
+    since_ts (unix seconds; everything when None), newest first, at most max_results.
+    """
+    ids, page_token = [], None
+    query = f"after:{int(since_ts)}" if since_ts else None
+    while len(ids) < max_results:
+        with span("gmail.list", **{"gmail.label": label_id}):
+            resp = service.users().messages().list(
+                userId="me", labelIds=[label_id], q=query, maxResults=min(100, max_results - len(ids)),
+                pageToken=page_token).execute()
+        ids.extend(m["id"] for m in resp.get("messages", []))
+        page_token = resp.get("nextPageToken")
+        if not page_token:
+            break
+    return ids
+
+
+def decode_push_envelope(envelope: dict) -> dict:
+    """Pub/Sub push body → {"emailAddress": ..., "historyId": ...}"""
+    data = envelope["message"]["data"]
+    return json.loads(base64.b64decode(data).decode("utf-8"))
+
+
+def encode_push_envelope(email_address: str, history_id, message_id: str = "local-1") -> dict:
+    """Build the body Pub/Sub would POST for a Gmail notification."""
+    data = json.dumps({"emailAddress": email_address, "historyId": int(history_id)})
+    return {
+        "message": {"data": base64.b64encode(data.encode("utf-8")).decode("ascii"), "messageId": message_id},
+        "subscription": "projects/local/subscriptions/gmail-push",
+    }
+
+
+class PushIngestor:
+    """
+    Handles Gmail notifications. Clients are created once and reused; notifications are
+    processed one at a time so the history cursor only moves forward.
+    reply_queue (a reply_service.ReplyJobQueue) is optional; new INBOX messages are queued for drafting.
+    dedup (a dedup.NearDuplicateIndex) is optional; near-duplicates are recorded but not embedded.
+    """
+
+    def __init__(self, service, embedder, store, cursor: HistoryCursor = None, reply_queue=None,
+                 dedup=None):
+        self.service = service
+        self.embedder = embedder
+        self.store = store
+        self.cursor = cursor or HistoryCursor()
+        self.reply_queue = reply_queue
+        self.dedup = dedup
+        self._lock = threading.Lock()
+
+    def handle_notification(self, history_id) -> int:
+        from googleapiclient.errors import HttpError
+        from read_gmail_to_milvus import parse_messages, index_email
+
+        with span("gmail.push", **{"gmail.history_id": str(history_id)}) as trace_span, self._lock:
+            start = self.cursor.load()
+            if start is None:
+                # First notification: nothing to diff against yet, just remember where we are.
+                self.cursor.save(history_id)
+                return 0
+            if int(history_id) <= int(start):
+                return 0  # duplicate or out-of-order delivery, already covered
+
+            try:
+                ids, latest = fetch_new_message_ids(self.service, start)
+            except HttpError as e:
+                if e.resp.status != 404:
+                    raise
+                since = self.cursor.updated()
+                since = since - 3600 if since else None  # an hour of overlap; stored ids are skipped
+                print(f"⚠️ historyId {start} expired; re-listing INBOX since {since or 'the beginning'}")
+                ids, latest = resync_message_ids(self.service, since), history_id
+
+            # A notification that failed half-way is processed again in full: skip what it stored.
+            stored = self.store.existing_message_ids(ids)
+            indexed = 0
+            msg_datas = []
+            for msg_id in ids:
+                if msg_id in stored:
+                    continue
+                try:
+                    with span("gmail.get", **{"gmail.message_id": msg_id}):
+                        msg_data = self.service.users().messages().get(userId="me", id=msg_id).execute()
+                except HttpError as e:
+                    if e.resp.status == 404:
+                        continue  # deleted before we got to it
+                    raise
+                if not SKIP_LABELS.intersection(msg_data.get("labelIds", [])):
+                    msg_datas.append(msg_data)
+            try:
+                for email in parse_messages(msg_datas):
+                    indexed += index_email(email, self.embedder, self.store, self.dedup)
+                    if self.reply_queue is not None and "INBOX" in email["labels"]:
+                        self.reply_queue.enqueue(email["id"])
+            finally:
+                if self.dedup is not None:
+                    self.dedup.save()  # keep representatives stored before a failure
+            self.cursor.save(max(int(latest), int(history_id)))
+            trace_span.set_attributes(**{"push.messages": len(ids), "push.indexed": indexed})
+            print(f"📬 Push: indexed {indexed} new message(s) up to historyId {latest}")
+            return indexed
+
+
+def publish(history_id, email_address: str = "me@example.com", url: str = PUSH_URL):
+    """Local stand-in for Pub/Sub: POST one notification to the push endpoint."""
+    import requests
+    with span("gmail.publish", **{"gmail.history_id": str(history_id)}):
+        traceparent = current_traceparent()
+        headers = {"traceparent": traceparent} if traceparent else {}
+        r = requests.post(url, json=encode_push_envelope(email_address, history_id), headers=headers,
+                          timeout=10)
+    r.raise_for_status()
+    return r.status_code
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gmail push notification helpers")
+    sub = parser.add_subparsers(dest="command", required=True)
+    w = sub.add_parser("watch", help="start or renew users.watch on the inbox")
+    w.add_argument("--topic", required=True, help="projects/<project>/topics/<topic>")
+    p = sub.add_parser("publish", help="send a fake Pub/Sub push to the local endpoint")
+    p.add_argument("--history-id", required=True)
+    p.add_argument("--email", default="me@example.com")
+    p.add_argument("--url", default=PUSH_URL)
+    args = parser.parse_args(argv)
+
+    if args.command == "watch":
+        from gmail_client import get_gmail_service
+        resp = start_watch(get_gmail_service(), args.topic)
+        print(f"👀 Watching inbox: historyId={resp['historyId']} expiration={resp['expiration']}")
+    else:
+        status = publish(args.history_id, args.email, args.url)
+        print(f"📤 Published historyId={args.history_id} → {args.url} ({status})")
+
+
+if __name__ == "__main__":
+    main()
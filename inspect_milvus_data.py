@@ -1,25 +1,251 @@
 # inspect_milvus_data.py
-from pymilvus import connections, Collection
-
-# Step 1: Connect to Milvus
-connections.connect("default", host="127.0.0.1", port="19530")
-print("✅ Connected to Milvus")
-
-# Step 2: Load your collection
-collection_name = "gmail_emails"
-col = Collection(collection_name)
-col.load()
-
-# Step 3: Get collection stats
-stats = col.num_entities
-print(f"📊 Total entities (rows) stored: {stats}")
-
-# Step 4: Optionally show one or two entries
-print("\n🔍 Fetching a few stored emails...")
-data = col.query(expr="", output_fields=["subject", "from_email", "body"], limit=3)
-
-for i, doc in enumerate(data, start=1):
-    print(f"\n📧 Email #{i}")
-    print(f"  Subject: {doc['subject']}")
-    print(f"  From: {doc['from_email']}")
-    print(f"  Body: {doc['body'][:200]}...")  # show first 200 chars only
+"""
+Inspection / health tool for the email vector store (built on vector_store.GmailVectorStore;
+--backend local works too, minus the Milvus-only segment and index details).
+
+    python inspect_milvus_data.py summary                 # rows, segments, indexes, memory, sample rows
+    python inspect_milvus_data.py export --out emails.jsonl [--with-embeddings]
+    python inspect_milvus_data.py export --out emails.parquet --batch-size 2000   # needs pyarrow
+    python inspect_milvus_data.py duplicates              # duplicate message ids / bodies
+    python inspect_milvus_data.py probe --queries 50      # search latency p50/p99
+
+Full scans page through the collection with a query iterator, so client memory stays at one
+batch. Milvus can only serve queries from a loaded collection: commands that need it refuse
+to run on an unloaded one unless --load is given, and then release it again afterwards.
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import statistics
+import sys
+import time
+from contextlib import contextmanager
+
+from vector_store import OUTPUT_FIELDS, open_vector_store
+
+SMALL_SEGMENT_RATIO = 0.25  # segments under 25% of the largest one count as fragments
+
+
+@contextmanager
+def serving(store, allow_load: bool):
+    """Make sure the collection can answer queries; release it afterwards if we loaded it."""
+    if not hasattr(store, "loaded") or store.loaded():
+        yield
+        return
+    if not allow_load:
+        sys.exit("❌ Collection is not loaded; pass --load to load it for this command (released afterwards)")
+    from pymilvus import Collection
+    from vector_store import COLLECTION
+    col = Collection(COLLECTION)
+    print("⏳ Loading collection...")
+    col.load()
+    try:
+        yield
+    finally:
+        col.release()
+        print("📤 Released collection")
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))]
+
+
+def segment_report(stats: dict) -> dict:
+    segments = stats.get("segments") or []
+    if not segments:
+        return {}
+    rows = [s["rows"] for s in segments]
+    largest = max(rows) or 1
+    return {
+        "segments": len(segments),
+        "growing": sum("growing" in s["state"].lower() for s in segments),
+        "rows_min": min(rows), "rows_median": statistics.median(rows), "rows_max": largest,
+        "small_segments": sum(r < SMALL_SEGMENT_RATIO * largest for r in rows),
+        "mem_bytes": sum(s["mem_bytes"] or 0 for s in segments),
+    }
+
+
+def raw_vector_bytes(stats: dict) -> int:
+    """rows × dim float32: the embeddings alone, not index structures or scalar fields."""
+    return stats["rows"] * (stats.get("dim") or 0) * 4
+
+
+def _mb(n):
+    return f"{n / 1e6:,.1f} MB"
+
+
+def cmd_summary(store, args):
+    stats = store.stats()
+    report = {"stats": stats, "segment_report": segment_report(stats), "raw_vector_bytes": raw_vector_bytes(stats)}
+    if args.json:
+        print(json.dumps(report, indent=2, default=str))
+        return report
+
+    print(f"📊 {stats['backend']}: {stats['rows']:,} rows, dim {stats.get('dim')}")
+    print(f"   raw float32 vectors {_mb(report['raw_vector_bytes'])} (excluding index and scalar fields)")
+    for index in stats.get("indexes", []):
+        state = "✅ built" if not index["pending_rows"] and index["indexed_rows"] == index["total_rows"] \
+            else f"⏳ {index['indexed_rows']}/{index['total_rows']} rows indexed"
+        print(f"   index {index['name']:<20} {index['field']:<14} {index['type'] or '':<10} {state}")
+    seg = report["segment_report"]
+    if seg:
+        print(f"🧩 {seg['segments']} loaded segments ({seg['growing']} growing), rows/segment "
+              f"min {seg['rows_min']:,} / median {seg['rows_median']:,.0f} / max {seg['rows_max']:,}; "
+              f"{seg['small_segments']} small; memory {_mb(seg['mem_bytes'])}")
+        if seg["segments"] > 1 and seg["small_segments"] > seg["segments"] / 2:
+            print("⚠️ Mostly small segments: the collection is fragmented (compaction would help)")
+    elif stats["backend"] == "milvus":
+        print("🧩 Segment details need a loaded collection (summary --load)")
+    else:
+        print(f"💾 on disk: vectors {_mb(stats['vector_bytes'])}, metadata {_mb(stats['metadata_bytes'])}")
+
+    if stats["rows"] and (stats["backend"] != "milvus" or stats["loaded"]):
+        print("\n🔍 A few stored emails:")
+        page = next(store.iter_batches(batch_size=3, output_fields=["subject", "from_email", "body"]), [])
+        for i, doc in enumerate(page[:3], start=1):
+            print(f"\n📧 Email #{i}")
+            print(f"  Subject: {doc['subject']}")
+            print(f"  From: {doc['from_email']}")
+            print(f"  Body: {doc['body'][:200]}...")  # show first 200 chars only
+    return report
+
+
+def cmd_export(store, args):
+    fmt = args.format or ("parquet" if args.out.endswith(".parquet") else "jsonl")
+    fields = list(OUTPUT_FIELDS) + (["embedding"] if args.with_embeddings else [])
+    if os.path.dirname(args.out):
+        os.makedirs(os.path.dirname(args.out), exist_ok=True)
+    rows, start = 0, time.perf_counter()
+    batches = store.iter_batches(batch_size=args.batch_size, output_fields=fields)
+    if fmt == "parquet":
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            sys.exit("❌ Parquet export needs pyarrow (pip install pyarrow) — or use --format jsonl")
+        writer = None
+        try:
+            for page in batches:
+                table = pa.Table.from_pylist(page, schema=writer.schema if writer else None)
+                if writer is None:
+                    writer = pq.ParquetWriter(args.out, table.schema, compression="zstd")
+                writer.write_table(table)
+                rows += len(page)
+        finally:
+            if writer is not None:
+                writer.close()
+    else:
+        with open(args.out, "w", encoding="utf-8") as f:
+            for page in batches:
+                f.writelines(json.dumps(row, ensure_ascii=False) + "\n" for row in page)
+                rows += len(page)
+    elapsed = time.perf_counter() - start
+    print(f"📝 Exported {rows:,} rows to {args.out} ({fmt}) in {elapsed:.1f}s")
+    return {"rows": rows, "seconds": elapsed}
+
+
+def cmd_duplicates(store, args):
+    seen_ids, seen_bodies = set(), set()
+    report = {"rows": 0, "duplicate_message_ids": 0, "duplicate_bodies": 0, "empty_bodies": 0,
+              "missing_message_ids": 0}
+    for page in store.iter_batches(batch_size=args.batch_size, output_fields=["message_id", "body"]):
+        for row in page:
+            report["rows"] += 1
+            msg_id = row.get("message_id") or ""
+            if not msg_id:
+                report["missing_message_ids"] += 1
+            elif msg_id in seen_ids:
+                report["duplicate_message_ids"] += 1
+            else:
+                seen_ids.add(msg_id)
+            body = " ".join((row.get("body") or "").lower().split())
+            if not body:
+                report["empty_bodies"] += 1
+                continue
+            digest = hashlib.blake2b(body.encode("utf-8"), digest_size=8).digest()
+            if digest in seen_bodies:
+                report["duplicate_bodies"] += 1
+            else:
+                seen_bodies.add(digest)
+    if os.path.exists(args.dedup_index):
+        from dedup import NearDuplicateIndex
+        report["near_duplicates_skipped_at_ingest"] = NearDuplicateIndex(args.dedup_index).stats()["collapsed"]
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"🔁 {report['rows']:,} rows: {report['duplicate_message_ids']:,} re-inserted message ids, "
+              f"{report['duplicate_bodies']:,} exact duplicate bodies, {report['empty_bodies']:,} empty bodies, "
+              f"{report['missing_message_ids']:,} rows without message id")
+        if "near_duplicates_skipped_at_ingest" in report:
+            print(f"♻️ {report['near_duplicates_skipped_at_ingest']:,} near-duplicates were skipped at ingest "
+                  f"({args.dedup_index})")
+    return report
+
+
+def cmd_probe(store, args):
+    queries = []
+    for page in store.iter_batches(batch_size=args.queries, output_fields=["embedding"]):
+        queries = [row["embedding"] for row in page]
+        break
+    if not queries:
+        sys.exit("❌ The collection is empty; nothing to probe with")
+    store.search_similar(queries[0], limit=args.limit)  # warm-up
+    latencies = []
+    for q in queries:
+        t0 = time.perf_counter()
+        store.search_similar(q, limit=args.limit)
+        latencies.append(time.perf_counter() - t0)
+    report = {"queries": len(latencies), "limit": args.limit,
+              "p50_ms": round(_percentile(latencies, 50) * 1000, 3),
+              "p99_ms": round(_percentile(latencies, 99) * 1000, 3),
+              "mean_ms": round(statistics.mean(latencies) * 1000, 3)}
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"⏱️ {report['queries']} searches (top-{args.limit}): p50 {report['p50_ms']:.2f} ms, "
+              f"p99 {report['p99_ms']:.2f} ms, mean {report['mean_ms']:.2f} ms")
+    return report
+
+
+COMMANDS = {"summary": cmd_summary, "export": cmd_export, "duplicates": cmd_duplicates, "probe": cmd_probe}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect the email vector store: stats, export, duplicates, latency")
+    parser.add_argument("--backend", default=None, help="milvus (default, or VECTOR_BACKEND) or local")
+    parser.add_argument("--load", action="store_true", help="load an unloaded collection for this command")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    sub = parser.add_subparsers(dest="command")
+    sub.add_parser("summary", help="rows, segments, index build state, memory, sample rows")
+    export = sub.add_parser("export", help="stream every row to JSONL or Parquet")
+    export.add_argument("--out", required=True)
+    export.add_argument("--format", choices=["jsonl", "parquet"], default=None, help="default: from --out extension")
+    export.add_argument("--batch-size", type=int, default=1000)
+    export.add_argument("--with-embeddings", action="store_true")
+    dup = sub.add_parser("duplicates", help="duplicate message ids and bodies")
+    dup.add_argument("--batch-size", type=int, default=1000)
+    dup.add_argument("--dedup-index", default="data/dedup_index.json")
+    probe = sub.add_parser("probe", help="search latency with stored vectors as queries")
+    probe.add_argument("--queries", type=int, default=20)
+    probe.add_argument("--limit", type=int, default=3)
+    args = parser.parse_args(argv)
+    command = args.command or "summary"
+
+    try:
+        store = open_vector_store(args.backend, create=False)  # read-only: never create an empty store
+    except LookupError as e:
+        sys.exit(f"❌ {e}")
+    if command == "summary":
+        cmd_summary(store, args)  # works on an unloaded collection (segments need --load)
+        return
+    with serving(store, args.load):
+        COMMANDS[command](store, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+# local_vector_store.py
+"""
+In-process vector backend: a drop-in alternative to GmailVectorStore for a single
+mailbox, tests and offline runs (no Milvus server needed).
+
+Storage layout under `path`:
+- vectors.f32     append-only float32 matrix (one L2-normalised row per email), memory-mapped
+- metadata.jsonl  append-only, one JSON object per row (same fields as the Milvus schema)
+- .lock           OS file lock: appends and crash recovery are exclusive, so several processes
+                  (push ingest, reply service, pregen, cron ingest) can share one store
+
+Every instance follows rows appended by other processes: reads pick up the new tail of
+metadata.jsonl before they run.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from tracing import span
+from vector_store import VectorStoreBackend, sender_domain_of, sender_email_of
+
+
+@contextmanager
+def _file_lock(path: str, shared: bool = False):
+    """Hold an OS lock on path (shared for readers where the platform supports it)."""
+    with open(path, "a+b") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _read_rows(path: str, offset: int):
+    """Complete JSON lines of path from byte offset on, and the offset after the last one."""
+    if not os.path.exists(path) or os.path.getsize(path) <= offset:
+        return [], offset
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read()
+    end = data.rfind(b"\n") + 1  # a line still being written is left for the next read
+    rows = [json.loads(line) for line in data[:end].decode("utf-8").splitlines() if line.strip()]
+    return rows, offset + end
+
+
+class LocalHit:
+    """Search hit with the same surface as a pymilvus Hit (.id, .distance, .entity.get)."""
+
+    def __init__(self, id: int, distance: float, entity: dict):
+        self.id = id
+        self.distance = distance
+        self.entity = entity
+
+    def __repr__(self):
+        return f"LocalHit(id={self.id}, distance={self.distance:.4f}, subject={self.entity.get('subject')!r})"
+
+
+class LocalVectorStore(VectorStoreBackend):
+    def __init__(self, dim: int = 768, path: str = "data/local_vectors", create: bool = True):
+        self.dim = dim
+        self.path = path
+        self.vec_path = os.path.join(path, "vectors.f32")
+        self.meta_path = os.path.join(path, "metadata.jsonl")
+        if not create and not os.path.exists(self.meta_path):
+            raise LookupError(f"Local vector store '{path}' does not exist")
+        os.makedirs(path, exist_ok=True)
+        self.lock_path = os.path.join(path, ".lock")
+
+        # Vectors are written before metadata, so after a crash the vector file may hold a
+        # trailing row (or partial row) without metadata: trim both to the common length.
+        # Writers hold the file lock for both appends, so under it only crash leftovers remain.
+        with _file_lock(self.lock_path):
+            self.meta, self._meta_offset = _read_rows(self.meta_path, 0)
+            row_bytes = 4 * dim
+            vec_rows = os.path.getsize(self.vec_path) // row_bytes if os.path.exists(self.vec_path) else 0
+            n = min(vec_rows, len(self.meta))
+            if os.path.exists(self.vec_path) and os.path.getsize(self.vec_path) != n * row_bytes:
+                with open(self.vec_path, "r+b") as f:
+                    f.truncate(n * row_bytes)
+            meta_size = os.path.getsize(self.meta_path) if os.path.exists(self.meta_path) else 0
+            if len(self.meta) != n or meta_size != self._meta_offset:
+                self.meta = self.meta[:n]
+                with open(self.meta_path, "w", encoding="utf-8") as f:
+                    f.writelines(json.dumps(m, ensure_ascii=False) + "\n" for m in self.meta)
+                self._meta_offset = os.path.getsize(self.meta_path)
+
+        self._dirty = True
+        self._lock = threading.Lock()  # inserts append to two files; searches re-map after inserts
+        print(f"✅ Opened local vector store: {path} ({n} emails)")
+
+    def _sync(self, file_locked: bool = False):
+        """Append rows other processes wrote since the last read (caller holds self._lock)."""
+        if os.path.exists(self.meta_path) and os.path.getsize(self.meta_path) > self._meta_offset:
+            if file_locked:
+                rows, self._meta_offset = _read_rows(self.meta_path, self._meta_offset)
+            else:
+                with _file_lock(self.lock_path, shared=True):
+                    rows, self._meta_offset = _read_rows(self.meta_path, self._meta_offset)
+            if rows:
+                self.meta.extend(rows)
+                self._dirty = True
+
+    def __len__(self):
+        with self._lock:
+            self._sync()
+            return len(self.meta)
+
+    @property
+    def cache_key(self):
+        return ("local", os.path.abspath(self.path))
+
+    @property
+    def generation(self):
+        return len(self)  # rows on disk; append-only, so the count changes on every insert
+
+    def _refresh(self):
+        """Re-map the vector file and rebuild the filter columns after inserts."""
+        n = len(self.meta)
+        if n:
+            self.vectors = np.memmap(self.vec_path, dtype=np.float32, mode="r", shape=(n, self.dim))
+        else:
+            self.vectors = np.empty((0, self.dim), dtype=np.float32)
+        self._date_ts = np.fromiter((m["date_ts"] for m in self.meta), dtype=np.int64, count=n)
+        self._thread_id = np.array([m["thread_id"] for m in self.meta], dtype=object)
+        self._sender_domain = np.array([m["sender_domain"] for m in self.meta], dtype=object)
+        # rows written before sender_email was stored get it derived from from_email
+        self._sender_email = np.array([m.get("sender_email") or sender_email_of(m["from_email"])
+                                       for m in self.meta], dtype=object)
+        self._dirty = False
+
+    def insert_email(self, subject: str, from_email: str, body: str, embedding: List[float],
+                     message_id: str = "", thread_id: str = "", rfc_message_id: str = "",
+                     date_ts: int = 0, labels: Optional[Sequence[str]] = None, snippet: str = ""):
+        vec = np.asarray(embedding, dtype=np.float32)
+        if vec.shape != (self.dim,):
+            raise ValueError(f"Expected a {self.dim}-dim embedding, got shape {vec.shape}")
+        norm = np.linalg.norm(vec)
+        if norm > 0:
+            vec = vec / norm
+
+        row = {
+            "id": None,
+            "subject": subject,
+            "from_email": from_email,
+            "body": body,
+            "message_id": message_id,
+            "thread_id": thread_id,
+            "rfc_message_id": rfc_message_id,
+            "sender_domain": sender_domain_of(from_email),
+            "sender_email": sender_email_of(from_email),
+            "date_ts": int(date_ts or 0),
+            "labels": list(labels or []),
+            "snippet": snippet,
+        }
+        with span("vector.insert", **{"db.system": "local", "body.bytes": len(body)}), self._lock:
+            with _file_lock(self.lock_path):
+                self._sync(file_locked=True)  # ids follow rows other processes appended
+                row["id"] = len(self.meta)
+                with open(self.vec_path, "ab") as f:
+                    f.write(vec.tobytes())
+                with open(self.meta_path, "ab") as f:
+                    f.write((json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8"))
+                    self._meta_offset = f.tell()
+            self.meta.append(row)
+            self._dirty = True
+        print(f"📥 Inserted email: {subject[:50]}...")
+
+    def _filter_mask(self, since_days, thread_id, sender_domain, labels):
+        mask = np.ones(len(self.meta), dtype=bool)
+        if since_days is not None:
+            mask &= self._date_ts >= int(time.time() - since_days * 86400)
+        if thread_id:
+            mask &= self._thread_id == thread_id
+        if sender_domain:
+            mask &= self._sender_domain == sender_domain.lower()
+        if labels:
+            wanted = set(labels)
+            mask &= np.fromiter((not wanted.isdisjoint(m["labels"]) for m in self.meta),
+                                dtype=bool, count=len(self.meta))
+        return mask
+
+    def search_similar(self, query_embedding: List[float], limit: int = 3,
+                       since_days: Optional[float] = None, thread_id: Optional[str] = None,
+                       sender_domain: Optional[str] = None, labels: Optional[Sequence[str]] = None,
+                       expr: Optional[str] = None):
+        """
+        Cosine top-k over the rows that pass the filters. Filters are applied first so only
+        candidate rows are read from the memory map; top-k uses argpartition (O(n)) and only
+        the k winners are sorted.
+        """
+        if expr:
+            raise ValueError("Raw Milvus expressions are not supported by the local backend")
+        with span("vector.search", **{"db.system": "local", "search.limit": limit}) as s:
+            with self._lock:
+                self._sync()
+                if self._dirty:
+                    self._refresh()
+                candidates = np.flatnonzero(self._filter_mask(since_days, thread_id, sender_domain, labels))
+                vectors, meta = self.vectors, self.meta
+            if not len(candidates) or limit <= 0:
+                return []
+
+            q = np.asarray(query_embedding, dtype=np.float32)
+            norm = np.linalg.norm(q)
+            if norm > 0:
+                q = q / norm
+            if len(candidates) == len(vectors):
+                scores = vectors @ q
+            else:
+                scores = vectors[candidates] @ q
+
+            k = min(limit, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            s.set_attributes(**{"search.candidates": int(len(candidates)), "search.hits": int(k)})
+        return [LocalHit(int(candidates[i]), float(scores[i]), meta[candidates[i]]) for i in top]
+
+    def count_emails(self, sender: Optional[str] = None, since_days: Optional[float] = None,
+                     thread_id: Optional[str] = None, labels: Optional[Sequence[str]] = None) -> int:
+        addr = sender_email_of(sender)
+        with self._lock:
+            self._sync()
+            if self._dirty:
+                self._refresh()
+            mask = self._filter_mask(since_days, thread_id, None, labels)
+            if addr:
+                mask &= self._sender_email == addr
+            return int(mask.sum())
+
+    def existing_message_ids(self, message_ids: Sequence[str]) -> set:
+        wanted = {m for m in message_ids if m}
+        with self._lock:
+            self._sync()
+            return {m["message_id"] for m in self.meta if m["message_id"] in wanted}
+
+    def iter_batches(self, batch_size: int = 1000, output_fields: Optional[Sequence[str]] = None):
+        with self._lock:
+            self._sync()
+            if self._dirty:
+                self._refresh()
+            vectors, meta = self.vectors, list(self.meta)
+        fields = list(output_fields) if output_fields else None
+        for start in range(0, len(meta), batch_size):
+            page = []
+            for i, row in enumerate(meta[start:start + batch_size], start):
+                row = dict(row, embedding=vectors[i].tolist()) if fields and "embedding" in fields else row
+                page.append({k: row[k] for k in fields if k in row} if fields else dict(row))
+            yield page
+
+    def stats(self) -> dict:
+        def size(p):
+            return os.path.getsize(p) if os.path.exists(p) else 0
+        return {"backend": "local", "path": self.path, "rows": len(self), "dim": self.dim,
+                "vector_bytes": size(self.vec_path), "metadata_bytes": size(self.meta_path)}
@@ -0,0 +1,358 @@
+# ollama_client.py
+"""
+Shared Ollama HTTP client used by embedder.py, smart_reply.py and ollamaconnect.py.
+
+- Pooled keep-alive connections: one requests.Session (sync) per process and one
+  httpx.AsyncClient (async) per event loop, instead of a new connection per call.
+- Retries with jittered exponential backoff on connection errors, timeouts and 5xx replies.
+  Streams are only retried before the first token, so a reply is never duplicated.
+- A circuit breaker per host: after `failure_threshold` consecutive failures the host is
+  skipped for `reset_timeout` seconds, then a single trial request decides whether it is back.
+  With every host open, calls fail immediately with OllamaUnavailable instead of waiting
+  out timeouts.
+- Several hosts (OLLAMA_HOSTS="http://gpu1:11434,http://gpu2:11434"): each request goes to
+  the healthy host with the fewest requests in flight.
+
+    client = get_client()
+    vec = client.embed("text", model="nomic-embed-text")
+    for chunk in client.generate({"model": "mistral:instruct", "prompt": "..."}):
+        print(chunk.get("response", ""), end="")
+"""
+
+import json
+import os
+import random
+import threading
+import time
+import weakref
+
+# requests / httpx are imported on first use so importing this module stays cheap.
+
+RETRY_STATUS = {500, 502, 503, 504}
+
+
+def ollama_host() -> str:
+    """Ollama base URL from OLLAMA_HOST (same variable the Ollama CLI uses), default localhost:11434"""
+    return _normalize(os.environ.get("OLLAMA_HOST", "http://localhost:11434"))
+
+
+def ollama_hosts():
+    """All configured hosts: OLLAMA_HOSTS (comma-separated) or the single OLLAMA_HOST."""
+    hosts = [_normalize(h) for h in os.environ.get("OLLAMA_HOSTS", "").split(",") if h.strip()]
+    return hosts or [ollama_host()]
+
+
+def _normalize(host: str) -> str:
+    host = host.strip()
+    if "://" not in host:
+        host = "http://" + host
+    return host.rstrip("/")
+
+
+class OllamaError(RuntimeError):
+    """Ollama request failed (after retries)."""
+
+
+class OllamaUnavailable(OllamaError):
+    """No host reachable: connection refused, timeouts, or every circuit breaker open."""
+
+
+class CircuitBreaker:
+    """closed → (failure_threshold consecutive failures) → open → (reset_timeout) → half-open → closed/open"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial:
+                self._trial = True  # exactly one probe request while half-open
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+
+class HostPool:
+    """Hosts with their breakers and in-flight counters; shared by the sync and async clients."""
+
+    def __init__(self, hosts=None, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.hosts = [_normalize(h) for h in (hosts or ollama_hosts())]
+        self.breakers = {h: CircuitBreaker(failure_threshold, reset_timeout) for h in self.hosts}
+        self.inflight = {h: 0 for h in self.hosts}
+        self._lock = threading.Lock()
+
+    def acquire(self, exclude=()):
+        """Least-loaded host whose breaker lets a request through (others tried first)."""
+        with self._lock:
+            candidates = sorted(self.hosts, key=lambda h: (h in exclude, self.inflight[h], random.random()))
+        for host in candidates:
+            if self.breakers[host].allow():
+                with self._lock:
+                    self.inflight[host] += 1
+                return host
+        raise OllamaUnavailable(f"Ollama circuit open for all hosts: {', '.join(self.hosts)}")
+
+    def release(self, host, ok: bool):
+        with self._lock:
+            self.inflight[host] -= 1
+        if ok:
+            self.breakers[host].record_success()
+        else:
+            self.breakers[host].record_failure()
+
+    def status(self) -> dict:
+        return {h: {"state": self.breakers[h].state, "inflight": self.inflight[h]} for h in self.hosts}
+
+
+class _Base:
+    def __init__(self, pool: HostPool = None, retries: int = 3, backoff: float = 0.5,
+                 max_backoff: float = 8.0, connect_timeout: float = 10.0, read_timeout: float = 300.0,
+                 pool_size: int = 16):
+        self.pool = pool or HostPool()
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_size = pool_size
+
+    def delay(self, attempt: int) -> float:
+        return min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+class OllamaClient(_Base):
+    """Blocking client (scripts, worker threads). Safe to share between threads."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        with self._session_lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=len(self.pool.hosts), pool_maxsize=self.pool_size)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session = session
+            return self._session
+
+    def request(self, method: str, path: str, stream: bool = False, **kwargs):
+        """
+        Send one request with retries; returns (host, response) with a 2xx status. For
+        stream=True the caller must call finish(host, response, ok) when done reading.
+        """
+        import requests
+        tried, last_error = [], None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.delay(attempt - 1))
+            host = self.pool.acquire(exclude=tried)
+            tried.append(host)
+            try:
+                r = self.session.request(method, host + path, stream=stream,
+                                         timeout=(self.connect_timeout, self.read_timeout), **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.pool.release(host, ok=False)
+                last_error = e
+                continue
+            if r.status_code in RETRY_STATUS:
+                self.pool.release(host, ok=False)
+                last_error = OllamaError(f"{host}{path} returned HTTP {r.status_code}: {r.text[:200]}")
+                r.close()
+                continue
+            if r.status_code >= 400:  # client errors (unknown model, bad payload) are not retried
+                self.pool.release(host, ok=True)
+                message = f"{host}{path} returned HTTP {r.status_code}: {r.text[:200]}"
+                r.close()
+                raise OllamaError(message)
+            if not stream:
+                self.pool.release(host, ok=True)
+            return host, r
+        raise OllamaUnavailable(f"Ollama request failed after {self.retries + 1} attempts: {last_error}")
+
+    def finish(self, host, response, ok: bool = True):
+        response.close()
+        self.pool.release(host, ok)
+
+    def embed(self, text: str, model: str = "nomic-embed-text"):
+        _, r = self.request("POST", "/api/embeddings", json={"model": model, "prompt": text})
+        return r.json()["embedding"]
+
+    def generate(self, payload: dict):
+        """
+        Stream /api/generate: yields each decoded NDJSON chunk. Connection errors are retried
+        (and raised) when this is called; errors after the first chunk raise OllamaError.
+        """
+        host, r = self.request("POST", "/api/generate", stream=True, json=dict(payload, stream=True))
+        return self._iter_chunks(host, r)
+
+    def _iter_chunks(self, host, r):
+        # Only a transport error counts against the host; a consumer that stops early
+        # (break / close() after "done") is a success.
+        import requests
+        failed = False
+        try:
+            for line in r.iter_lines():
+                if line:
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+        except requests.RequestException as e:
+            failed = True
+            raise OllamaError(f"Ollama stream from {host} broke off: {e}") from e
+        finally:
+            self.finish(host, r, ok=not failed)
+
+    def tags(self) -> dict:
+        _, r = self.request("GET", "/api/tags")
+        return r.json()
+
+
+class AsyncOllamaClient(_Base):
+    """asyncio client (FastAPI). One pooled httpx.AsyncClient per event loop."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._clients = weakref.WeakKeyDictionary()
+
+    def _http(self):
+        import asyncio
+        import httpx
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size))
+            self._clients[loop] = client
+        return client
+
+    async def request(self, method: str, path: str, stream: bool = False, **kwargs):
+        """Async twin of OllamaClient.request; for stream=True call finish() when done."""
+        import asyncio
+        import httpx
+        http = self._http()
+        tried, last_error = [], None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self.delay(attempt - 1))
+            host = self.pool.acquire(exclude=tried)
+            tried.append(host)
+            try:
+                r = await http.send(http.build_request(method, host + path, **kwargs), stream=stream)
+            except httpx.TransportError as e:  # connect/read errors and timeouts
+                self.pool.release(host, ok=False)
+                last_error = e
+                continue
+            if r.status_code >= 400:
+                body = (await r.aread()).decode("utf-8", "replace")[:200]
+                await r.aclose()
+                retry = r.status_code in RETRY_STATUS
+                self.pool.release(host, ok=not retry)
+                last_error = OllamaError(f"{host}{path} returned HTTP {r.status_code}: {body}")
+                if retry:
+                    continue
+                raise last_error
+            if not stream:
+                await r.aread()
+                self.pool.release(host, ok=True)
+            return host, r
+        raise OllamaUnavailable(f"Ollama request failed after {self.retries + 1} attempts: {last_error}")
+
+    async def finish(self, host, response, ok: bool = True):
+        await response.aclose()
+        self.pool.release(host, ok)
+
+    async def embed(self, text: str, model: str = "nomic-embed-text"):
+        _, r = await self.request("POST", "/api/embeddings", json={"model": model, "prompt": text})
+        return r.json()["embedding"]
+
+    async def generate(self, payload: dict):
+        """
+        Open a streaming /api/generate (with retries) and return an async iterator of chunks.
+        A consumer that stops before the end must `await chunks.aclose()` to free the connection.
+        """
+        host, r = await self.request("POST", "/api/generate", stream=True, json=dict(payload, stream=True))
+        return self._iter_chunks(host, r)
+
+    async def _iter_chunks(self, host, r):
+        import httpx
+        failed = False
+        try:
+            async for line in r.aiter_lines():
+                if line:
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+        except httpx.HTTPError as e:
+            failed = True
+            raise OllamaError(f"Ollama stream from {host} broke off: {e}") from e
+        finally:
+            await self.finish(host, r, ok=not failed)
+
+    async def complete(self, payload: dict) -> dict:
+        """Non-streaming /api/generate."""
+        _, r = await self.request("POST", "/api/generate", json=dict(payload, stream=False))
+        return r.json()
+
+    async def tags(self) -> dict:
+        _, r = await self.request("GET", "/api/tags")
+        return r.json()
+
+
+_pool = None
+_client = None
+_async_client = None
+_lock = threading.Lock()
+
+
+def get_client() -> OllamaClient:
+    """Process-wide sync client (shares hosts and breaker state with get_async_client)."""
+    global _pool, _client
+    with _lock:
+        if _client is None:
+            _pool = _pool or HostPool()
+            _client = OllamaClient(_pool)
+        return _client
+
+
+def get_async_client() -> AsyncOllamaClient:
+    global _pool, _async_client
+    with _lock:
+        if _async_client is None:
+            _pool = _pool or HostPool()
+            _async_client = AsyncOllamaClient(_pool)
+        return _async_client
@@ -1,14 +1,24 @@
 
 # Enhanced FastAPI with Ollama Streaming Support
 import uvicorn
-import requests
 import json
-from fastapi import FastAPI, HTTPException
+import os
+import threading
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Header, Request, Response
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import asyncio
 
+from gmail_push import decode_push_envelope
+from ollama_client import OllamaError, OllamaUnavailable, get_async_client
+from tracing import span, current_traceparent
+from sse_stream import StreamBuffer, register, lookup, sse_frames
+
 app = FastAPI(title="AI Text Generator with Streaming", description="Generate AI responses using Ollama with streaming support")
+# gzip is negotiated via Accept-Encoding; Starlette leaves text/event-stream uncompressed so
+# SSE frames are not held back in the compressor.
+app.add_middleware(GZipMiddleware, minimum_size=1000)
 
 # Request/Response models
 class PromptRequest(BaseModel):
@@ -17,51 +27,67 @@ class PromptRequest(BaseModel):
     max_tokens: int = 512
     temperature: float = 0.7
     stream: bool = True
+    frame_ms: int = 50          # SSE: max delay before buffered tokens are sent
+    frame_chars: int = 64       # SSE: send early once this many characters are waiting
+    summary: bool = False       # SSE: repeat the full text in the final "done" event
 
 class AIResponse(BaseModel):
     response: str
     model: str
     prompt: str
 
-# Ollama API configuration
-OLLAMA_BASE_URL = "http://localhost:11434"
+# Ollama API configuration: OLLAMA_HOST / OLLAMA_HOSTS, see ollama_client.py
+# (pooled async connections, retries, per-host circuit breaker, load balancing)
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """One span per request, continuing the caller's W3C traceparent header if present"""
+    with span(f"{request.method} {request.url.path}", parent=request.headers.get("traceparent"),
+              **{"http.method": request.method, "http.route": request.url.path}) as s:
+        response = await call_next(request)
+        s.set_attribute("http.status_code", response.status_code)
+        return response
 
 @app.get("/")
 async def root():
     return {"message": "AI Text Generator API is running with streaming support"}
 
-def parse_streaming_response(response):
-    """
-    Generator function to parse streaming JSON responses from Ollama
-    """
-    for line in response.iter_lines():
-        if line:
-            try:
-                # Decode the line and parse JSON
-                decoded_line = line.decode('utf-8')
-                json_data = json.loads(decoded_line)
-                
-                # Extract the response content
-                content = json_data.get("response", "")
-                done = json_data.get("done", False)
-                
-                # Yield the content chunk
-                if content:
-                    yield content
-                
-                # Break if done
-                if done:
-                    break
-                    
-            except (json.JSONDecodeError, UnicodeDecodeError) as e:
-                # Skip invalid lines
-                continue
+SSE_HEADERS = {"Cache-Control": "no-cache", "Connection": "keep-alive", "X-Accel-Buffering": "no"}
+
+_pumps = set()  # running _pump tasks (the event loop only keeps weak references)
+
+async def _pump(buf, chunks):
+    """Copy Ollama's token stream into buf; it keeps going if the client drops, for resume."""
+    try:
+        async for data in chunks:
+            buf.append(data.get("response", ""))
+            if data.get("done"):
+                break
+        buf.finish()
+    except Exception as e:
+        buf.finish(error=str(e))
+    finally:
+        await chunks.aclose()  # returns the connection (and a success) to the host pool now
+
+def _sse_response(buf, offset, request):
+    return StreamingResponse(
+        sse_frames(buf, offset, request.frame_ms, request.frame_chars, request.summary),
+        media_type="text/event-stream",
+        headers=dict(SSE_HEADERS, **{"X-Stream-Id": buf.id}),
+    )
 
 @app.post("/generate")
-async def generate_text(request: PromptRequest):
+async def generate_text(request: PromptRequest, last_event_id: str = Header(None)):
     """
-    Generate AI text using Ollama's local API with optional streaming
+    Generate AI text using Ollama's local API with optional streaming.
+    Streaming replies are SSE frames (see sse_stream.py); sending the Last-Event-ID of the last
+    frame received resumes that generation instead of starting a new one.
     """
+    if request.stream and last_event_id:
+        buf, offset = lookup(last_event_id)
+        if buf is None:
+            raise HTTPException(status_code=404, detail="Unknown or expired stream")
+        return _sse_response(buf, offset, request)
     try:
         # Prepare the request payload for Ollama
         ollama_payload = {
@@ -74,70 +100,32 @@ async def generate_text(request: PromptRequest):
             }
         }
         
-        # Make request to Ollama API
-        response = requests.post(
-            f"{OLLAMA_BASE_URL}/api/generate",
-            json=ollama_payload,
-            stream=request.stream,  # Important: enable streaming in requests
-            timeout=60
-        )
-        
-        # Check if request was successful
-        response.raise_for_status()
-        
+        client = get_async_client()
         if request.stream:
-            # Return streaming response
-            def generate_stream():
-                full_response = ""
-                for chunk in parse_streaming_response(response):
-                    full_response += chunk
-                    # Format each chunk as JSON for the client
-                    chunk_data = {
-                        "content": chunk,
-                        "done": False,
-                        "model": request.model
-                    }
-                    yield f"data: {json.dumps(chunk_data)}\n\n"
-                
-                # Send final message
-                final_data = {
-                    "content": "",
-                    "done": True,
-                    "model": request.model,
-                    "full_response": full_response
-                }
-                yield f"data: {json.dumps(final_data)}\n\n"
-            
-            return StreamingResponse(
-                generate_stream(),
-                media_type="text/event-stream",
-                headers={
-                    "Cache-Control": "no-cache",
-                    "Connection": "keep-alive",
-                }
-            )
+            # Opening the stream is retried; once tokens flow they are pumped into the buffer
+            chunks = await client.generate(ollama_payload)
+            buf = register(StreamBuffer(request.model))
+            task = asyncio.create_task(_pump(buf, chunks))
+            _pumps.add(task)
+            task.add_done_callback(_pumps.discard)
+            return _sse_response(buf, 0, request)
         else:
             # Return complete response
-            ollama_response = response.json()
+            ollama_response = await client.complete(ollama_payload)
             return AIResponse(
                 response=ollama_response.get("response", ""),
                 model=request.model,
                 prompt=request.prompt
             )
         
-    except requests.exceptions.ConnectionError:
+    except OllamaUnavailable as e:
         raise HTTPException(
             status_code=503, 
-            detail="Cannot connect to Ollama. Make sure Ollama is running on localhost:11434"
+            detail=f"Cannot reach Ollama: {e}"
         )
-    except requests.exceptions.Timeout:
+    except OllamaError as e:
         raise HTTPException(
-            status_code=408, 
-            detail="Request to Ollama timed out"
-        )
-    except requests.exceptions.RequestException as e:
-        raise HTTPException(
-            status_code=500, 
+            status_code=502, 
             detail=f"Error communicating with Ollama: {str(e)}"
         )
     except Exception as e:
@@ -145,6 +133,20 @@ async def generate_text(request: PromptRequest):
             status_code=500, 
             detail=f"Internal server error: {str(e)}"
         )
+
+@app.get("/generate/stream/{stream_id}")
+async def resume_stream(stream_id: str, last_event_id: str = Header(None), frame_ms: int = 50,
+                        frame_chars: int = 64, summary: bool = False):
+    """
+    Reconnect to a running (or recently finished) generation. EventSource clients reconnect
+    here automatically with the Last-Event-ID header; without it the stream replays from the start.
+    """
+    buf, offset = lookup(last_event_id if last_event_id and last_event_id.startswith(stream_id)
+                         else f"{stream_id}-0")
+    if buf is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired stream")
+    return _sse_response(buf, offset, PromptRequest(prompt="", frame_ms=frame_ms,
+                                                    frame_chars=frame_chars, summary=summary))
 '''
 @app.get("/health")
 async def health_check():
@@ -177,7 +179,7 @@ async def generate_email_reply(
     )
     
     request = PromptRequest(prompt=prompt, model=model, stream=stream)
-    return await generate_text(request)
+    return await generate_text(request, last_event_id=None)
 
 # Simple streaming endpoint for testing
 @app.get("/stream-test")
@@ -201,6 +203,64 @@ async def stream_test():
         media_type="text/event-stream"
     )
 
+# Gmail push ingestion (Pub/Sub push subscription → this endpoint), see gmail_push.py
+# Set GMAIL_PUSH_TOKEN and append ?token=... to the push URL to reject foreign callers;
+# set GMAIL_PUSH_ENQUEUE_REPLIES=1 to also queue new inbox mail for reply_service.py.
+GMAIL_PUSH_TOKEN = os.environ.get("GMAIL_PUSH_TOKEN", "")
+_push_ingestor = None
+_push_ingestor_lock = threading.Lock()
+
+def get_push_ingestor():
+    """Create the Gmail/embedder/vector-store clients once, on the first notification"""
+    global _push_ingestor
+    with _push_ingestor_lock:
+        if _push_ingestor is None:
+            from embedder import OllamaEmbedder
+            from vector_store import open_vector_store
+            from gmail_client import get_gmail_service
+            from gmail_push import PushIngestor
+            from dedup import NearDuplicateIndex
+            reply_queue = None
+            if os.environ.get("GMAIL_PUSH_ENQUEUE_REPLIES"):
+                from reply_service import ReplyJobQueue
+                reply_queue = ReplyJobQueue()
+            _push_ingestor = PushIngestor(get_gmail_service(), OllamaEmbedder(),
+                                          open_vector_store(dim=768), reply_queue=reply_queue,
+                                          dedup=NearDuplicateIndex())
+        return _push_ingestor
+
+def ingest_push_notification(history_id, traceparent=None):
+    try:
+        with span("gmail.push.ingest", parent=traceparent):
+            get_push_ingestor().handle_notification(history_id)
+    except Exception as e:
+        print(f"❌ Push ingestion failed for historyId {history_id}: {e}")
+
+@app.post("/gmail/push", status_code=204)
+async def gmail_push(envelope: dict, background_tasks: BackgroundTasks, token: str = ""):
+    """
+    Pub/Sub push endpoint for Gmail users.watch notifications.
+    Acknowledges immediately (so Pub/Sub does not redeliver) and ingests in the background.
+    """
+    if GMAIL_PUSH_TOKEN and token != GMAIL_PUSH_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid push token")
+    try:
+        notification = decode_push_envelope(envelope)
+        history_id = int(notification["historyId"])
+    except (KeyError, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Malformed Pub/Sub push body")
+
+    # the request span may end before the task runs, so hand its context over explicitly
+    background_tasks.add_task(ingest_push_notification, history_id, current_traceparent())
+    return Response(status_code=204)
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Run the FastAPI app (generation + Gmail push endpoint)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args(argv)
+    uvicorn.run(app, host=args.host, port=args.port)
+
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
+    main()
@@ -0,0 +1,317 @@
+# pregen.py
+"""
+Speculative reply pre-generation.
+
+Polls the mailbox, scores each thread's newest message with cheap heuristics (is it asking
+something, is it bulk/automated, how often have we stored mail from this sender) and, while
+the machine is idle, generates replies for the most likely-to-need-a-reply messages first.
+Results go to a small bounded cache (data/pregen_cache.json) that smart_reply.py checks
+before running the LLM, so drafting those messages is instant.
+
+A cached reply only answers one specific message: as soon as its thread has a newer message
+(an incoming follow-up or our own sent reply) the entry is dropped.
+
+With --reply-db, messages that already have a reply_service job are left to the service, and
+the service uses (and, with --save-drafts, keeps the draft of) a reply pre-generated here.
+A failed generation is forgotten and scored again on the next poll.
+
+Usage:
+    python pregen.py --poll-interval 60 --threshold 0.5
+    python pregen.py --once            # one poll + generate everything above the threshold
+"""
+
+import argparse
+import heapq
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parseaddr
+
+DEFAULT_CACHE = "data/pregen_cache.json"
+MAX_TRACKED = 5000  # message ids remembered as scored / threads remembered (oldest forgotten first)
+
+# Labels whose messages are never answered
+SKIP_LABELS = {"SENT", "DRAFT", "SPAM", "TRASH", "CATEGORY_PROMOTIONS", "CATEGORY_SOCIAL",
+               "CATEGORY_UPDATES", "CATEGORY_FORUMS"}
+NO_REPLY = re.compile(r"no[-_.]?reply|do[-_.]?not[-_.]?reply|notifications?@|mailer-daemon", re.I)
+REQUEST = re.compile(r"\b(please|could you|can you|would you|let me know|are you able|"
+                     r"what do you think|any update|get back to me)\b", re.I)
+
+
+def reply_score(email: dict, store=None) -> float:
+    """
+    0..1 estimate of how likely `email` (from smart_reply.get_email) needs a reply.
+    Bulk mail, no-reply senders and promotional/social categories score 0; questions, direct
+    requests, IMPORTANT and an existing history with the sender raise the score.
+    """
+    labels = set(email.get("labels") or [])
+    if email.get("bulk") or labels & SKIP_LABELS or NO_REPLY.search(email.get("from_email", "")):
+        return 0.0
+    text = f"{email.get('subject', '')}\n{email.get('body', '')[:4000]}"
+    score = 0.0
+    if "?" in text:
+        score += 0.4
+    if REQUEST.search(text):
+        score += 0.2
+    if "IMPORTANT" in labels:
+        score += 0.2
+    if store is not None and parseaddr(email.get("from_email", ""))[1]:
+        # 1 past email → +0.1, 3 → +0.2, 15+ → capped at +0.4
+        history = store.count_emails(sender=email["from_email"])
+        score += min(0.4, 0.1 * math.log2(1 + history))
+    return round(min(score, 1.0), 3)
+
+
+class ReplyCache:
+    """
+    Pre-generated replies keyed by Gmail message id, stored as JSON:
+    {message_id: {"thread_id", "reply", "score", "created_at", "draft_id"}}.
+    Bounded to max_entries (oldest evicted) and max_age seconds.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE, max_entries: int = 200, max_age: float = 3 * 86400):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self.entries = {}
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        self._expire()
+
+    def _expire(self):
+        cutoff = time.time() - self.max_age
+        self.entries = {k: v for k, v in self.entries.items() if v["created_at"] >= cutoff}
+        if len(self.entries) > self.max_entries:
+            newest = sorted(self.entries.items(), key=lambda kv: kv[1]["created_at"])[-self.max_entries:]
+            self.entries = dict(newest)
+
+    def __contains__(self, message_id):
+        return self.get(message_id) is not None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def entry(self, message_id: str):
+        """The cached entry dict, or None if missing or expired."""
+        entry = self.entries.get(message_id)
+        if entry is None or entry["created_at"] < time.time() - self.max_age:
+            return None
+        return entry
+
+    def get(self, message_id: str):
+        """The cached reply text, or None if missing or expired."""
+        entry = self.entry(message_id)
+        return entry["reply"] if entry else None
+
+    def put(self, message_id: str, thread_id: str, reply: str, score: float = 0.0, draft_id: str = None):
+        with self._lock:
+            self.entries[message_id] = {"thread_id": thread_id, "reply": reply, "score": score,
+                                        "created_at": time.time(), "draft_id": draft_id}
+            self._expire()
+
+    def invalidate_thread(self, thread_id: str, keep: str = None) -> int:
+        """Drop replies to older messages of thread_id (keep = its newest message id)."""
+        with self._lock:
+            stale = [k for k, v in self.entries.items() if v["thread_id"] == thread_id and k != keep]
+            for k in stale:
+                del self.entries[k]
+        return len(stale)
+
+    def save(self):
+        with self._lock:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+
+
+def system_idle(max_load: float = 0.7, reply_queue=None) -> bool:
+    """
+    True when the 1-minute load average per CPU is below max_load and the reply service
+    (if its queue is given) has no pending or running jobs: foreground work always wins.
+    """
+    try:
+        load = os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (AttributeError, OSError):  # not available on Windows
+        load = 0.0
+    if load > max_load:
+        return False
+    if reply_queue is not None:
+        from reply_service import PENDING, RUNNING
+        counts = reply_queue.counts()
+        if counts.get(PENDING) or counts.get(RUNNING):
+            return False
+    return True
+
+
+class Pregenerator:
+    """Keeps a priority queue of candidate messages and fills the ReplyCache while idle."""
+
+    def __init__(self, service, embedder, store, cache: ReplyCache = None, threshold: float = 0.5,
+                 max_load: float = 0.7, reply_queue=None, save_drafts: bool = False):
+        self.service = service
+        self.embedder = embedder
+        self.store = store
+        self.cache = cache if cache is not None else ReplyCache()
+        self.threshold = threshold
+        self.max_load = max_load
+        self.reply_queue = reply_queue
+        self.save_drafts = save_drafts
+        self.latest_in_thread = OrderedDict()  # thread_id -> newest message id seen (LRU)
+        self.scored = OrderedDict()            # message ids already scored (LRU, keys only)
+        self._candidates = []        # heap of (-score, seq, message_id, email)
+        self._seq = 0
+
+    @staticmethod
+    def _remember(lru: OrderedDict, key, value=None):
+        lru[key] = value
+        lru.move_to_end(key)
+        while len(lru) > MAX_TRACKED:
+            lru.popitem(last=False)
+
+    def poll(self, max_results: int = 25) -> int:
+        """
+        Look at the newest inbox/sent messages; returns the number of new candidates.
+        A message that cannot be fetched or scored is skipped and tried again next poll.
+        """
+        from smart_reply import get_email
+
+        resp = self.service.users().messages().list(
+            userId="me", q="in:inbox OR in:sent", maxResults=max_results).execute()
+        added, seen_threads = 0, set()
+        for m in resp.get("messages", []):  # newest first
+            thread_id, message_id = m["threadId"], m["id"]
+            if thread_id in seen_threads:
+                continue  # only a thread's newest message can need a reply
+            seen_threads.add(thread_id)
+            self._remember(self.latest_in_thread, thread_id, message_id)
+            dropped = self.cache.invalidate_thread(thread_id, keep=message_id)
+            if dropped:
+                print(f"🧹 Dropped {dropped} stale pre-generated repl{'y' if dropped == 1 else 'ies'} in thread {thread_id}")
+            if message_id in self.scored or message_id in self.cache or self._queued(message_id):
+                continue
+            try:
+                email = get_email(self.service, message_id)
+                score = reply_score(email, self.store)
+            except Exception as e:
+                print(f"⚠️ Could not score {message_id}: {e}")
+                continue
+            self._remember(self.scored, message_id)
+            if score >= self.threshold:
+                self._seq += 1
+                heapq.heappush(self._candidates, (-score, self._seq, message_id, email))
+                added += 1
+        return added
+
+    def _queued(self, message_id: str) -> bool:
+        """True if reply_service already has a job for the message: it drafts it, not us."""
+        return self.reply_queue is not None and self.reply_queue.status(message_id) is not None
+
+    def pending(self) -> int:
+        return len(self._candidates)
+
+    def run_once(self) -> bool:
+        """Generate the best still-current candidate if the machine is idle. Returns True if one was generated."""
+        from smart_reply import format_email_text, get_similar_context, generate_reply_with_ollama
+
+        while self._candidates:
+            if not system_idle(self.max_load, self.reply_queue):
+                return False
+            neg_score, _, message_id, email = heapq.heappop(self._candidates)
+            if self.latest_in_thread.get(email["thread_id"]) != message_id or self._queued(message_id):
+                continue  # thread moved on, or reply_service took it, while this was queued
+            email_text = format_email_text(email)
+            writer = None
+            if self.save_drafts:
+                from draft_writer import DraftWriter
+                writer = DraftWriter(email)
+            try:
+                context = get_similar_context(email_text, embedder=self.embedder, store=self.store)
+                reply = generate_reply_with_ollama(email_text, context, echo=False, raise_errors=True,
+                                                   on_chunk=writer.write if writer else None)
+            except Exception as e:
+                if writer is not None:
+                    writer.discard()
+                self.scored.pop(message_id, None)  # scored (and generated) again on the next poll
+                print(f"⚠️ Pre-generation failed for {message_id}: {e}")
+                return False
+            draft_id = None
+            if writer is not None:
+                try:
+                    if self._queued(message_id):
+                        writer.discard()  # queued meanwhile: reply_service writes the one draft
+                    else:
+                        writer.close(reply)
+                        draft_id = writer.draft_id
+                except Exception as e:  # the reply itself is fine: still cache it
+                    print(f"⚠️ Draft for {message_id} not saved: {e}")
+            self.cache.put(message_id, email["thread_id"], reply, -neg_score, draft_id=draft_id)
+            self.cache.save()
+            print(f"⚡ Pre-generated reply for {message_id} (score {-neg_score:.2f}): {email['subject'][:50]}")
+            return True
+        return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-generate replies for messages likely to need one")
+    parser.add_argument("--poll-interval", type=float, default=60.0)
+    parser.add_argument("--threshold", type=float, default=0.5, help="minimum reply score (0..1)")
+    parser.add_argument("--max-load", type=float, default=0.7,
+                        help="only generate while the 1-min load average per CPU is below this")
+    parser.add_argument("--max-results", type=int, default=25, help="messages looked at per poll")
+    parser.add_argument("--cache", default=DEFAULT_CACHE)
+    parser.add_argument("--max-entries", type=int, default=200)
+    parser.add_argument("--reply-db", default=None,
+                        help="reply_service queue; pre-generation pauses while it has work and "
+                             "skips messages it already has (default: its usual path, if present)")
+    parser.add_argument("--save-drafts", action="store_true", help="also write each reply as a Gmail draft")
+    parser.add_argument("--once", action="store_true", help="poll once, generate all candidates, exit")
+    args = parser.parse_args(argv)
+
+    from embedder import OllamaEmbedder
+    from vector_store import open_vector_store
+    from gmail_client import COMPOSE_SCOPES, get_credentials, get_gmail_service
+
+    if args.save_drafts:
+        get_credentials(COMPOSE_SCOPES)
+    reply_queue = None
+    from reply_service import DB_PATH, ReplyJobQueue
+    reply_db = args.reply_db or (DB_PATH if os.path.exists(DB_PATH) else None)
+    if reply_db:
+        reply_queue = ReplyJobQueue(reply_db)
+    pregen = Pregenerator(get_gmail_service(), OllamaEmbedder(), open_vector_store(dim=768),
+                          ReplyCache(args.cache, max_entries=args.max_entries), threshold=args.threshold,
+                          max_load=float("inf") if args.once else args.max_load,
+                          reply_queue=reply_queue, save_drafts=args.save_drafts)
+    print(f"🚀 Pre-generating replies (threshold {args.threshold}, {len(pregen.cache)} cached)")
+    try:
+        next_poll = 0.0
+        while True:
+            if time.monotonic() >= next_poll:
+                try:
+                    added = pregen.poll(args.max_results)
+                    pregen.cache.save()
+                    if added:
+                        print(f"📩 {added} new candidate(s), {pregen.pending()} pending")
+                except Exception as e:  # e.g. a transient Gmail HttpError: try again next interval
+                    print(f"⚠️ Poll failed: {e}")
+                next_poll = time.monotonic() + args.poll_interval
+            if pregen.run_once():
+                continue
+            if args.once and not pregen.pending():
+                break
+            time.sleep(min(5.0, max(0.0, next_poll - time.monotonic())))
+    except KeyboardInterrupt:
+        print("\n🛑 Stopping pre-generation...")
+
+
+if __name__ == "__main__":
+    main()
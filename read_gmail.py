@@ -6,29 +6,27 @@ import re
 import io
 import base64
 from datetime import datetime
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from PyPDF2 import PdfReader
-from docx import Document
-from PIL import Image
-import pytesseract
-from PIL import Image
-import pytesseract
-from vector_store import GmailVectorStore as EmailVectorDB
-import pytesseract
-pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
+from gmail_client import get_gmail_service
+from email_text import body_text
+from tracing import span, traced
 
+# Extractors (PyPDF2, python-docx, PIL, pytesseract) are imported on first use, so importing
+# this module or fetching mail without attachments does not pay for them.
 
+# If Tesseract is installed in a custom location, set TESSERACT_CMD (the default Windows path is used if present)
+TESSERACT_CMD = os.environ.get("TESSERACT_CMD", r"C:\Program Files\Tesseract-OCR\tesseract.exe")
+_pytesseract = None
 
 
-
-# ---- Scope: we only read emails for now. When you want to create drafts, add compose scope. ----
-SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
-
-# If Tesseract is installed in a custom location, uncomment and set the path:
-# pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
+def get_pytesseract():
+    """Import pytesseract once and point it at TESSERACT_CMD when that binary exists."""
+    global _pytesseract
+    if _pytesseract is None:
+        import pytesseract
+        if os.path.exists(TESSERACT_CMD):
+            pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+        _pytesseract = pytesseract
+    return _pytesseract
 
 
 def sanitize_filename(name: str) -> str:
@@ -42,28 +40,10 @@ def ensure_dir(path: str):
 
 def get_email_body_from_payload(payload):
     """
-    Try to retrieve a sensible plain-text body from the payload.
-    Gmail messages can be nested; this walks parts recursively looking for text/plain.
+    Retrieve a sensible plain-text body from the payload: the text/plain alternative when it is
+    usable, otherwise the text/html one converted to text (quotes are kept in the saved copy).
     """
-    # If payload itself has data (small messages)
-    if payload.get("body", {}).get("data"):
-        data = payload["body"]["data"]
-        text = base64.urlsafe_b64decode(data.encode("UTF-8")).decode("utf-8", errors="replace")
-        return text
-
-    # If there are parts, search them
-    parts = payload.get("parts", [])
-    for part in parts:
-        mime = part.get("mimeType", "")
-        if mime == "text/plain" and part.get("body", {}).get("data"):
-            data = part["body"]["data"]
-            text = base64.urlsafe_b64decode(data.encode("UTF-8")).decode("utf-8", errors="replace")
-            return text
-        # recursive dive
-        inner = get_email_body_from_payload(part)
-        if inner:
-            return inner
-    return ""
+    return body_text(payload)
 
 
 def collect_all_parts(payload, out_list):
@@ -92,7 +72,9 @@ def save_attachment(service, msg_id, part, save_dir):
     if "attachmentId" in body:
         # Official attachment reference — fetch via attachments.get
         att_id = body["attachmentId"]
-        att = service.users().messages().attachments().get(userId='me', messageId=msg_id, id=att_id).execute()
+        with span("gmail.attachments.get", **{"gmail.message_id": msg_id}) as s:
+            att = service.users().messages().attachments().get(userId='me', messageId=msg_id, id=att_id).execute()
+            s.set_attribute("attachment.bytes", att.get("size", 0))
         raw = att.get("data")
         if raw:
             data_bytes = base64.urlsafe_b64decode(raw.encode("UTF-8"))
@@ -130,38 +112,41 @@ def save_attachment(service, msg_id, part, save_dir):
 #'''
 def extract_text_from_bytes(data_bytes: bytes, filename: str) -> str:
     """Extract text from bytes based on the file extension. Returns extracted text or empty string."""
-    lower = filename.lower()
-    try:
-        if lower.endswith(".pdf"):
-            # PDF extraction with PyPDF2
-            reader = PdfReader(io.BytesIO(data_bytes))
-            pages_text = []
-            for p in reader.pages:
-                t = p.extract_text() or ""
-                pages_text.append(t)
-            return "\n".join(pages_text).strip()
-        elif lower.endswith(".docx"):
-            # Word .docx extraction
-            doc = Document(io.BytesIO(data_bytes))
-            return "\n".join([p.text for p in doc.paragraphs]).strip()
-        elif lower.endswith((".png", ".jpg", ".jpeg", ".bmp", ".tiff")):
-            # Image -> OCR
-            img = Image.open(io.BytesIO(data_bytes))
-            # optional: convert to RGB to avoid issues
-            if img.mode != "RGB":
-                img = img.convert("RGB")
-            text = pytesseract.image_to_string(img)
-            return text.strip()
-        elif lower.endswith(".txt"):
-            return data_bytes.decode("utf-8", errors="replace")
-        else:
-            # Not supported natively — try to decode as text as a fallback
-            try:
+    with span("extract.attachment", **{"file.extension": os.path.splitext(filename)[1].lower(), "file.bytes": len(data_bytes)}):
+        lower = filename.lower()
+        try:
+            if lower.endswith(".pdf"):
+                # PDF extraction with PyPDF2
+                from PyPDF2 import PdfReader
+                reader = PdfReader(io.BytesIO(data_bytes))
+                pages_text = []
+                for p in reader.pages:
+                    t = p.extract_text() or ""
+                    pages_text.append(t)
+                return "\n".join(pages_text).strip()
+            elif lower.endswith(".docx"):
+                # Word .docx extraction
+                from docx import Document
+                doc = Document(io.BytesIO(data_bytes))
+                return "\n".join([p.text for p in doc.paragraphs]).strip()
+            elif lower.endswith((".png", ".jpg", ".jpeg", ".bmp", ".tiff")):
+                # Image -> OCR
+                from PIL import Image
+                img = Image.open(io.BytesIO(data_bytes))
+                # optional: convert to RGB to avoid issues
+                if img.mode != "RGB":
+                    img = img.convert("RGB")
+                return ocr_image(img)
+            elif lower.endswith(".txt"):
                 return data_bytes.decode("utf-8", errors="replace")
-            except Exception:
-                return ""
-    except Exception as e:
-        return f"[Error extracting text: {e}]"
+            else:
+                # Not supported natively — try to decode as text as a fallback
+                try:
+                    return data_bytes.decode("utf-8", errors="replace")
+                except Exception:
+                    return ""
+        except Exception as e:
+            return f"[Error extracting text: {e}]"
 
 
 def save_email_folder(service, message):
@@ -169,115 +154,121 @@ def save_email_folder(service, message):
     Given a Gmail message resource (as returned by messages.get with format='full'),
     create a folder and save metadata, body, attachments and extracted text.
     """
-    msg_id = message.get("id")
-    thread_id = message.get("threadId", "")
-    internal_date = message.get("internalDate")  # milliseconds-since-epoch as string
-    date_readable = ""
-    if internal_date:
-        try:
-            ts = int(internal_date) / 1000.0
-            date_readable = datetime.utcfromtimestamp(ts).strftime("%Y%m%d_%H%M%S")
-        except:
-            date_readable = internal_date
-
-    # Build a friendly folder name: emails/email_<msgid>_<date> (safe)
-    folder_name = f"emails/email_{sanitize_filename(msg_id)}"
-    if date_readable:
-        folder_name += f"_{date_readable}"
-    ensure_dir(folder_name)
-
-    # Extract headers metadata
-    headers = message.get("payload", {}).get("headers", [])
-    meta = {}
-    for h in headers:
-        name = h.get("name", "").lower()
-        if name in ["from", "to", "subject", "date", "message-id"]:
-            meta[name] = h.get("value")
-    meta["id"] = msg_id
-    meta["threadId"] = thread_id
-    meta["snippet"] = message.get("snippet", "")
-
-    # Save metadata.json
-    with open(os.path.join(folder_name, "metadata.json"), "w", encoding="utf-8") as f:
-        json.dump(meta, f, indent=2, ensure_ascii=False)
-
-    # Save body text (plain text if possible)
-    body_text = get_email_body_from_payload(message.get("payload", {})) or ""
-    with open(os.path.join(folder_name, "body.txt"), "w", encoding="utf-8") as f:
-        f.write(body_text)
-
-    # Now gather all parts and save attachments & extracted text
-    parts_list = []
-    collect_all_parts(message.get("payload", {}), parts_list)
-
-    extracted_texts = []
-
-    for part in parts_list:
-        # decide if this part is an attachment (has filename) or has attachmentId
-        filename = part.get("filename")
-        body = part.get("body", {})
-        if (filename and (body.get("attachmentId") or body.get("data"))):
-            fname, bytes_data = save_attachment(service, msg_id, part, folder_name)
-            if fname and bytes_data:
-                # Extract text from non-image attachments if needed
-                extracted = extract_text_from_bytes(bytes_data, fname)
-                extracted_texts.append({
-                    "attachment": fname,
-                    "text": extracted
-                })
-                # Save extracted text file
-                txt_name = f"extracted_{os.path.splitext(fname)[0]}.txt"
-                with open(os.path.join(folder_name, txt_name), "w", encoding="utf-8") as tx:
-                    tx.write(extracted)
-    # Save combined extracted text file (concatenated)
-    combined = "\n\n".join([et["text"] for et in extracted_texts if et["text"]])
-    with open(os.path.join(folder_name, "extracted_full.txt"), "w", encoding="utf-8") as comb:
-        comb.write(combined)
-
-    print(f"Saved email -> {folder_name} (body + {len(extracted_texts)} extracted attachments)")
-    return folder_name
-
-
-
-
-
-
-
-
-def main():
+    with span("gmail.save_email_folder", **{"gmail.message_id": message.get("id")}) as trace_span:
+        msg_id = message.get("id")
+        thread_id = message.get("threadId", "")
+        internal_date = message.get("internalDate")  # milliseconds-since-epoch as string
+        date_readable = ""
+        if internal_date:
+            try:
+                ts = int(internal_date) / 1000.0
+                date_readable = datetime.utcfromtimestamp(ts).strftime("%Y%m%d_%H%M%S")
+            except:
+                date_readable = internal_date
+
+        # Build a friendly folder name: emails/email_<msgid>_<date> (safe)
+        folder_name = f"emails/email_{sanitize_filename(msg_id)}"
+        if date_readable:
+            folder_name += f"_{date_readable}"
+        ensure_dir(folder_name)
+
+        # Extract headers metadata
+        headers = message.get("payload", {}).get("headers", [])
+        meta = {}
+        for h in headers:
+            name = h.get("name", "").lower()
+            if name in ["from", "to", "subject", "date", "message-id"]:
+                meta[name] = h.get("value")
+        meta["id"] = msg_id
+        meta["threadId"] = thread_id
+        meta["internalDate"] = internal_date
+        meta["labelIds"] = message.get("labelIds", [])
+        meta["snippet"] = message.get("snippet", "")
+
+        # Save metadata.json
+        with open(os.path.join(folder_name, "metadata.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2, ensure_ascii=False)
+
+        # Save body text (plain text if possible)
+        body_text = get_email_body_from_payload(message.get("payload", {})) or ""
+        trace_span.set_attribute("email.body_bytes", len(body_text.encode("utf-8")))
+        with open(os.path.join(folder_name, "body.txt"), "w", encoding="utf-8") as f:
+            f.write(body_text)
+
+        # Now gather all parts and save attachments & extracted text
+        parts_list = []
+        collect_all_parts(message.get("payload", {}), parts_list)
+
+        extracted_texts = []
+
+        for part in parts_list:
+            # decide if this part is an attachment (has filename) or has attachmentId
+            filename = part.get("filename")
+            body = part.get("body", {})
+            if (filename and (body.get("attachmentId") or body.get("data"))):
+                fname, bytes_data = save_attachment(service, msg_id, part, folder_name)
+                if fname and bytes_data:
+                    # Extract text from non-image attachments if needed
+                    extracted = extract_text_from_bytes(bytes_data, fname)
+                    extracted_texts.append({
+                        "attachment": fname,
+                        "text": extracted
+                    })
+                    # Save extracted text file
+                    txt_name = f"extracted_{os.path.splitext(fname)[0]}.txt"
+                    with open(os.path.join(folder_name, txt_name), "w", encoding="utf-8") as tx:
+                        tx.write(extracted)
+        # Save combined extracted text file (concatenated)
+        combined = "\n\n".join([et["text"] for et in extracted_texts if et["text"]])
+        with open(os.path.join(folder_name, "extracted_full.txt"), "w", encoding="utf-8") as comb:
+            comb.write(combined)
+
+        trace_span.set_attributes(**{"email.attachments": len(extracted_texts),
+                                     "email.extracted_chars": len(combined)})
+        print(f"Saved email -> {folder_name} (body + {len(extracted_texts)} extracted attachments)")
+        return folder_name
+
+
+
+
+
+
+
+
+def main(argv=None):
     """Authenticate and process N latest emails, saving each to its own folder."""
-    creds = None
-    # token.json is created by the OAuth flow; it should not be in your git repo
-    if os.path.exists("token.json"):
-        creds = Credentials.from_authorized_user_file("token.json", SCOPES)
-
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            # This requires credentials.json in the same folder
-            flow = InstalledAppFlow.from_client_secrets_file("credentials.json", SCOPES)
-            creds = flow.run_local_server(port=0)
-        with open("token.json", "w", encoding="utf-8") as token_file:
-            token_file.write(creds.to_json())
-
-    service = build("gmail", "v1", credentials=creds)
-
-    # Configure how many recent emails you want to process
-    MAX_EMAILS = 10
-    resp = service.users().messages().list(userId="me", maxResults=MAX_EMAILS).execute()
-    messages = resp.get("messages", [])
-
-    if not messages:
-        print("No messages found.")
-        return
+    import argparse
+    parser = argparse.ArgumentParser(description="Save the newest emails (metadata, body, attachments, OCR) under emails/")
+    parser.add_argument("--max", type=int, default=10, help="how many recent emails to process")
+    args = parser.parse_args(argv)
+
+    # One root span per run, so every message of the batch lands in the same trace
+    with span("fetch.run", **{"fetch.max": args.max}) as run_span:
+        # token.json / credentials.json handling lives in gmail_client.py
+        service = get_gmail_service()
 
-    # For each message: fetch full message and save
-    for m in messages:
-        msg_id = m["id"]
-        # fetch full message (format='full' is default) so we can access parts/attachments
-        full = service.users().messages().get(userId="me", id=msg_id, format="full").execute()
-        save_email_folder(service, full)
+        with span("gmail.list", **{"gmail.max_results": args.max}):
+            resp = service.users().messages().list(userId="me", maxResults=args.max).execute()
+        messages = resp.get("messages", [])
+        run_span.set_attribute("fetch.messages", len(messages))
+
+        if not messages:
+            print("No messages found.")
+            return
+
+        # For each message: fetch full message and save
+        for m in messages:
+            msg_id = m["id"]
+            # fetch full message (format='full' is default) so we can access parts/attachments
+            with span("gmail.get", **{"gmail.message_id": msg_id}):
+                full = service.users().messages().get(userId="me", id=msg_id, format="full").execute()
+            save_email_folder(service, full)
+
+
+@traced("ocr.tesseract")
+def ocr_image(image) -> str:
+    """Tesseract OCR of a PIL image."""
+    return get_pytesseract().image_to_string(image).strip()
 
 
 #for image reading
@@ -286,37 +277,14 @@ def extract_text_from_image(image_bytes: bytes) -> str:
     Extract text from an image using OCR (pytesseract).
     """
     try:
+        from PIL import Image
         # Load image from byte data
         image = Image.open(io.BytesIO(image_bytes))
-        text = pytesseract.image_to_string(image)
-        return text.strip()
+        return ocr_image(image)
     except Exception as e:
         return f"Error extracting text from image: {e}"
     
 
-#mail content to embeding to vector db
-# read_gmail.py  (top of file)
-from embedder import OllamaEmbedder
-# e.g., right after your Google auth setup
-embedder = OllamaEmbedder()        # uses nomic-embed-text by default
-vecdb = EmailVectorDB()            # local file data/email_vectors.db
-# Suppose you have variables:
-#   msg_id: Gmail message id (string). We'll cast to int via a stable hash fallback.
-#   full_text: string of "Subject: ...\nBody: ..." for this email
-
-# Convert the Gmail string id to a stable integer for Milvus primary key
-def id_to_int(gmail_id: str) -> int:
-    # small stable hash (fits 64-bit)
-    return abs(hash(gmail_id)) % (2**63 - 1)
-
-try:
-    emb = embedder.embed(full_text)          # 768-length vector
-    vecdb.upsert(message_id=id_to_int(msg_id), vector=emb)
-except Exception as e:
-    print(f"[Milvus] Skipped indexing {msg_id}: {e}")
-
-
-
 
 if __name__ == "__main__":
     main()
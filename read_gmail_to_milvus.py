@@ -8,99 +8,136 @@ Requires:
 - Milvus running in Docker
 """
 
-import base64
-import re
-import requests
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-import pickle, os.path
-
+from email_text import normalize_bodies
 from embedder import OllamaEmbedder
-from vector_store import GmailVectorStore
-
-
-# ============================================================
-# Gmail Setup
-# ============================================================
+from dedup import NearDuplicateIndex
+from vector_store import open_vector_store
+from gmail_client import get_gmail_service
+from tracing import span
 
-SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
 
-
-def get_gmail_service():
-    """Authenticate and return Gmail API service"""
-    creds = None
-    if os.path.exists('token.json'):
-        with open('token.json', 'rb') as token:
-            creds = pickle.load(token)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        with open('token.json', 'wb') as token:
-            pickle.dump(creds, token)
-    return build('gmail', 'v1', credentials=creds)
+def parse_messages(msg_datas):
+    """Turn Gmail messages.get resources into the dicts stored in the vector DB"""
+    # best MIME part, HTML/quotes/signature stripped, one pass over the batch
+    bodies = normalize_bodies([msg_data['payload'] for msg_data in msg_datas])
+    emails = []
+    for msg_data, body in zip(msg_datas, bodies):
+        headers = msg_data['payload']['headers']
+        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), "No Subject")
+        sender = next((h['value'] for h in headers if h['name'] == 'From'), "Unknown Sender")
+        rfc_id = next((h['value'] for h in headers if h['name'].lower() == 'message-id'), "")
+        emails.append({
+            "id": msg_data['id'],
+            "thread_id": msg_data.get('threadId', ""),
+            "rfc_message_id": rfc_id,
+            "date_ts": int(msg_data.get('internalDate', 0)) // 1000,
+            "labels": msg_data.get('labelIds', []),
+            "snippet": msg_data.get('snippet', ""),
+            "subject": subject,
+            "from_email": sender,
+            "body": body,
+        })
+    return emails
 
 
-def clean_text(text):
-    """Remove HTML tags, newlines, and excess spaces"""
-    text = re.sub(r'<[^>]+>', '', text)
-    text = re.sub(r'\s+', ' ', text)
-    return text.strip()
+def parse_message(msg_data):
+    """Turn a Gmail messages.get resource into the dict stored in the vector DB"""
+    return parse_messages([msg_data])[0]
 
 
 def read_emails(max_results=5):# increase the capacity
     """Fetch latest emails"""
     service = get_gmail_service()
-    results = service.users().messages().list(userId='me', maxResults=max_results).execute()
+    with span("gmail.list", **{"gmail.max_results": max_results}):
+        results = service.users().messages().list(userId='me', maxResults=max_results).execute()
     messages = results.get('messages', [])
-    emails = []
+    msg_datas = []
 
     for msg in messages:
-        msg_data = service.users().messages().get(userId='me', id=msg['id']).execute()
-        headers = msg_data['payload']['headers']
-        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), "No Subject")
-        sender = next((h['value'] for h in headers if h['name'] == 'From'), "Unknown Sender")
-
-        # Extract message body
-        body = ""
-        if 'data' in msg_data['payload']['body']:
-            body = base64.urlsafe_b64decode(msg_data['payload']['body']['data']).decode('utf-8', errors='ignore')
-        elif 'parts' in msg_data['payload']:
-            for part in msg_data['payload']['parts']:
-                if 'data' in part['body']:
-                    body += base64.urlsafe_b64decode(part['body']['data']).decode('utf-8', errors='ignore')
-
-        emails.append({
-            "subject": subject,
-            "from_email": sender,
-            "body": clean_text(body)
-        })
-    return emails
+        with span("gmail.get", **{"gmail.message_id": msg['id']}):
+            msg_datas.append(service.users().messages().get(userId='me', id=msg['id']).execute())
+    return parse_messages(msg_datas)
+
+
+def index_email(email, embedder, store, dedup=None):
+    """
+    Embed one parsed email and insert it with its metadata.
+    With a dedup.NearDuplicateIndex, near-duplicates of an indexed email are only recorded as
+    members of that representative (no embedding, no insert). Returns True if the email was stored.
+    """
+    with span("ingest.index_email", **{"gmail.message_id": email['id']}) as s:
+        if dedup is not None:
+            rep_id, is_new = dedup.add(email['id'], email['body'])
+            if not is_new:
+                s.set_attribute("dedup.representative", rep_id)
+                print(f"♻️ Skipped near-duplicate {email['id']} of {rep_id}: {email['subject'][:50]}")
+                return False
+        text_content = f"Subject: {email['subject']}\nFrom: {email['from_email']}\nBody: {email['body']}"
+        try:
+            embedding = embedder.embed(text_content)
+            store.insert_email(email['subject'], email['from_email'], email['body'], embedding,
+                               message_id=email['id'], thread_id=email['thread_id'],
+                               rfc_message_id=email['rfc_message_id'], date_ts=email['date_ts'],
+                               labels=email['labels'], snippet=email['snippet'])
+        except Exception:
+            if dedup is not None:
+                dedup.forget(email['id'])  # not stored: a retry must index it again
+            raise
+        return True
+
+
+def index_emails(emails, embedder, store, dedup=None):
+    """
+    Index a batch of parsed emails, skipping the ones already in the store (re-runs overlap,
+    and short bodies are never recorded by the near-duplicate index). The dedup index is saved
+    even when an email fails, so representatives stored before the failure are kept.
+    Returns the number of emails stored.
+    """
+    stored = store.existing_message_ids([email['id'] for email in emails])
+    if stored:
+        print(f"⏭️ Skipping {len(stored)} already indexed email(s)")
+    indexed = 0
+    try:
+        for email in emails:
+            if email['id'] not in stored:
+                indexed += index_email(email, embedder, store, dedup)
+    finally:
+        if dedup is not None:
+            dedup.save()
+    return indexed
 
 
 # ============================================================
 # Main Pipeline
 # ============================================================
 
-if __name__ == "__main__":
-    print("📩 Fetching Gmail messages...")
-    emails = read_emails(max_results=5)
-    print(f"✅ Retrieved {len(emails)} emails.")
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Embed the newest Gmail messages into the vector store")
+    parser.add_argument("--max", type=int, default=5, help="how many recent emails to index")
+    args = parser.parse_args(argv)
 
-    embedder = OllamaEmbedder()
-    store = GmailVectorStore(dim=768)  # 768 is embedding size for nomic-embed-text
+    # One root span per run, so every message of the batch lands in the same trace
+    with span("ingest.run", **{"ingest.max": args.max}) as run_span:
+        print("📩 Fetching Gmail messages...")
+        emails = read_emails(max_results=args.max)
+        print(f"✅ Retrieved {len(emails)} emails.")
 
-    for email in emails:
-        text_content = f"Subject: {email['subject']}\nFrom: {email['from_email']}\nBody: {email['body']}"
-        embedding = embedder.embed(text_content)
-        store.insert_email(email['subject'], email['from_email'], email['body'], embedding)
+        embedder = OllamaEmbedder()
+        store = open_vector_store(dim=768)  # 768 is embedding size for nomic-embed-text; VECTOR_BACKEND=local skips Milvus
+
+        dedup = NearDuplicateIndex()
+        indexed = index_emails(emails, embedder, store, dedup)
+        run_span.set_attributes(**{"ingest.messages": len(emails), "ingest.indexed": indexed})
+        print(f"🧮 Near-duplicate index: {dedup.stats()}")
 
     print("✅ All Gmail emails embedded and stored in Milvus.")
 
 
+if __name__ == "__main__":
+    main()
+
+
 
 
 
@@ -0,0 +1,334 @@
+# reply_service.py
+"""
+Long-running reply service:
+new-message events → durable SQLite job queue → N generation workers → reply drafts.
+
+- Jobs are keyed by Gmail message id, so a message is queued (and drafted) at most once. The
+  Gmail draft id is stored with the job: a retry (or a restart after a crash) updates that
+  draft instead of creating a second one, and a failed attempt deletes its partial draft.
+- Failed generations are retried with exponential backoff + jitter, up to --max-attempts.
+- Several processes can share the queue (e.g. this service and the API enqueueing from Gmail
+  push): a job is claimed inside an IMMEDIATE transaction, so only one of them gets it.
+- Running jobs carry their owner and a heartbeat; jobs whose owner stopped heartbeating
+  (crashed process) are put back in the queue, jobs of live processes are left alone.
+- With --save-drafts each reply is written to Gmail as a threaded draft while it streams.
+- A reply pre-generated by pregen.py (--pregen-cache) is used instead of generating again,
+  and the draft pregen already wrote for it is kept rather than duplicated.
+- Gmail auth, the embedder and the vector store are set up once per process, not per email.
+- With TRACE_FILE set, each job's spans continue the trace that enqueued it (see tracing.py).
+
+Usage:
+    python reply_service.py --workers 2 --poll-interval 30
+"""
+
+import argparse
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+from embedder import OllamaEmbedder
+from vector_store import open_vector_store
+from gmail_client import COMPOSE_SCOPES, get_credentials, get_gmail_service
+from smart_reply import get_email, format_email_text, get_similar_context, generate_reply_with_ollama
+from draft_writer import DraftWriter
+from pregen import DEFAULT_CACHE as PREGEN_CACHE, ReplyCache
+from tracing import span, current_traceparent
+
+DB_PATH = "data/reply_jobs.sqlite3"
+
+PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+
+HEARTBEAT = 30.0     # seconds between heartbeats of a process's running jobs
+STALE_AFTER = 120.0  # a running job without heartbeat for this long belongs to a dead process
+
+
+class ReplyJobQueue:
+    """
+    SQLite-backed job queue, safe to share between worker threads and between processes.
+    Each instance has its own owner id; it is recorded on the jobs it claims.
+    """
+
+    def __init__(self, path: str = DB_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                message_id  TEXT PRIMARY KEY,
+                status      TEXT NOT NULL,
+                attempts    INTEGER NOT NULL DEFAULT 0,
+                next_run_at REAL NOT NULL,
+                created_at  REAL NOT NULL,
+                updated_at  REAL NOT NULL,
+                reply       TEXT,
+                error       TEXT,
+                traceparent TEXT,
+                draft_id    TEXT,
+                owner       TEXT
+            )""")
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        for column in ("traceparent", "draft_id", "owner"):  # queues created by older versions
+            if column not in columns:
+                self._db.execute(f"ALTER TABLE jobs ADD COLUMN {column} TEXT")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, next_run_at)")
+
+    def enqueue(self, message_id: str) -> bool:
+        """Queue a message for drafting. Returns False if it was already queued or drafted."""
+        now = time.time()
+        with self._lock:
+            cur = self._db.execute(
+                "INSERT OR IGNORE INTO jobs (message_id, status, next_run_at, created_at, updated_at, traceparent) "
+                "VALUES (?, ?, ?, ?, ?, ?)", (message_id, PENDING, now, now, now, current_traceparent()))
+        return cur.rowcount == 1
+
+    def claim(self):
+        """Atomically take the oldest ready job. Returns (message_id, attempts, traceparent) or None."""
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE takes the write lock before the SELECT, so two processes cannot
+            # both see the same pending row.
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT message_id, attempts, traceparent FROM jobs WHERE status = ? AND next_run_at <= ? "
+                    "ORDER BY next_run_at LIMIT 1", (PENDING, now)).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ?, owner = ? "
+                        "WHERE message_id = ?", (RUNNING, now, self.owner, row[0]))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return None if row is None else (row[0], row[1] + 1, row[2])
+
+    # complete/fail only touch jobs this instance still owns: a job that was re-queued as
+    # stale and claimed by another process is not overwritten by the late original worker.
+
+    def complete(self, message_id: str, reply: str):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, reply = ?, error = NULL, updated_at = ? "
+                "WHERE message_id = ? AND owner = ?", (DONE, reply, time.time(), message_id, self.owner))
+
+    def fail(self, message_id: str, error: str, retry_in=None):
+        """Record a failure; retry_in=None marks the job permanently failed."""
+        now = time.time()
+        with self._lock:
+            if retry_in is None:
+                self._db.execute(
+                    "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE message_id = ? AND owner = ?",
+                    (FAILED, error, now, message_id, self.owner))
+            else:
+                self._db.execute(
+                    "UPDATE jobs SET status = ?, error = ?, next_run_at = ?, updated_at = ? "
+                    "WHERE message_id = ? AND owner = ?", (PENDING, error, now + retry_in, now, message_id, self.owner))
+
+    def heartbeat(self) -> int:
+        """Mark this instance's running jobs as alive (ReplyWorkerPool calls it every HEARTBEAT s)."""
+        with self._lock:
+            cur = self._db.execute("UPDATE jobs SET updated_at = ? WHERE status = ? AND owner = ?",
+                                   (time.time(), RUNNING, self.owner))
+        return cur.rowcount
+
+    def requeue_stale(self, stale_after: float = STALE_AFTER) -> int:
+        """Put jobs whose process stopped heartbeating (crashed) back in the queue."""
+        now = time.time()
+        with self._lock:
+            cur = self._db.execute(
+                "UPDATE jobs SET status = ?, next_run_at = ?, updated_at = ?, owner = NULL "
+                "WHERE status = ? AND updated_at < ?", (PENDING, now, now, RUNNING, now - stale_after))
+        return cur.rowcount
+
+    def status(self, message_id: str):
+        """The job's status, or None if the message was never queued."""
+        with self._lock:
+            row = self._db.execute("SELECT status FROM jobs WHERE message_id = ?", (message_id,)).fetchone()
+        return row[0] if row else None
+
+    def draft_id(self, message_id: str):
+        with self._lock:
+            row = self._db.execute("SELECT draft_id FROM jobs WHERE message_id = ?", (message_id,)).fetchone()
+        return row[0] if row else None
+
+    def set_draft_id(self, message_id: str, draft_id):
+        with self._lock:
+            self._db.execute("UPDATE jobs SET draft_id = ?, updated_at = ? WHERE message_id = ?",
+                             (draft_id, time.time(), message_id))
+
+    def counts(self) -> dict:
+        with self._lock:
+            return dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+
+class ReplyWorkerPool:
+    """Runs `workers` threads that drain the queue and generate replies."""
+
+    def __init__(self, queue: ReplyJobQueue, workers: int = 2, max_attempts: int = 5,
+                 base_delay: float = 2.0, max_delay: float = 300.0, idle_sleep: float = 1.0,
+                 save_drafts: bool = False, pregen_cache: str = None):
+        self.queue = queue
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.idle_sleep = idle_sleep
+        self.save_drafts = save_drafts
+        self.pregen_cache = pregen_cache
+        self.embedder = OllamaEmbedder()
+        self.store = open_vector_store(dim=768)
+        self._stop = threading.Event()
+        self._threads = []
+
+    def backoff(self, attempts: int) -> float:
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _pregenerated(self, message_id: str, email_of):
+        """The reply pregen.py cached for the message (its draft reused), or None."""
+        cached = ReplyCache(self.pregen_cache).entry(message_id) if self.pregen_cache else None
+        if cached is None:
+            return None
+        if cached.get("draft_id"):
+            self.queue.set_draft_id(message_id, cached["draft_id"])
+        elif self.save_drafts:
+            writer = DraftWriter(email_of(), draft_id=self.queue.draft_id(message_id),
+                                 on_draft=lambda draft_id: self.queue.set_draft_id(message_id, draft_id))
+            writer.close(cached["reply"])
+        print(f"⚡ Using the reply pre-generated for {message_id}")
+        return cached["reply"]
+
+    def process(self, message_id: str) -> str:
+        service = get_gmail_service()  # one service per worker thread
+        reply = self._pregenerated(message_id, lambda: get_email(service, message_id))
+        if reply is not None:
+            return reply
+        email = get_email(service, message_id)
+        email_text = format_email_text(email)
+        context = get_similar_context(email_text, embedder=self.embedder, store=self.store)
+        if not self.save_drafts:
+            return generate_reply_with_ollama(email_text, context, echo=False, raise_errors=True)
+        writer = DraftWriter(email, draft_id=self.queue.draft_id(message_id),
+                             on_draft=lambda draft_id: self.queue.set_draft_id(message_id, draft_id))
+        try:
+            reply = generate_reply_with_ollama(email_text, context, echo=False, raise_errors=True,
+                                               on_chunk=writer.write)
+            writer.close(reply)
+        except Exception:
+            try:
+                writer.discard()  # no half-written draft left behind
+                self.queue.set_draft_id(message_id, None)
+            except Exception as e:
+                # the id stays with the job, so the retry overwrites this draft
+                print(f"⚠️ Could not delete draft {writer.draft_id} of {message_id}: {e}")
+            raise
+        return reply
+
+    def _run(self):
+        while not self._stop.is_set():
+            job = self.queue.claim()
+            if job is None:
+                self._stop.wait(self.idle_sleep)
+                continue
+            message_id, attempts, traceparent = job
+            try:
+                with span("reply.job", parent=traceparent, **{"gmail.message_id": message_id,
+                                                              "job.attempt": attempts}):
+                    reply = self.process(message_id)
+            except Exception as e:
+                if attempts >= self.max_attempts:
+                    self.queue.fail(message_id, str(e))
+                    print(f"❌ Giving up on {message_id} after {attempts} attempts: {e}")
+                else:
+                    delay = self.backoff(attempts)
+                    self.queue.fail(message_id, str(e), retry_in=delay)
+                    print(f"⚠️ {message_id} failed (attempt {attempts}), retrying in {delay:.1f}s: {e}")
+                continue
+            self.queue.complete(message_id, reply)
+            print(f"💬 Drafted reply for {message_id} ({len(reply)} chars)")
+
+    def _heartbeat(self):
+        while not self._stop.wait(HEARTBEAT):
+            self.queue.heartbeat()
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"reply-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        t = threading.Thread(target=self._heartbeat, name="reply-heartbeat", daemon=True)
+        t.start()
+        self._threads.append(t)
+
+    def stop(self, timeout: float = None):
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout)
+
+
+def poll_new_messages(queue: ReplyJobQueue, service, max_results: int = 10) -> int:
+    """Feed the queue from the newest inbox messages; already-known ids are ignored."""
+    with span("gmail.list", **{"gmail.max_results": max_results}):
+        resp = service.users().messages().list(userId='me', labelIds=['INBOX'], maxResults=max_results).execute()
+    return sum(queue.enqueue(m['id']) for m in resp.get('messages', []))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Draft replies for new Gmail messages with a worker pool")
+    parser.add_argument("--workers", type=int, default=2, help="number of generation workers")
+    parser.add_argument("--poll-interval", type=float, default=30.0,
+                        help="seconds between inbox polls (0 = only drain the existing queue)")
+    parser.add_argument("--max-attempts", type=int, default=5)
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--save-drafts", action="store_true",
+                        help="write each reply to Gmail as a draft while it streams (needs gmail.compose)")
+    parser.add_argument("--pregen-cache", default=PREGEN_CACHE,
+                        help="replies pre-generated by pregen.py to use instead of generating ('' = off)")
+    args = parser.parse_args(argv)
+
+    if args.save_drafts:
+        get_credentials(COMPOSE_SCOPES)  # ask for consent now, not from a worker thread
+    queue = ReplyJobQueue(args.db)
+    stale = queue.requeue_stale()
+    if stale:
+        print(f"🔁 Re-queued {stale} interrupted jobs")
+
+    pool = ReplyWorkerPool(queue, workers=args.workers, max_attempts=args.max_attempts,
+                           save_drafts=args.save_drafts, pregen_cache=args.pregen_cache)
+    pool.start()
+    service = get_gmail_service() if args.poll_interval > 0 else None
+    print(f"🚀 Reply service running with {args.workers} workers")
+    try:
+        while True:
+            stale = queue.requeue_stale()  # jobs of a process that died meanwhile
+            if stale:
+                print(f"🔁 Re-queued {stale} interrupted jobs")
+            if args.poll_interval > 0:
+                try:
+                    added = poll_new_messages(queue, service)
+                    if added:
+                        print(f"📩 Queued {added} new messages")
+                except Exception as e:  # e.g. a transient Gmail HttpError or socket timeout: poll again later
+                    print(f"⚠️ Poll failed: {e}")
+                time.sleep(args.poll_interval)
+            else:
+                time.sleep(5)
+                counts = queue.counts()
+                if not counts.get(PENDING) and not counts.get(RUNNING):
+                    break
+    except KeyboardInterrupt:
+        print("\n🛑 Stopping reply service...")
+    finally:
+        pool.stop(timeout=10)
+        print(f"📊 Jobs: {queue.counts()}")
+
+
+if __name__ == "__main__":
+    main()
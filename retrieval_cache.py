@@ -0,0 +1,181 @@
+# retrieval_cache.py
+"""
+Two-level cache for smart_reply.get_similar_context:
+
+1. query vectors:  (embedding model, sha256 of the email text)             → embedding
+2. hit lists:      (store.cache_key, store.generation, sha256 of the vector, limit, filters)
+                   → search hits
+
+Drafting the same message again (another prompt, another model, a reply-service retry)
+then costs neither an embedding call nor a vector search. The process-wide cache also keeps
+query vectors in a small SQLite file (data/query_vectors.sqlite3), so separate smart_reply
+runs while iterating on a prompt skip the embedding call too. Every vector store bumps its
+`generation` on insert_email, which makes all hit lists cached for that store unreachable,
+so a newly indexed email is visible to the next search. The local backend's generation is
+its on-disk row count, so that holds for inserts from other processes too; with Milvus,
+inserts made by *another* process are only picked up when the (short) hit-list TTL runs out.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+VECTOR_DB = "data/query_vectors.sqlite3"
+
+
+class TTLCache:
+    """Thread-safe LRU mapping with a per-entry time-to-live."""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DiskVectorCache:
+    """
+    Persistent (model, text digest) → embedding map shared by every process. Embeddings only
+    change with the model, which is part of the key, so entries do not expire; the least
+    recently used ones are dropped beyond max_entries.
+    """
+
+    def __init__(self, path: str = VECTOR_DB, max_entries: int = 10000):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS vectors (
+                model     TEXT NOT NULL,
+                digest    TEXT NOT NULL,
+                vec       BLOB NOT NULL,
+                used_at   REAL NOT NULL,
+                PRIMARY KEY (model, digest)
+            )""")
+
+    def get(self, model: str, digest: str):
+        with self._lock:
+            row = self._db.execute("SELECT vec FROM vectors WHERE model = ? AND digest = ?",
+                                   (model, digest)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE vectors SET used_at = ? WHERE model = ? AND digest = ?",
+                             (time.time(), model, digest))
+        return array("d", row[0]).tolist()
+
+    def put(self, model: str, digest: str, vec):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO vectors (model, digest, vec, used_at) VALUES (?, ?, ?, ?)",
+                             (model, digest, array("d", vec).tobytes(), time.time()))
+            self._db.execute("DELETE FROM vectors WHERE rowid IN (SELECT rowid FROM vectors "
+                             "ORDER BY used_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _filters_key(filters: dict):
+    return tuple(sorted((k, tuple(sorted(v)) if isinstance(v, (list, tuple, set)) else v)
+                        for k, v in filters.items() if v is not None))
+
+
+class RetrievalCache:
+    """
+    vector_ttl can be long (an embedding only changes with the model, which is part of the
+    key); hits_ttl bounds how stale results can be with respect to other writers.
+    vector_db (a path) adds a DiskVectorCache behind the in-memory query vectors.
+    """
+
+    def __init__(self, max_entries: int = 1024, vector_ttl: float = 24 * 3600, hits_ttl: float = 300.0,
+                 vector_db: str = None):
+        self.vectors = TTLCache(max_entries, vector_ttl)
+        self.hit_lists = TTLCache(max_entries, hits_ttl)
+        self.disk = DiskVectorCache(vector_db) if vector_db else None
+
+    def query_vector(self, text: str, embedder):
+        key = (getattr(embedder, "model", type(embedder).__name__), _digest(text.encode("utf-8")))
+        vec = self.vectors.get(key)
+        if vec is None and self.disk is not None:
+            vec = self.disk.get(*key)
+            if vec is not None:
+                self.vectors.put(key, vec)
+        if vec is None:
+            vec = embedder.embed(text)
+            self.vectors.put(key, vec)
+            if self.disk is not None:
+                self.disk.put(*key, vec)
+        return vec
+
+    def search(self, store, query_embedding, limit: int, **filters):
+        key = (getattr(store, "cache_key", id(store)), getattr(store, "generation", 0),
+               _digest(array("f", query_embedding).tobytes()),
+               limit, _filters_key(filters))
+        hits = self.hit_lists.get(key)
+        if hits is None:
+            hits = list(store.search_similar(query_embedding, limit=limit, **filters))
+            self.hit_lists.put(key, hits)
+        return hits
+
+    def clear(self):
+        self.vectors.clear()
+        self.hit_lists.clear()
+
+    def stats(self) -> dict:
+        return {name: {"entries": len(c), "hits": c.hits, "misses": c.misses}
+                for name, c in (("vectors", self.vectors), ("hit_lists", self.hit_lists))}
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_cache() -> RetrievalCache:
+    """
+    Process-wide cache used by get_similar_context unless another one is passed. Query
+    vectors persist in VECTOR_DB (QUERY_VECTOR_DB overrides the path, an empty value disables it).
+    """
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = RetrievalCache(vector_db=os.environ.get("QUERY_VECTOR_DB", VECTOR_DB))
+        return _default
@@ -5,85 +5,88 @@ Fetches a new Gmail message, retrieves similar emails from Milvus,
 and drafts a contextual reply using Ollama.
 """
 
-import base64
-import re
-import requests
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-import pickle, os
-
+from email_text import normalize_body
 from embedder import OllamaEmbedder
-from vector_store import GmailVectorStore
-
-
-SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
-
-# ============================================================
-# Gmail setup
-# ============================================================
-def get_gmail_service():
-    """Authenticate and return Gmail API service (JSON token format)"""
-    from google.oauth2.credentials import Credentials
-    creds = None
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        # Save the credentials for next run
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
-    return build('gmail', 'v1', credentials=creds)
-
-
-def clean_text(text):
-    text = re.sub(r'<[^>]+>', '', text)
-    text = re.sub(r'\s+', ' ', text)
-    return text.strip()
-
-
-def get_latest_email():
-    """Fetch the most recent email"""
-    service = get_gmail_service()
-    result = service.users().messages().list(userId='me', maxResults=1).execute()
-    message_id = result['messages'][0]['id']
-    msg = service.users().messages().get(userId='me', id=message_id).execute()
+from ollama_client import get_client
+from dedup import collapse_hits
+from retrieval_cache import default_cache
+from vector_store import open_vector_store
+from gmail_client import get_gmail_service
+from tracing import span
+
+# extra hits fetched so near-duplicates can be dropped (see get_similar_context)
+DEDUP_MARGIN = 3
+
+
+def get_email(service, message_id):
+    """
+    Fetch one message by id and return it as {id, thread_id, subject, from_email, body} plus
+    the reply_to / rfc_message_id / references headers needed to thread a reply draft, its
+    labels, and whether it is bulk/automated mail (List-Unsubscribe, Precedence, Auto-Submitted).
+    """
+    with span("gmail.get", **{"gmail.message_id": message_id}):
+        msg = service.users().messages().get(userId='me', id=message_id).execute()
 
     headers = msg['payload']['headers']
     subject = next((h['value'] for h in headers if h['name'] == 'Subject'), "No Subject")
     sender = next((h['value'] for h in headers if h['name'] == 'From'), "Unknown Sender")
+    header = {h['name'].lower(): h['value'] for h in headers}
 
-    body = ""
-    if 'data' in msg['payload']['body']:
-        body = base64.urlsafe_b64decode(msg['payload']['body']['data']).decode('utf-8', errors='ignore')
-    elif 'parts' in msg['payload']:
-        for part in msg['payload']['parts']:
-            if 'data' in part['body']:
-                body += base64.urlsafe_b64decode(part['body']['data']).decode('utf-8', errors='ignore')
-
-    body = clean_text(body)
+    body = normalize_body(msg['payload'])
     return {
         "id": message_id,
+        "thread_id": msg.get('threadId', ""),
         "subject": subject,
         "from_email": sender,
-        "body": body
+        "body": body,
+        "reply_to": header.get('reply-to', ""),
+        "rfc_message_id": header.get('message-id', ""),
+        "references": header.get('references', ""),
+        "labels": msg.get('labelIds', []),
+        "bulk": bool(header.get('list-unsubscribe')
+                     or header.get('precedence', "").lower() in ("bulk", "list", "junk")
+                     or header.get('auto-submitted', "no").lower() != "no"),
     }
 
 
+def get_latest_email():
+    """Fetch the most recent email"""
+    service = get_gmail_service()
+    result = service.users().messages().list(userId='me', maxResults=1).execute()
+    return get_email(service, result['messages'][0]['id'])
+
+
+def format_email_text(email):
+    return f"Subject: {email['subject']}\nFrom: {email['from_email']}\nBody: {email['body']}"
+
+
 # ============================================================
 # Reply generation logic
 # ============================================================
 
-def get_similar_context(email_text, top_k=3):
-    """Retrieve similar emails from Milvus"""
-    embedder = OllamaEmbedder()
-    store = GmailVectorStore(dim=768)
-    qvec = embedder.embed(email_text)
-    hits = store.search_similar(qvec, limit=top_k)
+def get_similar_context(email_text, top_k=3, embedder=None, store=None, cache=None, **filters):
+    """
+    Retrieve similar emails from Milvus.
+    Pass embedder/store to reuse existing clients (the reply service does); otherwise new ones are created.
+    filters are passed to the vector store's search_similar (since_days, thread_id, sender_domain, labels).
+    Query vectors and hit lists are memoized in the process-wide retrieval_cache (or `cache`;
+    cache=False always embeds and searches).
+    """
+    if embedder is None:
+        embedder = OllamaEmbedder()
+    if store is None:  # not `or`: an empty LocalVectorStore is falsy (it defines __len__)
+        store = open_vector_store(dim=768)
+    if cache is None:
+        cache = default_cache()
+    # Over-fetch a little so near-duplicate hits (e.g. the same newsletter indexed before
+    # ingest-time dedup existed) can be collapsed without returning fewer than top_k.
+    if cache:
+        qvec = cache.query_vector(email_text, embedder)
+        hits = cache.search(store, qvec, top_k + DEDUP_MARGIN, **filters)
+    else:
+        qvec = embedder.embed(email_text)
+        hits = store.search_similar(qvec, limit=top_k + DEDUP_MARGIN, **filters)
+    hits = collapse_hits(hits, top_k)
 
     context_blocks = []
     for hit in hits:
@@ -94,10 +97,15 @@ def get_similar_context(email_text, top_k=3):
 
     return "\n".join(context_blocks)
 
-def generate_reply_with_ollama(email_text, similar_context):
-    """Generate a smart reply using Ollama LLM"""
-    import json
-    import requests
+def generate_reply_with_ollama(email_text, similar_context, echo=True, raise_errors=False, on_chunk=None):
+    """
+    Generate a smart reply using Ollama LLM.
+    echo streams tokens to the console; on_chunk(chunk) is called for every streamed token;
+    raise_errors re-raises Ollama failures (and empty replies) instead of returning a
+    placeholder, so callers such as the reply service can retry. Connection problems are
+    already retried by ollama_client before they get here.
+    """
+    import time
 
     payload = {
         "model": "mistral:instruct",   # or whichever model you have pulled {{{{{llama3}}}}}   
@@ -117,24 +125,42 @@ Write a short, polite, human-like reply for this email.
         "stream": True
     }
 
-    reply_text = ""
-    try:
-        with requests.post("http://localhost:11434/api/generate", json=payload, stream=True) as r:
-            for line in r.iter_lines():
-                if line:
-                    try:
-                        data = json.loads(line.decode("utf-8"))
-                        if "response" in data:
-                            chunk = data["response"]
-                            reply_text += chunk
-                            print(chunk, end="", flush=True)  # live stream to console
-                    except json.JSONDecodeError:
-                        continue
-        print("\n")
-    except Exception as e:
-        print(f"❌ Error generating reply: {e}")
+    parts = []  # joined once at the end instead of re-copying the reply on every token
+    with span("ollama.generate", **{"llm.model": payload["model"],
+                                    "prompt.bytes": len(payload["prompt"].encode("utf-8"))}) as trace_span:
+        start = time.perf_counter()
+        chunks = 0
+        try:
+            for data in get_client().generate(payload):
+                if data.get("done"):
+                    # Ollama reports token counts on the final chunk
+                    trace_span.set_attributes(**{
+                        "llm.prompt_tokens": data.get("prompt_eval_count"),
+                        "llm.completion_tokens": data.get("eval_count")})
+                if "response" in data:
+                    chunk = data["response"]
+                    if not chunks:
+                        trace_span.set_attribute("llm.ttft_ms", round((time.perf_counter() - start) * 1000, 3))
+                    chunks += 1
+                    parts.append(chunk)
+                    if on_chunk is not None:
+                        on_chunk(chunk)
+                    if echo:
+                        print(chunk, end="", flush=True)  # live stream to console
+            if echo:
+                print("\n")
+        except Exception as e:
+            trace_span.record_exception(e)
+            if raise_errors:
+                raise
+            print(f"❌ Error generating reply: {e}")
+        trace_span.set_attribute("llm.chunks", chunks)
+
+    reply_text = "".join(parts)
 
     if not reply_text.strip():
+        if raise_errors:
+            raise RuntimeError("Ollama returned an empty response")
         reply_text = "(No reply generated — model returned empty response.)"
 
     return reply_text.strip()
@@ -142,18 +168,50 @@ Write a short, polite, human-like reply for this email.
 # ============================================================
 # Main execution
 # ============================================================
-if __name__ == "__main__":
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Draft a reply to the latest email using similar past emails")
+    parser.add_argument("--save-draft", action="store_true",
+                        help="save the reply as a Gmail draft while it streams (needs gmail.compose)")
+    parser.add_argument("--fresh", action="store_true", help="ignore replies pre-generated by pregen.py")
+    args = parser.parse_args(argv)
+    if args.save_draft:
+        from gmail_client import COMPOSE_SCOPES, get_credentials
+        get_credentials(COMPOSE_SCOPES)  # consent up front rather than from the upload thread
+
     print("📩 Fetching latest email...")
     latest_email = get_latest_email()
-    email_text = f"Subject: {latest_email['subject']}\nFrom: {latest_email['from_email']}\nBody: {latest_email['body']}"
+    email_text = format_email_text(latest_email)
     print(f"✅ Got email: {latest_email['subject']} from {latest_email['from_email']}")
 
-    print("\n🔍 Retrieving similar context from Milvus...")
-    similar_context = get_similar_context(email_text)
-    print(f"✅ Retrieved related context ({len(similar_context)} chars)")
-
-    print("\n🧠 Generating reply using Ollama...")
-    reply = generate_reply_with_ollama(email_text, similar_context)
+    from pregen import ReplyCache
+    reply = None if args.fresh else ReplyCache().get(latest_email['id'])
+    if reply is not None:
+        print("\n⚡ Using the reply pre-generated by pregen.py (--fresh to regenerate)")
+        if args.save_draft:
+            from draft_writer import DraftWriter
+            print(f"📝 Saved Gmail draft {DraftWriter(latest_email).close(reply)}")
+    else:
+        print("\n🔍 Retrieving similar context from Milvus...")
+        similar_context = get_similar_context(email_text)
+        print(f"✅ Retrieved related context ({len(similar_context)} chars)")
+
+        print("\n🧠 Generating reply using Ollama...")
+        writer = None
+        if args.save_draft:
+            from draft_writer import DraftWriter
+            writer = DraftWriter(latest_email)
+        reply = generate_reply_with_ollama(email_text, similar_context,
+                                           on_chunk=writer.write if writer else None)
+        if writer is not None:
+            if writer.text().strip():
+                print(f"📝 Saved Gmail draft {writer.close(reply)}")
+            else:
+                writer.discard()
 
     print("\n💬 Suggested Reply:\n")
     print(reply)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+# sse_stream.py
+"""
+Server-sent-events plumbing for the streaming endpoints in ollamaconnect.py.
+
+A generation writes its tokens into a StreamBuffer (one per generation, filled by an asyncio
+task or a thread); every client connection reads it through sse_frames() from its own offset:
+
+- tokens are batched into frames: a frame is sent once `frame_chars` characters are waiting
+  or `frame_ms` after its first character, whichever comes first
+- frames are plain text (`event: token`, multi-line `data:`), no JSON per token
+- each frame's id is "<stream id>-<offset>", so a client that reconnects with the
+  Last-Event-ID header continues exactly after the last frame it received
+- the closing `event: done` frame carries {"model", "chars"} and the full text only when
+  the client asked for a summary
+"""
+
+import asyncio
+import bisect
+import json
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+RETENTION = 120.0     # seconds a finished stream stays resumable
+MAX_STREAMS = 256
+KEEPALIVE = 15.0      # idle seconds before a ": ping" comment keeps proxies from timing out
+
+
+class StreamBuffer:
+    """Append-only text of one generation (chunk list + end offsets, joined only on read)."""
+
+    def __init__(self, model: str = ""):
+        self.id = secrets.token_hex(8)
+        self.model = model
+        self.parts = []
+        self.ends = []
+        self.length = 0
+        self.done = False
+        self.error = None
+        self.finished_at = None
+        self._cond = threading.Condition()
+        self._waiters = []  # (loop, asyncio.Event, target length)
+
+    def append(self, text: str):
+        if not text:
+            return
+        with self._cond:
+            self.parts.append(text)
+            self.length += len(text)
+            self.ends.append(self.length)
+            self._wake()
+
+    def finish(self, error: str = None):
+        with self._cond:
+            self.done = True
+            self.error = error
+            self.finished_at = time.monotonic()
+            self._wake()
+
+    def _wake(self):
+        waiting = []
+        for loop, event, target in self._waiters:
+            if self.done or self.length >= target:
+                loop.call_soon_threadsafe(event.set)
+            else:
+                waiting.append((loop, event, target))
+        self._waiters = waiting
+
+    def read(self, offset: int):
+        """(text after offset, done) as one consistent snapshot."""
+        with self._cond:
+            i = bisect.bisect_right(self.ends, offset)
+            if i == len(self.parts):
+                return "", self.done
+            start = self.ends[i] - len(self.parts[i])
+            return self.parts[i][offset - start:] + "".join(self.parts[i + 1:]), self.done
+
+    def text(self) -> str:
+        with self._cond:
+            return "".join(self.parts)
+
+    async def wait(self, target: int, timeout: float):
+        """Wait until `target` characters exist, the stream ends, or timeout passes."""
+        event = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), event, target)
+        with self._cond:
+            if self.done or self.length >= target:
+                return
+            self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._cond:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+
+_streams = OrderedDict()
+_streams_lock = threading.Lock()
+
+
+def register(buf: StreamBuffer) -> StreamBuffer:
+    """Keep buf resumable; drops streams finished more than RETENTION seconds ago."""
+    now = time.monotonic()
+    with _streams_lock:
+        for stream_id, old in list(_streams.items()):
+            if old.done and now - old.finished_at > RETENTION:
+                del _streams[stream_id]
+        while len(_streams) >= MAX_STREAMS:
+            _streams.popitem(last=False)
+        _streams[buf.id] = buf
+    return buf
+
+
+def lookup(last_event_id: str):
+    """Last-Event-ID "<stream id>-<offset>" → (StreamBuffer, offset), or (None, 0)."""
+    stream_id, _, offset = (last_event_id or "").partition("-")
+    with _streams_lock:
+        buf = _streams.get(stream_id)
+    try:
+        return (buf, max(0, min(int(offset or 0), buf.length))) if buf else (None, 0)
+    except ValueError:
+        return None, 0
+
+
+def format_event(event: str, data: str, event_id: str = None) -> str:
+    lines = data.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    head = f"event: {event}\n" + (f"id: {event_id}\n" if event_id else "")
+    return head + "".join(f"data: {line}\n" for line in lines) + "\n"
+
+
+async def sse_frames(buf: StreamBuffer, offset: int = 0, frame_ms: int = 50, frame_chars: int = 64,
+                     summary: bool = False):
+    """Async iterator of SSE frames for buf starting at offset (see module docstring)."""
+    loop = asyncio.get_running_loop()
+    interval = frame_ms / 1000.0
+    frame_started = None
+    while True:
+        text, done = buf.read(offset)
+        now = loop.time()
+        if text and frame_started is None:
+            frame_started = now
+        if done or len(text) >= frame_chars or (text and now - frame_started >= interval):
+            if text:
+                offset += len(text)
+                frame_started = None
+                yield format_event("token", text, f"{buf.id}-{offset}")
+            if done:
+                final = {"model": buf.model, "chars": offset}
+                if buf.error:
+                    final["error"] = buf.error
+                if summary:
+                    final["full_response"] = buf.text()
+                yield format_event("done", json.dumps(final), f"{buf.id}-{offset}")
+                return
+            continue
+        if text:
+            await buf.wait(offset + frame_chars, interval - (now - frame_started))
+        else:
+            before = buf.length
+            await buf.wait(offset + 1, KEEPALIVE)
+            if buf.length == before and not buf.done:
+                yield ": ping\n\n"
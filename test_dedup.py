@@ -0,0 +1,92 @@
+# test_dedup.py
+import pytest
+
+from dedup import NearDuplicateIndex
+
+
+NEWSLETTER = " ".join(f"deal{i} on item{i} today only" for i in range(40))
+
+
+def test_near_duplicates_collapse_to_one_representative(tmp_path):
+    path = str(tmp_path / "dedup.json")
+    index = NearDuplicateIndex(path)
+    assert index.add("m1", NEWSLETTER) == ("m1", True)
+    assert index.add("m2", NEWSLETTER.replace("deal7", "offer7")) == ("m1", False)
+    assert index.add("m3", "A completely different message about the quarterly planning "
+                           "meeting, the budget review and who is presenting next week " * 2) == ("m3", True)
+    assert index.add("m2", NEWSLETTER) == ("m1", False)  # re-ingest is a no-op
+    index.save()
+
+    reloaded = NearDuplicateIndex(path)
+    assert reloaded.members("m1") == ["m1", "m2"]
+    assert reloaded.stats() == {"representatives": 2, "messages": 3, "collapsed": 1}
+
+
+def test_short_bodies_are_never_collapsed(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path / "dedup.json"))
+    assert index.add("a", "Thanks!") == ("a", True)
+    assert index.add("b", "Thanks!") == ("b", True)
+
+
+def test_failed_insert_is_not_skipped_on_retry(tmp_path):
+    from read_gmail_to_milvus import index_email
+
+    class FlakyEmbedder:
+        calls = 0
+
+        def embed(self, text):
+            self.calls += 1
+            if self.calls == 1:
+                raise ConnectionError("ollama down")
+            return [1.0, 0.0]
+
+    class Store:
+        rows = []
+
+        def insert_email(self, subject, from_email, body, embedding, **meta):
+            self.rows.append(meta["message_id"])
+
+    email = {"id": "m1", "subject": "Deals", "from_email": "shop@example.com", "body": NEWSLETTER,
+             "thread_id": "t1", "rfc_message_id": "", "date_ts": 0, "labels": ["INBOX"], "snippet": ""}
+    index, embedder, store = NearDuplicateIndex(str(tmp_path / "dedup.json")), FlakyEmbedder(), Store()
+    with pytest.raises(ConnectionError):
+        index_email(email, embedder, store, index)
+    assert index.stats()["messages"] == 0
+    assert index_email(email, embedder, store, index) is True
+    assert store.rows == ["m1"] and index.members("m1") == ["m1"]
+
+
+def test_batch_skips_stored_emails_and_saves_on_failure(tmp_path):
+    from read_gmail_to_milvus import index_emails
+
+    class Embedder:
+        def embed(self, text):
+            if "FAIL" in text:
+                raise ConnectionError("ollama down")
+            return [1.0, 0.0]
+
+    class Store:
+        def __init__(self):
+            self.rows = []
+
+        def insert_email(self, subject, from_email, body, embedding, **meta):
+            self.rows.append(meta["message_id"])
+
+        def existing_message_ids(self, ids):
+            return set(ids) & set(self.rows)
+
+    def email(msg_id, body, subject="Hi"):
+        return {"id": msg_id, "subject": subject, "from_email": "a@example.com", "body": body,
+                "thread_id": "t", "rfc_message_id": "", "date_ts": 0, "labels": ["INBOX"], "snippet": ""}
+
+    path = str(tmp_path / "dedup.json")
+    store = Store()
+    short = email("s1", "Thanks!")  # too short to be recorded by the dedup index
+    assert index_emails([short], Embedder(), store, NearDuplicateIndex(path)) == 1
+    assert index_emails([short], Embedder(), store, NearDuplicateIndex(path)) == 0  # re-run
+    assert store.rows == ["s1"]
+
+    with pytest.raises(ConnectionError):
+        index_emails([email("m1", NEWSLETTER), email("m2", "boom", subject="FAIL")],
+                     Embedder(), store, NearDuplicateIndex(path))
+    assert NearDuplicateIndex(path).members("m1") == ["m1"]  # saved despite the failure
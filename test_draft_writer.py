@@ -0,0 +1,97 @@
+# test_draft_writer.py
+import base64
+import email
+import email.policy
+import threading
+import time
+
+from draft_writer import DraftWriter, build_reply_message
+
+ORIGINAL = {
+    "id": "m1", "thread_id": "t1", "subject": "Quarterly numbers", "from_email": "Ann <ann@example.com>",
+    "reply_to": "", "rfc_message_id": "<abc@example.com>", "references": "<root@example.com>",
+}
+
+
+class FakeDrafts:
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def _call(self, kind, **kwargs):
+        with self.lock:
+            self.calls.append((kind, kwargs))
+        return self
+
+    def create(self, userId, body):
+        return self._call("create", body=body)
+
+    def update(self, userId, id, body):
+        return self._call("update", id=id, body=body)
+
+    def delete(self, userId, id):
+        return self._call("delete", id=id)
+
+    def execute(self):
+        return {"id": "d1"}
+
+    def users(self):
+        return self
+
+    def drafts(self):
+        return self
+
+
+def _text(call):
+    raw = base64.urlsafe_b64decode(call[1]["body"]["message"]["raw"])
+    return email.message_from_bytes(raw, policy=email.policy.default).get_content().strip()
+
+
+def test_reply_is_threaded():
+    message = build_reply_message(ORIGINAL, "Thanks!")
+    parsed = email.message_from_bytes(base64.urlsafe_b64decode(message["raw"]))
+    assert message["threadId"] == "t1"
+    assert parsed["To"] == "Ann <ann@example.com>"
+    assert parsed["Subject"] == "Re: Quarterly numbers"
+    assert parsed["In-Reply-To"] == "<abc@example.com>"
+    assert parsed["References"] == "<root@example.com> <abc@example.com>"
+
+
+def test_draft_created_on_first_chunk_and_finalised_on_close():
+    fake = FakeDrafts()
+    writer = DraftWriter(ORIGINAL, service=fake, min_interval=10, min_chars=5)
+    for word in ["Hi ", "Ann, ", "numbers ", "look ", "good."]:
+        writer.write(word)
+    assert writer.close("Hi Ann, numbers look good.") == "d1"
+
+    kinds = [kind for kind, _ in fake.calls]
+    assert kinds[0] == "create" and set(kinds[1:]) <= {"update"}
+    assert len(kinds) <= 3  # batched, not one call per chunk
+    assert _text(fake.calls[-1]) == "Hi Ann, numbers look good."
+
+
+def test_discard_deletes_the_draft():
+    fake = FakeDrafts()
+    writer = DraftWriter(ORIGINAL, service=fake)
+    writer.write("partial")
+    deadline = time.monotonic() + 5
+    while writer.draft_id is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    writer.discard()
+    assert fake.calls[-1] == ("delete", {"id": "d1"})
+
+
+def test_existing_draft_is_updated_and_recreated_if_gone():
+    import httplib2
+    from googleapiclient.errors import HttpError
+
+    class GoneDrafts(FakeDrafts):
+        def update(self, userId, id, body):
+            self._call("update", id=id, body=body)
+            raise HttpError(httplib2.Response({"status": 404}), b"not found")
+
+    created = []
+    fake = GoneDrafts()
+    writer = DraftWriter(ORIGINAL, service=fake, draft_id="d0", on_draft=created.append)
+    assert writer.close("Hello") == "d1"
+    assert [kind for kind, _ in fake.calls] == ["update", "create"] and created == ["d1"]
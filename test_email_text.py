@@ -0,0 +1,86 @@
+# test_email_text.py
+import base64
+
+from email_text import html_to_text, normalize_bodies, normalize_body, normalize_text, pick_best_alternative
+
+
+def _part(mime, text):
+    return {"mimeType": mime, "body": {"data": base64.urlsafe_b64encode(text.encode()).decode()}}
+
+
+def test_html_to_text_drops_markup_scripts_and_entities():
+    html = ("<html><head><style>.a{color:red}</style></head><body><p>Tom &amp; Jerry&nbsp;say hi</p>"
+            "<script>alert(1)</script><div>one<br>two</div></body></html>")
+    assert normalize_text(html) == "Tom & Jerry say hi\n\none\ntwo"
+    assert "alert" not in html_to_text(html)
+
+
+def test_quoted_history_and_signature_are_stripped():
+    text = ("Works for me, thanks!\n\n-- \nBob\n\n"
+            "On Tue, Oct 7, 2025 at 10:48 AM Jane <jane@x.com> wrote:\n> Can we meet at 4?\n")
+    assert normalize_text(text) == "Works for me, thanks!"
+
+    html = '<div>Sounds good.</div><div class="gmail_quote">On Mon wrote:<blockquote>old</blockquote></div>'
+    assert normalize_text(html) == "Sounds good."
+
+
+def test_bare_forward_keeps_forwarded_content():
+    html = '<div class="gmail_quote">---------- Forwarded message ---------<br>Hello there</div>'
+    assert "Hello there" in normalize_text(html)
+
+
+def test_best_alternative_instead_of_concatenation():
+    payload = {"mimeType": "multipart/alternative", "parts": [
+        _part("text/plain", "Plain version of the message body, long enough to be real."),
+        _part("text/html", "<p>Plain version of the message body, long enough to be real.</p>"),
+    ]}
+    assert pick_best_alternative(payload)[1] == "text/plain"
+    assert normalize_body(payload) == "Plain version of the message body, long enough to be real."
+
+    stub = {"mimeType": "multipart/alternative", "parts": [
+        _part("text/plain", "View in browser"),
+        _part("text/html", "<p>" + "Big sale on everything today. " * 20 + "</p>"),
+    ]}
+    assert pick_best_alternative(stub)[1] == "text/html"
+
+
+def test_calendar_and_other_text_parts_are_not_body():
+    payload = {"mimeType": "multipart/mixed", "parts": [
+        _part("text/plain", "Invitation: planning meeting on Friday at 10, see you there."),
+        _part("text/calendar", "BEGIN:VCALENDAR\nMETHOD:REQUEST\nEND:VCALENDAR"),
+    ]}
+    assert normalize_body(payload) == "Invitation: planning meeting on Friday at 10, see you there."
+
+
+def test_wrapped_reply_header_and_underscore_rules():
+    wrapped = ("Fine by me.\n\nOn Tue, Oct 7, 2025 at 10:48 AM Jane Doe <\n"
+               "jane@example.com> wrote:\nCan we meet at 4?\n")
+    assert normalize_text(wrapped) == "Fine by me."
+
+    apple = "Yes.\n\nOn Oct 7, 2025, at 10:48, Jane wrote:\n\nOld text"
+    assert normalize_text(apple) == "Yes."
+
+    prose = "Hi team,\nOn Friday we ship the release.\nAs Jane wrote:\nthe freeze starts Monday."
+    assert normalize_text(prose) == prose
+    assert normalize_text("Hi,\nOn the topic of budgets, Jane wrote:\nwe are fine.").endswith("we are fine.")
+
+    table = "See the table below\n____________\nrow1 42\nrow2 17"
+    assert normalize_text(table) == table
+
+    outlook = "Approved.\n\n________________________________\nFrom: Jane\nSent: Monday\nTo: Bob\nold text"
+    assert normalize_text(outlook) == "Approved."
+
+
+def test_batch_matches_single_message_normalization(monkeypatch):
+    import email_text
+
+    html = _part("text/html", "<p>Weekly digest</p><p>" + "News item. " * 30 + "</p>")
+    plain = _part("text/plain", "Thanks, see you Friday!\n\nOn Mon, Oct 6, 2025 at 9:00 AM Bob wrote:\n> hi")
+    payloads = [html, plain, html]
+    expected = [normalize_body(p) for p in payloads]
+
+    calls = []
+    real = email_text.normalize_text
+    monkeypatch.setattr(email_text, "normalize_text", lambda *a, **kw: calls.append(1) or real(*a, **kw))
+    assert normalize_bodies(payloads) == expected
+    assert expected[1] == "Thanks, see you Friday!" and len(calls) == 2  # the repeated digest once
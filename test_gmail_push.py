@@ -0,0 +1,128 @@
+# test_gmail_push.py
+import base64
+
+import pytest
+
+np = pytest.importorskip("numpy")
+httplib2 = pytest.importorskip("httplib2")
+from googleapiclient.errors import HttpError
+
+from gmail_push import HistoryCursor, PushIngestor, fetch_new_message_ids
+from local_vector_store import LocalVectorStore
+
+
+def _message(msg_id, labels=("INBOX",)):
+    body = base64.urlsafe_b64encode(f"Body of {msg_id}".encode()).decode()
+    return {"id": msg_id, "threadId": msg_id, "labelIds": list(labels), "internalDate": "0",
+            "payload": {"mimeType": "text/plain", "body": {"data": body},
+                        "headers": [{"name": "Subject", "value": f"Subject {msg_id}"},
+                                    {"name": "From", "value": "a@example.com"}]}}
+
+
+class _Call:
+    def __init__(self, fn):
+        self.fn = fn
+
+    def execute(self):
+        return self.fn()
+
+
+class FakeGmail:
+    """history().list / messages().list / messages().get over an in-memory mailbox."""
+
+    def __init__(self, messages, history_expired=False):
+        self.by_id = {m["id"]: m for m in messages}
+        self.history_expired = history_expired
+        self.history_calls = []
+        self.fail_get = set()
+
+    def users(self):
+        return self
+
+    def history(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def list(self, userId="me", startHistoryId=None, labelId=None, labelIds=None, pageToken=None, **kwargs):
+        if startHistoryId is None:  # messages().list
+            return _Call(lambda: {"messages": [{"id": m["id"]} for m in self.by_id.values()
+                                               if set(labelIds or []) <= set(m["labelIds"])]})
+
+        def history():
+            self.history_calls.append(labelId)
+            if self.history_expired:
+                raise HttpError(httplib2.Response({"status": 404}), b"expired")
+            return {"historyId": "200", "history": [
+                {"messagesAdded": [{"message": {"id": m["id"], "labelIds": m["labelIds"]}}]}
+                for m in self.by_id.values() if labelId is None or labelId in m["labelIds"]]}
+        return _Call(history)
+
+    def get(self, userId="me", id=None, **kwargs):
+        def get():
+            if id in self.fail_get:
+                raise ConnectionError("transient")
+            return self.by_id[id]
+        return _Call(get)
+
+
+class Embedder:
+    fail_on_call = None  # raise on this (1-based) call
+
+    def __init__(self):
+        self.calls = 0
+
+    def embed(self, text):
+        self.calls += 1
+        if self.calls == self.fail_on_call:
+            raise ConnectionError("ollama down")
+        return [1.0, 0.0, 0.0, 0.0]
+
+
+def _ingestor(tmp_path, service):
+    cursor = HistoryCursor(str(tmp_path / "cursor.json"))
+    cursor.save(100)
+    store = LocalVectorStore(dim=4, path=str(tmp_path / "store"))
+    return PushIngestor(service, Embedder(), store, cursor), store
+
+
+def test_cursor_round_trip(tmp_path):
+    cursor = HistoryCursor(str(tmp_path / "cursor.json"))
+    assert cursor.load() is None and cursor.updated() is None
+    cursor.save(42)
+    assert cursor.load() == "42" and cursor.updated() > 0
+
+
+def test_only_inbox_messages_are_fetched():
+    service = FakeGmail([_message("in1"), _message("draft1", ["DRAFT"]), _message("sent1", ["SENT"]),
+                         _message("in2", ["INBOX", "DRAFT"])])
+    assert fetch_new_message_ids(service, 100) == (["in1"], "200")
+    assert service.history_calls == ["INBOX"]
+
+
+def test_retry_after_partial_failure_does_not_duplicate(tmp_path):
+    service = FakeGmail([_message("m1"), _message("m2")])
+    ingestor, store = _ingestor(tmp_path, service)
+    service.fail_get = {"m2"}
+    with pytest.raises(ConnectionError):
+        ingestor.handle_notification(150)
+    assert ingestor.cursor.load() == "100"  # not advanced
+
+    service.fail_get = set()
+    ingestor.embedder.fail_on_call = 2  # m1 is stored, m2 fails
+    with pytest.raises(ConnectionError):
+        ingestor.handle_notification(150)
+    assert [m["message_id"] for m in store.meta] == ["m1"] and ingestor.cursor.load() == "100"
+
+    assert ingestor.handle_notification(150) == 1
+    assert [m["message_id"] for m in store.meta] == ["m1", "m2"]
+    assert ingestor.cursor.load() == "200"
+
+
+def test_expired_history_falls_back_to_full_listing(tmp_path):
+    service = FakeGmail([_message("m1"), _message("s1", ["SENT"])], history_expired=True)
+    ingestor, store = _ingestor(tmp_path, service)
+    assert ingestor.handle_notification(300) == 1
+    assert [m["message_id"] for m in store.meta] == ["m1"]
+    assert ingestor.cursor.load() == "300"
@@ -1,6 +1,6 @@
 # test_gmail_vector_pipeline.py
 from embedder import OllamaEmbedder
-from vector_store import GmailVectorStore
+from vector_store import open_vector_store
 
 embedder = OllamaEmbedder()
 text1 = "Subject: Meeting update\nBody: The client meeting is moved to 4 PM."
@@ -12,7 +12,7 @@ vec1 = embedder.embed(text1)
 vec2 = embedder.embed(text2)
 vec3 = embedder.embed(text3)
 
-store = GmailVectorStore(dim=len(vec1))
+store = open_vector_store(dim=len(vec1))
 
 # Insert into Milvus
 store.insert_email("Meeting update", "team@company.com", text1, vec1)
@@ -0,0 +1,51 @@
+# test_inspect_milvus_data.py
+import json
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import inspect_milvus_data
+from local_vector_store import LocalVectorStore
+
+
+def _store(tmp_path):
+    store = LocalVectorStore(dim=4, path=str(tmp_path / "store"))
+    for i, (msg_id, body) in enumerate([("m1", "Hello  there"), ("m2", "hello there"), ("m1", "other"),
+                                        ("m3", "")]):
+        vec = [0.0] * 4
+        vec[i] = 1.0
+        store.insert_email(f"s{i}", "a@b.com", body, vec, message_id=msg_id)
+    return store
+
+
+def test_export_duplicates_and_probe(tmp_path, monkeypatch, capsys):
+    store = _store(tmp_path)
+    monkeypatch.setattr(inspect_milvus_data, "open_vector_store", lambda backend, **kw: store)
+
+    out = tmp_path / "export.jsonl"
+    inspect_milvus_data.main(["--backend", "local", "export", "--out", str(out), "--batch-size", "3",
+                              "--with-embeddings"])
+    rows = [json.loads(line) for line in out.read_text().splitlines()]
+    assert [r["message_id"] for r in rows] == ["m1", "m2", "m1", "m3"]
+    assert rows[1]["embedding"] == [0.0, 1.0, 0.0, 0.0]
+
+    capsys.readouterr()
+    inspect_milvus_data.main(["--backend", "local", "--json", "duplicates", "--dedup-index", str(tmp_path / "none")])
+    report = json.loads(capsys.readouterr().out)
+    assert report == {"rows": 4, "duplicate_message_ids": 1, "duplicate_bodies": 1, "empty_bodies": 1,
+                      "missing_message_ids": 0}
+
+    inspect_milvus_data.main(["--backend", "local", "--json", "probe", "--queries", "4", "--limit", "2"])
+    probe = json.loads(capsys.readouterr().out)
+    assert probe["queries"] == 4 and probe["p50_ms"] <= probe["p99_ms"]
+
+
+def test_missing_store_is_not_created(tmp_path, monkeypatch):
+    missing = tmp_path / "missing"
+    real_open = inspect_milvus_data.open_vector_store
+    monkeypatch.setattr(inspect_milvus_data, "open_vector_store",
+                        lambda backend, **kw: real_open(backend, path=str(missing), **kw))
+    with pytest.raises(SystemExit, match="does not exist"):
+        inspect_milvus_data.main(["--backend", "local", "summary"])
+    assert not missing.exists()
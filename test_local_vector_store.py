@@ -0,0 +1,100 @@
+# test_local_vector_store.py
+import time
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from local_vector_store import LocalVectorStore
+from vector_store import truncate_utf8
+
+
+def _unit(i, dim=8):
+    v = np.zeros(dim, dtype=np.float32)
+    v[i] = 1.0
+    return v.tolist()
+
+
+def test_insert_search_and_filters(tmp_path):
+    store = LocalVectorStore(dim=8, path=str(tmp_path))
+    now = int(time.time())
+    store.insert_email("Meeting update", "Team <team@company.com>", "moved to 4 PM", _unit(0),
+                       message_id="m1", thread_id="t1", date_ts=now, labels=["INBOX"])
+    store.insert_email("Invoice", "accounts@company.com", "send invoice", _unit(1),
+                       message_id="m2", thread_id="t2", date_ts=now - 200 * 86400, labels=["INBOX"])
+    store.insert_email("Dinner", "friend@mail.com", "dinner tonight", _unit(2),
+                       message_id="m3", thread_id="t1", date_ts=now, labels=["SPAM"])
+
+    query = [0.9, 0.4, 0.1, 0, 0, 0, 0, 0]
+    hits = store.search_similar(query, limit=2)
+    assert [h.entity.get("message_id") for h in hits] == ["m1", "m2"]
+    assert hits[0].distance > hits[1].distance
+
+    assert [h.entity.get("message_id") for h in store.search_similar(query, since_days=90)] == ["m1", "m3"]
+    assert [h.entity.get("message_id") for h in store.search_similar(query, thread_id="t1")] == ["m1", "m3"]
+    assert [h.entity.get("message_id") for h in store.search_similar(query, sender_domain="Company.com")] == ["m1", "m2"]
+    assert [h.entity.get("message_id") for h in store.search_similar(query, labels=["SPAM"])] == ["m3"]
+    assert store.search_similar(query, thread_id="missing") == []
+
+    assert store.count_emails() == 3
+    assert store.count_emails(sender="ACCOUNTS@company.com") == 1
+    assert store.count_emails(sender="Team <team@company.com>", since_days=90) == 1
+    assert store.count_emails(sender="t_am@company.com") == 0  # exact address, no wildcards
+
+
+def test_sender_filter_expression_is_exact_and_normalized():
+    from vector_store import build_filter_expr
+    assert build_filter_expr(sender_email="Team <TEAM@Company.com>") == 'sender_email == "team@company.com"'
+
+
+def test_persistence_and_crash_recovery(tmp_path):
+    store = LocalVectorStore(dim=8, path=str(tmp_path))
+    store.insert_email("a", "a@x.com", "a", _unit(3), message_id="a")
+    # simulate a crash after the vector write but before the metadata write
+    with open(store.vec_path, "ab") as f:
+        f.write(np.ones(8, dtype=np.float32).tobytes()[:10])
+
+    reopened = LocalVectorStore(dim=8, path=str(tmp_path))
+    assert len(reopened) == 1
+    hits = reopened.search_similar(_unit(3), limit=5)
+    assert len(hits) == 1 and hits[0].entity.get("message_id") == "a"
+    assert hits[0].distance == pytest.approx(1.0)
+
+
+def test_truncate_utf8_counts_bytes():
+    assert truncate_utf8("héllo", 64) == "héllo"
+    assert truncate_utf8("é" * 10, 5) == "éé"  # 2 bytes each; the split third one is dropped
+    assert len(truncate_utf8("日本語" * 500, 1024).encode("utf-8")) <= 1024
+    assert truncate_utf8(None, 10) == ""
+
+
+def test_instances_follow_each_other_and_keep_rows_aligned(tmp_path):
+    import threading
+
+    reader = LocalVectorStore(dim=8, path=str(tmp_path))
+    writers = [LocalVectorStore(dim=8, path=str(tmp_path)) for _ in range(4)]
+    assert len(reader) == 0 and reader.search_similar(_unit(0)) == []
+    generation = reader.generation
+
+    writers[0].insert_email("one", "a@x.com", "first", _unit(1), message_id="m1")
+    assert len(reader) == 1 and reader.generation != generation
+    assert reader.existing_message_ids(["m1", "m2"]) == {"m1"}
+    assert reader.search_similar(_unit(1), limit=1)[0].entity.get("message_id") == "m1"
+
+    def insert_many(store, w):
+        for i in range(25):
+            store.insert_email(f"{w}-{i}", "b@x.com", "body", _unit(w), message_id=f"{w}-{i}")
+
+    threads = [threading.Thread(target=insert_many, args=(store, w)) for w, store in enumerate(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    reopened = LocalVectorStore(dim=8, path=str(tmp_path))  # recovery must not trim anything
+    for store in (reader, reopened):
+        rows = [row for page in store.iter_batches(output_fields=["message_id", "embedding"]) for row in page]
+        assert len(rows) == 101
+        for row in rows[1:]:  # each vector is the one inserted with its metadata row
+            assert row["embedding"] == _unit(int(row["message_id"].split("-")[0]))
+    assert [row["id"] for row in reopened.meta] == list(range(101))
@@ -0,0 +1,126 @@
+# test_ollama_client.py
+import asyncio
+import time
+
+import pytest
+
+import ollama_client
+from benchmarks.fakes import FakeOllamaServer
+from ollama_client import (AsyncOllamaClient, CircuitBreaker, HostPool, OllamaClient, OllamaError,
+                           OllamaUnavailable)
+
+DEAD = "http://127.0.0.1:9"  # discard port: connection refused
+PAYLOAD = {"model": "m", "prompt": "p"}
+
+
+def _fake(**kwargs):
+    return FakeOllamaServer(embed_latency=0, prefill_latency=0, token_latency=0, reply_tokens=3, dim=4, **kwargs)
+
+
+def test_breaker_opens_and_half_opens():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow() and not breaker.allow()  # a single trial request
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_failover_to_healthy_host_and_fail_fast(monkeypatch):
+    monkeypatch.setattr(ollama_client.random, "random", lambda: 0.0)  # ties go to DEAD (listed first)
+    with _fake() as fake:
+        client = OllamaClient(HostPool([DEAD, fake.url], failure_threshold=1, reset_timeout=60),
+                              retries=2, backoff=0.001)
+        for _ in range(3):
+            assert len(client.embed("hello")) == 4
+        assert client.pool.status()[DEAD]["state"] == "open"
+        assert client.pool.breakers[DEAD].failures == 1  # tried once, then skipped
+        assert "".join(c.get("response", "") for c in client.generate(PAYLOAD)) == "word0 word1 word2 "
+        assert client.pool.breakers[fake.url].failures == 0
+        assert all(s["inflight"] == 0 for s in client.pool.status().values())
+
+    client = OllamaClient(HostPool([DEAD], failure_threshold=2, reset_timeout=60), retries=3, backoff=0.001)
+    with pytest.raises(OllamaUnavailable):
+        client.embed("x")
+    start = time.perf_counter()
+    with pytest.raises(OllamaUnavailable, match="circuit open"):
+        client.embed("x")
+    assert time.perf_counter() - start < 0.05
+
+
+def test_5xx_is_retried():
+    with _fake() as fake:
+        client = OllamaClient(HostPool([fake.url], failure_threshold=3), retries=2, backoff=0.001)
+        fake.fail_requests = 2
+        assert len(client.embed("hello")) == 4
+        assert fake.fail_requests == 0 and fake.calls["embeddings"] == 1
+        assert client.pool.breakers[fake.url].failures == 0
+
+
+def test_finished_or_closed_streams_are_successes():
+    with _fake() as fake:
+        client = OllamaClient(HostPool([fake.url], failure_threshold=2, reset_timeout=60))
+        for _ in range(5):  # more than failure_threshold
+            for data in client.generate(PAYLOAD):
+                if data.get("done"):
+                    break
+            chunks = client.generate(PAYLOAD)
+            next(chunks)
+            chunks.close()  # consumer gave up early
+        assert client.pool.status()[fake.url] == {"state": "closed", "inflight": 0}
+        assert client.pool.breakers[fake.url].failures == 0
+
+
+def test_broken_stream_is_a_failure_and_not_retried():
+    with _fake() as fake:
+        fake.break_after = 2
+        client = OllamaClient(HostPool([fake.url], failure_threshold=5), retries=3, backoff=0.001)
+        received = []
+        with pytest.raises(OllamaError, match="broke off"):
+            for data in client.generate(PAYLOAD):
+                received.append(data["response"])
+        assert received == ["word0 ", "word1 "]
+        assert fake.calls["generate"] == 1
+        assert client.pool.breakers[fake.url].failures == 1
+        assert client.pool.inflight[fake.url] == 0
+
+
+def test_async_client_streams_and_retries():
+    async def run(client):
+        for _ in range(5):
+            chunks = await client.generate(PAYLOAD)
+            async for data in chunks:
+                if data.get("done"):
+                    break
+            await chunks.aclose()
+        return await client.embed("hello")
+
+    with _fake() as fake:
+        fake.fail_requests = 1
+        client = AsyncOllamaClient(HostPool([fake.url], failure_threshold=2, reset_timeout=60),
+                                   retries=2, backoff=0.001)
+        assert len(asyncio.run(run(client))) == 4
+        assert fake.calls["generate"] == 5
+        assert client.pool.status()[fake.url] == {"state": "closed", "inflight": 0}
+        assert client.pool.breakers[fake.url].failures == 0
+
+
+def test_api_streams_do_not_trip_the_breaker(monkeypatch):
+    pytest.importorskip("fastapi")
+    from fastapi.testclient import TestClient
+    import ollamaconnect
+
+    with _fake() as fake:
+        client = AsyncOllamaClient(HostPool([fake.url], failure_threshold=2, reset_timeout=60))
+        monkeypatch.setattr(ollamaconnect, "get_async_client", lambda: client)
+        with TestClient(ollamaconnect.app) as api:
+            for _ in range(6):
+                r = api.post("/generate", json={"prompt": "hi", "model": "m"})
+                assert r.status_code == 200 and "event: done" in r.text
+            deadline = time.monotonic() + 2
+            while client.pool.inflight[fake.url] and time.monotonic() < deadline:
+                time.sleep(0.01)
+        assert client.pool.status()[fake.url] == {"state": "closed", "inflight": 0}
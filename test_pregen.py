@@ -0,0 +1,131 @@
+# test_pregen.py
+import base64
+
+from local_vector_store import LocalVectorStore
+from pregen import Pregenerator, ReplyCache, reply_score
+
+
+def _email(**kw):
+    return dict({"id": "m1", "thread_id": "t1", "subject": "Budget", "from_email": "Ann <ann@corp.com>",
+                 "body": "", "labels": ["INBOX"], "bulk": False}, **kw)
+
+
+def test_reply_score_heuristics(tmp_path):
+    store = LocalVectorStore(dim=4, path=str(tmp_path))
+    for i in range(3):
+        store.insert_email("s", "Ann <ann@corp.com>", "b", [1, 0, 0, 0], message_id=f"old{i}")
+
+    question = _email(body="Could you send the numbers by Friday?")
+    assert reply_score(question) == 0.6
+    assert reply_score(question, store) == 0.8  # three past emails from ann@corp.com
+    assert reply_score(_email(body="FYI, the report is attached.")) == 0.0
+    assert reply_score(_email(body="Any questions?", bulk=True)) == 0.0
+    assert reply_score(_email(body="Any questions?", from_email="noreply@shop.com")) == 0.0
+    assert reply_score(_email(body="Any questions?", labels=["INBOX", "CATEGORY_PROMOTIONS"])) == 0.0
+
+
+def test_cache_bounds_and_thread_invalidation(tmp_path):
+    path = str(tmp_path / "cache.json")
+    cache = ReplyCache(path, max_entries=2)
+    cache.put("m1", "t1", "reply 1")
+    cache.put("m2", "t2", "reply 2")
+    cache.put("m3", "t1", "reply 3")
+    assert cache.get("m1") is None and len(cache) == 2  # oldest evicted
+
+    assert cache.invalidate_thread("t1", keep="m4") == 1
+    cache.save()
+    assert ReplyCache(path).entries.keys() == {"m2"}
+    assert ReplyCache(path, max_age=-1).get("m2") is None
+
+
+class FakeGmail:
+    def __init__(self, messages):
+        self.messages_ = messages  # newest first: (id, thread_id, body)
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def list(self, userId, q=None, maxResults=25):
+        self.result = {"messages": [{"id": i, "threadId": t} for i, t, _ in self.messages_]}
+        return self
+
+    def get(self, userId, id):
+        _, thread_id, body = next(m for m in self.messages_ if m[0] == id)
+        self.result = {"id": id, "threadId": thread_id, "labelIds": ["INBOX"], "payload": {
+            "mimeType": "text/plain", "headers": [{"name": "From", "value": "bob@corp.com"},
+                                                  {"name": "Subject", "value": "Hi"}],
+            "body": {"data": base64.urlsafe_b64encode(body.encode()).decode()}}}
+        return self
+
+    def execute(self):
+        return self.result
+
+
+def test_new_thread_activity_drops_cached_reply(tmp_path):
+    cache = ReplyCache(str(tmp_path / "cache.json"))
+    cache.put("m1", "t1", "cached reply to m1")
+    gmail = FakeGmail([("m2", "t1", "Also, can you review it?"), ("m1", "t1", "Can we meet?"),
+                       ("m3", "t2", "Newsletter text.")])
+    pregen = Pregenerator(gmail, embedder=None, store=None, cache=cache, threshold=0.5)
+
+    assert pregen.poll() == 1  # only m2: m1 is no longer its thread's newest, m3 asks nothing
+    assert cache.get("m1") is None
+    assert pregen.pending() == 1
+
+
+def test_poll_survives_a_failing_message_and_retries_it(tmp_path, monkeypatch):
+    import pregen as pregen_module
+
+    gmail = FakeGmail([("m1", "t1", "Could you meet me?"), ("m2", "t2", "Could you call me?")])
+    pregen = Pregenerator(gmail, embedder=None, store=None, cache=ReplyCache(str(tmp_path / "c.json")))
+    real_get = gmail.get
+
+    def flaky_get(userId, id):
+        if id == "m1":
+            raise ConnectionError("transient")
+        return real_get(userId, id)
+
+    gmail.get = flaky_get
+    assert pregen.poll() == 1 and "m1" not in pregen.scored
+    gmail.get = real_get
+    assert pregen.poll() == 1 and "m1" in pregen.scored  # m1 is scored on the next poll
+
+    monkeypatch.setattr(pregen_module, "MAX_TRACKED", 1)
+    pregen._remember(pregen.scored, "m3")
+    assert list(pregen.scored) == ["m3"]
+
+
+def test_failed_generation_is_retried_and_queued_messages_are_left_alone(tmp_path, monkeypatch):
+    import smart_reply
+
+    class Queue:
+        jobs = {"m2": "pending"}
+
+        def status(self, message_id):
+            return self.jobs.get(message_id)
+
+        def counts(self):
+            return {}
+
+    attempts = []
+
+    def generate(email_text, context, echo, raise_errors, on_chunk):
+        attempts.append(email_text)
+        if len(attempts) == 1:
+            raise ConnectionError("ollama down")
+        return "Sure."
+
+    monkeypatch.setattr(smart_reply, "get_similar_context", lambda *args, **kwargs: "")
+    monkeypatch.setattr(smart_reply, "generate_reply_with_ollama", generate)
+    gmail = FakeGmail([("m1", "t1", "Could you meet me?"), ("m2", "t2", "Could you call me?")])
+    cache = ReplyCache(str(tmp_path / "c.json"))
+    pregen = Pregenerator(gmail, embedder=None, store=None, cache=cache, max_load=float("inf"),
+                          reply_queue=Queue())
+
+    assert pregen.poll() == 1  # m2 already has a reply_service job
+    assert not pregen.run_once() and "m1" not in pregen.scored
+    assert pregen.poll() == 1 and pregen.run_once()
+    assert cache.get("m1") == "Sure." and cache.get("m2") is None
@@ -0,0 +1,200 @@
+# test_reply_service.py
+import functools
+import time
+
+import pytest
+
+import reply_service
+from draft_writer import DraftWriter
+from reply_service import ReplyJobQueue, ReplyWorkerPool
+
+EMAIL = {"id": "m1", "thread_id": "t1", "subject": "Hi", "from_email": "ann@example.com",
+         "reply_to": "", "rfc_message_id": "", "references": ""}
+
+
+class FakeDrafts:
+    def __init__(self):
+        self.calls = []
+        self.fail_final = False
+        self.fail_delete = False
+
+    def users(self):
+        return self
+
+    def drafts(self):
+        return self
+
+    def _result(self, result):
+        return type("Call", (), {"execute": lambda _self: result})()
+
+    def create(self, userId, body):
+        self.calls.append(("create", None))
+        return self._result({"id": f"d{sum(kind == 'create' for kind, _ in self.calls)}"})
+
+    def update(self, userId, id, body):
+        self.calls.append(("update", id))
+        if self.fail_final:
+            raise ConnectionError("gmail down")
+        return self._result({"id": id})
+
+    def delete(self, userId, id):
+        self.calls.append(("delete", id))
+        if self.fail_delete:
+            raise ConnectionError("gmail down")
+        return self._result({})
+
+
+def _generate(email_text, context, echo, raise_errors, on_chunk):
+    on_chunk("Hello Ann, ")
+    writer = on_chunk.__self__
+    while writer.draft_id is None or not writer.updates:  # let the first draft be created
+        time.sleep(0.005)
+    return "Hello Ann, see you then."
+
+
+@pytest.fixture
+def pool(tmp_path, monkeypatch):
+    fake = FakeDrafts()
+    monkeypatch.setattr(reply_service, "open_vector_store", lambda **kwargs: None)
+    monkeypatch.setattr(reply_service, "get_gmail_service", lambda *args: None)
+    monkeypatch.setattr(reply_service, "get_email", lambda service, message_id: EMAIL)
+    monkeypatch.setattr(reply_service, "format_email_text", lambda email: "text")
+    monkeypatch.setattr(reply_service, "get_similar_context", lambda *args, **kwargs: "")
+    monkeypatch.setattr(reply_service, "generate_reply_with_ollama", _generate)
+    monkeypatch.setattr(reply_service, "DraftWriter", functools.partial(DraftWriter, service=fake, min_interval=0))
+    queue = ReplyJobQueue(str(tmp_path / "jobs.sqlite3"))
+    queue.enqueue("m1")
+    pool = ReplyWorkerPool(queue, save_drafts=True)
+    pool.fake = fake
+    return pool
+
+
+def test_failed_attempt_deletes_its_draft(pool):
+    pool.fake.fail_final = True
+    with pytest.raises(ConnectionError):
+        pool.process("m1")
+    assert pool.fake.calls[-1] == ("delete", "d1")
+    assert pool.queue.draft_id("m1") is None
+
+
+def test_retry_reuses_the_draft_it_could_not_delete(pool):
+    pool.fake.fail_final = pool.fake.fail_delete = True
+    with pytest.raises(ConnectionError):
+        pool.process("m1")
+    assert pool.queue.draft_id("m1") == "d1"
+
+    pool.fake.fail_final = False
+    pool.fake.calls.clear()
+    assert pool.process("m1") == "Hello Ann, see you then."
+    assert {kind for kind, _ in pool.fake.calls} == {"update"}
+    assert pool.queue.draft_id("m1") == "d1"
+
+
+def test_enqueue_is_deduplicated(tmp_path):
+    queue = ReplyJobQueue(str(tmp_path / "jobs.sqlite3"))
+    assert queue.enqueue("m1") is True
+    assert queue.enqueue("m1") is False
+    assert queue.counts() == {"pending": 1}
+
+
+def test_two_processes_never_claim_the_same_job(tmp_path):
+    import threading
+
+    path = str(tmp_path / "jobs.sqlite3")
+    queues = [ReplyJobQueue(path) for _ in range(4)]  # separate connections, like separate processes
+    for i in range(40):
+        queues[0].enqueue(f"m{i}")
+    claimed = []
+
+    def drain(queue):
+        while True:
+            job = queue.claim()
+            if job is None:
+                return
+            claimed.append(job[0])
+
+    threads = [threading.Thread(target=drain, args=(q,)) for q in queues]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(claimed) == sorted(f"m{i}" for i in range(40))
+
+
+def test_retry_with_backoff_then_give_up(tmp_path, monkeypatch):
+    monkeypatch.setattr(reply_service, "open_vector_store", lambda **kwargs: None)
+    queue = ReplyJobQueue(str(tmp_path / "jobs.sqlite3"))
+    pool = ReplyWorkerPool(queue, max_attempts=3, base_delay=0.01, max_delay=0.02, idle_sleep=0.01)
+    for attempts in range(1, 6):
+        cap = min(0.02, 0.01 * 2 ** (attempts - 1))  # exponential, capped, jittered to [cap/2, cap]
+        assert cap / 2 <= pool.backoff(attempts) <= cap
+
+    queue.enqueue("m1")
+    calls = []
+
+    def process(message_id):
+        calls.append(message_id)
+        raise RuntimeError("ollama down")
+
+    pool.process = process
+    pool.start()
+    deadline = time.monotonic() + 5
+    while queue.counts().get("failed") != 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    pool.stop(timeout=5)
+    assert calls == ["m1"] * 3
+    assert queue.counts() == {"failed": 1}
+
+
+def test_requeue_stale_spares_live_jobs(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    live, dead = ReplyJobQueue(path), ReplyJobQueue(path)
+    live.enqueue("a")
+    dead.enqueue("b")
+    assert live.claim()[0] == "a" and dead.claim()[0] == "b"
+
+    assert live.requeue_stale() == 0  # both just claimed: nothing is stale
+    time.sleep(0.05)
+    live.heartbeat()
+    assert live.requeue_stale(stale_after=0.04) == 1  # only the job whose owner went quiet
+    assert live.counts() == {"pending": 1, "running": 1}
+    dead.complete("b", "late reply")  # the original owner lost the job: no overwrite
+    assert live.counts() == {"pending": 1, "running": 1}
+
+
+def test_service_survives_a_failed_poll(tmp_path, monkeypatch):
+    polls = []
+
+    def poll(queue, service):
+        polls.append(1)
+        if len(polls) == 1:
+            raise TimeoutError("gmail timed out")
+        if len(polls) == 3:
+            raise KeyboardInterrupt
+        return 0
+
+    monkeypatch.setattr(reply_service, "open_vector_store", lambda **kwargs: None)
+    monkeypatch.setattr(reply_service, "get_gmail_service", lambda *args: None)
+    monkeypatch.setattr(reply_service, "poll_new_messages", poll)
+    monkeypatch.setattr(reply_service.time, "sleep", lambda seconds: None)
+    reply_service.main(["--db", str(tmp_path / "jobs.sqlite3"), "--workers", "0", "--poll-interval", "1"])
+    assert len(polls) == 3
+
+
+def test_pregenerated_reply_and_its_draft_are_reused(pool, tmp_path, monkeypatch):
+    from pregen import ReplyCache
+
+    monkeypatch.setattr(reply_service, "generate_reply_with_ollama", None)  # must not be called
+    pool.pregen_cache = str(tmp_path / "pregen.json")
+    cache = ReplyCache(pool.pregen_cache)
+    cache.put("m1", "t1", "Pre-generated.", draft_id="d7")
+    cache.put("m2", "t2", "No draft yet.")
+    cache.save()
+
+    assert pool.process("m1") == "Pre-generated."
+    assert pool.queue.draft_id("m1") == "d7" and pool.fake.calls == []  # pregen's draft is the one
+
+    pool.queue.enqueue("m2")
+    assert pool.process("m2") == "No draft yet."
+    assert [kind for kind, _ in pool.fake.calls] == ["create"]  # one draft, written once
+    assert pool.queue.draft_id("m2") == "d1"
@@ -0,0 +1,70 @@
+# test_retrieval_cache.py
+import time
+
+from local_vector_store import LocalVectorStore
+from retrieval_cache import RetrievalCache, TTLCache
+from smart_reply import get_similar_context
+
+
+class CountingEmbedder:
+    model = "fake-embed"
+
+    def __init__(self):
+        self.calls = 0
+
+    def embed(self, text):
+        self.calls += 1
+        return [1.0, 0.0, 0.0, float(len(text) % 3)]
+
+
+class CountingStore(LocalVectorStore):
+    searches = 0
+
+    def search_similar(self, *args, **kwargs):
+        self.searches += 1
+        return super().search_similar(*args, **kwargs)
+
+
+def test_repeat_drafts_skip_embedder_and_search_until_insert(tmp_path):
+    store = CountingStore(dim=4, path=str(tmp_path))
+    store.insert_email("Old", "a@x.com", "old thread", [1, 0, 0, 0], message_id="m1")
+    embedder, cache = CountingEmbedder(), RetrievalCache()
+
+    first = get_similar_context("Subject: hi", embedder=embedder, store=store, cache=cache)
+    again = get_similar_context("Subject: hi", embedder=embedder, store=store, cache=cache)
+    assert first == again and "Old" in first
+    assert (embedder.calls, store.searches) == (1, 1)
+
+    get_similar_context("Subject: hi", embedder=embedder, store=store, cache=cache, since_days=7)
+    assert (embedder.calls, store.searches) == (1, 2)  # filters are part of the key
+
+    store.insert_email("New", "b@x.com", "new thread", [1, 0, 0, 0], message_id="m2")
+    assert "New" in get_similar_context("Subject: hi", embedder=embedder, store=store, cache=cache)
+    assert (embedder.calls, store.searches) == (1, 3)
+
+    get_similar_context("Subject: hi", embedder=embedder, store=store, cache=False)
+    assert (embedder.calls, store.searches) == (2, 4)
+
+
+def test_ttl_and_lru_bounds():
+    cache = TTLCache(max_entries=2, ttl=0.05)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)  # evicts b, the least recently used
+    assert cache.get("b") is None and cache.get("a") == 1
+    time.sleep(0.06)
+    assert cache.get("a") is None and len(cache) == 1
+
+
+def test_query_vectors_persist_across_processes(tmp_path):
+    db = str(tmp_path / "vectors.sqlite3")
+    embedder = CountingEmbedder()
+    first = RetrievalCache(vector_db=db).query_vector("Subject: hi", embedder)
+    again = RetrievalCache(vector_db=db).query_vector("Subject: hi", embedder)  # a later run
+    assert first == again and embedder.calls == 1
+
+    other_model = CountingEmbedder()
+    other_model.model = "other-embed"
+    RetrievalCache(vector_db=db).query_vector("Subject: hi", other_model)
+    assert other_model.calls == 1  # the model is part of the key
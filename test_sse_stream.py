@@ -0,0 +1,44 @@
+# test_sse_stream.py
+import asyncio
+import threading
+import time
+
+from sse_stream import StreamBuffer, format_event, lookup, register, sse_frames
+
+
+async def _collect(buf, offset=0, **kwargs):
+    return [frame async for frame in sse_frames(buf, offset, **kwargs)]
+
+
+def test_tokens_are_batched_into_frames():
+    buf = StreamBuffer("m")
+
+    def produce():
+        for i in range(40):
+            buf.append(f"t{i} ")
+            time.sleep(0.002)
+        buf.finish()
+
+    threading.Thread(target=produce).start()
+    frames = asyncio.run(_collect(buf, frame_ms=30, frame_chars=1000, summary=True))
+    tokens = [f for f in frames if f.startswith("event: token")]
+    assert 1 <= len(tokens) < 10  # 40 tokens, a handful of frames
+    assert "".join(line[6:] for f in tokens for line in f.splitlines() if line.startswith("data: ")) == buf.text()
+    assert '"full_response"' in frames[-1] and frames[-1].startswith("event: done")
+
+
+def test_resume_from_last_event_id():
+    buf = register(StreamBuffer("m"))
+    buf.append("Hello ")
+    buf.append("world")
+    buf.finish()
+    resumed, offset = lookup(f"{buf.id}-6")
+    assert resumed is buf and offset == 6
+    frames = asyncio.run(_collect(buf, offset))
+    assert frames[0] == f"event: token\nid: {buf.id}-11\ndata: world\n\n"
+    assert '"full_response"' not in frames[-1]
+    assert lookup("unknown-3") == (None, 0)
+
+
+def test_multiline_data():
+    assert format_event("token", "a\nb") == "event: token\ndata: a\ndata: b\n\n"
@@ -0,0 +1,76 @@
+# test_tracing.py
+import json
+
+import tracing
+from tracing import span, parse_traceparent, current_traceparent
+
+PARENT = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+
+
+def test_spans_nest_and_continue_remote_parent(tmp_path, monkeypatch):
+    trace_file = tmp_path / "spans.jsonl"
+    monkeypatch.setattr(tracing, "TRACE_FILE", str(trace_file))
+    with span("outer", parent=PARENT, stage="ingest") as outer:
+        with span("inner") as inner:
+            inner.set_attribute("embedding.dim", 768)
+            assert current_traceparent() == inner.context.traceparent()
+
+    inner_rec, outer_rec = [json.loads(line) for line in trace_file.read_text().splitlines()]
+    assert outer_rec["traceId"] == inner_rec["traceId"] == "4bf92f3577b34da6a3ce929d0e0e4736"
+    assert outer_rec["parentSpanId"] == "00f067aa0ba902b7"
+    assert inner_rec["parentSpanId"] == outer.context.span_id
+    assert inner_rec["attributes"] == {"embedding.dim": 768}
+    assert outer_rec["attributes"] == {"stage": "ingest"}
+
+
+def test_exceptions_are_recorded_and_reraised(tmp_path, monkeypatch):
+    trace_file = tmp_path / "spans.jsonl"
+    monkeypatch.setattr(tracing, "TRACE_FILE", str(trace_file))
+    try:
+        with span("boom"):
+            raise ValueError("bad input")
+    except ValueError:
+        pass
+    rec = json.loads(trace_file.read_text())
+    assert rec["status"] == {"code": "ERROR", "message": "bad input"}
+
+
+def test_disabled_and_malformed():
+    assert parse_traceparent("not-a-traceparent") is None
+    assert parse_traceparent("00-" + "0" * 31 + "-" + "0" * 16 + "-01") is None
+    with span("noop") as s:
+        s.set_attribute("ignored", 1)
+
+
+def test_batch_ingest_is_one_trace(tmp_path, monkeypatch):
+    import functools
+
+    import read_gmail_to_milvus
+    from benchmarks.fakes import FakeGmailService
+    from dedup import NearDuplicateIndex
+
+    class Embedder:
+        def embed(self, text):
+            return [1.0, 0.0]
+
+    class Store:
+        def insert_email(self, *args, **kwargs):
+            pass
+
+        def existing_message_ids(self, ids):
+            return set()
+
+    trace_file = tmp_path / "spans.jsonl"
+    monkeypatch.setattr(tracing, "TRACE_FILE", str(trace_file))
+    monkeypatch.setattr(read_gmail_to_milvus, "get_gmail_service", lambda: FakeGmailService(latency=0))
+    monkeypatch.setattr(read_gmail_to_milvus, "OllamaEmbedder", Embedder)
+    monkeypatch.setattr(read_gmail_to_milvus, "open_vector_store", lambda **kwargs: Store())
+    monkeypatch.setattr(read_gmail_to_milvus, "NearDuplicateIndex",
+                        functools.partial(NearDuplicateIndex, str(tmp_path / "dedup.json")))
+    read_gmail_to_milvus.main(["--max", "3"])
+
+    spans = [json.loads(line) for line in trace_file.read_text().splitlines()]
+    names = [s["name"] for s in spans]
+    assert names.count("gmail.list") == 1 and names.count("gmail.get") == 3
+    assert names[-1] == "ingest.run"
+    assert len({s["traceId"] for s in spans}) == 1
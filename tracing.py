@@ -0,0 +1,168 @@
+# tracing.py
+"""
+Minimal per-stage tracing with OpenTelemetry-shaped spans and a local JSON-lines exporter.
+
+Enable by setting TRACE_FILE (e.g. TRACE_FILE=traces/spans.jsonl); when unset, span() is a
+cheap no-op. Each finished span is appended as one JSON object using OTLP field names
+(traceId, spanId, parentSpanId, name, startTimeUnixNano, endTimeUnixNano, attributes, status),
+so the file can be converted/imported into any OpenTelemetry backend.
+
+Correlation across processes uses W3C trace context:
+- HTTP: the FastAPI app continues the caller's `traceparent` header (see ollamaconnect.py)
+- batch scripts: a TRACEPARENT environment variable becomes the parent of the root spans
+- reply jobs: the enqueuer's traceparent is stored with the job and continued by the worker
+
+    with span("ollama.embed", model=self.model) as s:
+        ...
+        s.set_attribute("embedding.dim", len(vec))
+"""
+
+import contextvars
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+TRACE_FILE = os.environ.get("TRACE_FILE", "")
+SERVICE_NAME = os.environ.get("TRACE_SERVICE_NAME", os.path.basename(sys.argv[0] or "python"))
+
+_current = contextvars.ContextVar("current_span", default=None)
+_export_lock = threading.Lock()
+
+
+class SpanContext:
+    def __init__(self, trace_id: str, span_id: str):
+        self.trace_id = trace_id
+        self.span_id = span_id
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+
+def parse_traceparent(value):
+    """'00-<32 hex>-<16 hex>-<flags>' → SpanContext, or None if malformed."""
+    try:
+        version, trace_id, span_id, _flags = (value or "").strip().split("-")
+        int(trace_id, 16), int(span_id, 16)
+    except ValueError:
+        return None
+    if len(trace_id) != 32 or len(span_id) != 16 or version == "ff":
+        return None
+    return SpanContext(trace_id, span_id)
+
+
+class Span:
+    def __init__(self, name: str, parent, attributes: dict):
+        self.name = name
+        self.context = SpanContext(parent.trace_id if parent else secrets.token_hex(16), secrets.token_hex(8))
+        self.parent_id = parent.span_id if parent else ""
+        self.attributes = dict(attributes)
+        self.status = {"code": "OK"}
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes):
+        self.attributes.update(attributes)
+
+    def record_exception(self, exc: BaseException):
+        self.status = {"code": "ERROR", "message": str(exc)}
+        self.attributes["exception.type"] = type(exc).__name__
+
+    def to_dict(self) -> dict:
+        return {
+            "traceId": self.context.trace_id,
+            "spanId": self.context.span_id,
+            "parentSpanId": self.parent_id,
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "durationMs": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "status": self.status,
+            "resource": {"service.name": SERVICE_NAME, "process.pid": os.getpid()},
+        }
+
+
+class _NoopSpan:
+    context = None
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, **attributes):
+        pass
+
+    def record_exception(self, exc):
+        pass
+
+
+_NOOP = _NoopSpan()
+_env_parent = parse_traceparent(os.environ.get("TRACEPARENT", ""))
+
+
+def enabled() -> bool:
+    return bool(TRACE_FILE)
+
+
+def _export(s: Span):
+    line = json.dumps(s.to_dict(), ensure_ascii=False, default=str)
+    with _export_lock:
+        if os.path.dirname(TRACE_FILE):
+            os.makedirs(os.path.dirname(TRACE_FILE), exist_ok=True)
+        with open(TRACE_FILE, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+@contextmanager
+def span(name: str, parent=None, **attributes):
+    """
+    Start a child of the current span (or of `parent`, a SpanContext / traceparent string).
+    Exceptions are recorded on the span and re-raised.
+    """
+    if not TRACE_FILE:
+        yield _NOOP
+        return
+    if isinstance(parent, str):
+        parent = parse_traceparent(parent)
+    if parent is None:
+        current = _current.get()
+        parent = current.context if current is not None else _env_parent
+    s = Span(name, parent, attributes)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.record_exception(e)
+        raise
+    finally:
+        _current.reset(token)
+        s.end_ns = time.time_ns()
+        _export(s)
+
+
+def traced(name: str = None):
+    """Decorator form of span() for whole functions."""
+    def decorator(fn):
+        span_name = name or f"{fn.__module__}.{fn.__qualname__}"
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_traceparent():
+    """traceparent of the active span (for HTTP headers / job records), or None."""
+    current = _current.get()
+    if current is not None:
+        return current.context.traceparent()
+    return _env_parent.traceparent() if _env_parent else None
@@ -1,44 +1,312 @@
 # vector_store.py
-from typing import List
-from pymilvus import connections, Collection, FieldSchema, CollectionSchema, DataType, utility
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from email.utils import parseaddr
+from typing import List, Optional, Sequence
+
+from tracing import span
+
+# pymilvus is imported inside GmailVectorStore: it is slow to import and only the Milvus
+# backend needs it (the local backend runs without it).
 
 COLLECTION = "gmail_emails"
 
-class GmailVectorStore:
-    def __init__(self, dim: int = 768):
+# Scalar fields that get their own index so Milvus can prune candidates
+# before the vector scan (see build_filter_expr).
+SCALAR_INDEXES = {
+    "message_id": "INVERTED",
+    "thread_id": "INVERTED",
+    "sender_domain": "INVERTED",
+    "sender_email": "INVERTED",
+    "date_ts": "STL_SORT",
+    "labels": "INVERTED",
+}
+
+OUTPUT_FIELDS = ["subject", "from_email", "body", "message_id", "thread_id",
+                 "rfc_message_id", "sender_domain", "date_ts", "labels", "snippet"]
+
+
+def truncate_utf8(text: str, max_bytes: int) -> str:
+    """Cut text to at most max_bytes UTF-8 bytes (Milvus VARCHAR max_length counts bytes)."""
+    data = (text or "").encode("utf-8")
+    if len(data) <= max_bytes:
+        return text or ""
+    return data[:max_bytes].decode("utf-8", errors="ignore")  # drop a split trailing character
+
+
+def sender_email_of(from_header: str) -> str:
+    """'Jane <Jane@Example.com>' -> 'jane@example.com' (stored normalized so filters can use ==)."""
+    return parseaddr(from_header or "")[1].lower()
+
+
+def sender_domain_of(from_header: str) -> str:
+    """'Jane <jane@Example.com>' -> 'example.com' (empty string if there is no address)."""
+    addr = sender_email_of(from_header)
+    return addr.rpartition("@")[2] if "@" in addr else ""
+
+
+def _quote(value: str) -> str:
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def build_filter_expr(since_days: Optional[float] = None,
+                      thread_id: Optional[str] = None,
+                      sender_domain: Optional[str] = None,
+                      labels: Optional[Sequence[str]] = None,
+                      expr: Optional[str] = None,
+                      sender_email: Optional[str] = None) -> str:
+    """
+    Build a Milvus boolean expression from the search filters.
+    since_days keeps emails from the last N days, labels matches any of the given labels,
+    expr is ANDed in verbatim for anything not covered here.
+    """
+    clauses = []
+    if since_days is not None:
+        clauses.append(f"date_ts >= {int(time.time() - since_days * 86400)}")
+    if thread_id:
+        clauses.append(f"thread_id == {_quote(thread_id)}")
+    if sender_domain:
+        clauses.append(f"sender_domain == {_quote(sender_domain.lower())}")
+    if sender_email:
+        clauses.append(f"sender_email == {_quote(sender_email_of(sender_email))}")
+    if labels:
+        clauses.append(f"array_contains_any(labels, [{', '.join(_quote(l) for l in labels)}])")
+    if expr:
+        clauses.append(f"({expr})")
+    return " and ".join(clauses)
+
+
+class VectorStoreBackend(ABC):
+    """
+    Insert/search API shared by every vector backend.
+    search_similar returns hits exposing .id, .distance (cosine similarity) and .entity.get(field).
+    cache_key names the underlying data and generation changes on every insert_email; together
+    they let retrieval_cache.py drop cached hit lists once new emails are stored.
+    """
+
+    generation = 0
+
+    @property
+    def cache_key(self):
+        return id(self)
+
+    @abstractmethod
+    def insert_email(self, subject: str, from_email: str, body: str, embedding: List[float],
+                     message_id: str = "", thread_id: str = "", rfc_message_id: str = "",
+                     date_ts: int = 0, labels: Optional[Sequence[str]] = None, snippet: str = ""):
+        ...
+
+    @abstractmethod
+    def search_similar(self, query_embedding: List[float], limit: int = 3,
+                       since_days: Optional[float] = None, thread_id: Optional[str] = None,
+                       sender_domain: Optional[str] = None, labels: Optional[Sequence[str]] = None,
+                       expr: Optional[str] = None):
+        ...
+
+    @abstractmethod
+    def count_emails(self, sender: Optional[str] = None, since_days: Optional[float] = None,
+                     thread_id: Optional[str] = None, labels: Optional[Sequence[str]] = None) -> int:
+        """Number of stored emails matching the filters; sender is matched by email address."""
+
+    @abstractmethod
+    def existing_message_ids(self, message_ids: Sequence[str]) -> set:
+        """The subset of message_ids already stored (re-delivered messages are skipped, not re-inserted)."""
+
+    @abstractmethod
+    def iter_batches(self, batch_size: int = 1000, output_fields: Optional[Sequence[str]] = None):
+        """Yield every stored row as lists of at most batch_size dicts (full scan, bounded memory)."""
+
+    @abstractmethod
+    def stats(self) -> dict:
+        """Backend-specific size/layout statistics (see inspect_milvus_data.py)."""
+
+
+def open_vector_store(backend: Optional[str] = None, dim: int = 768, **kwargs) -> VectorStoreBackend:
+    """
+    Return the configured vector backend: "milvus" (default) or "local".
+    backend falls back to the VECTOR_BACKEND environment variable; kwargs go to the backend
+    constructor (e.g. path=... for the local store).
+    """
+    backend = (backend or os.environ.get("VECTOR_BACKEND", "milvus")).lower()
+    if backend == "milvus":
+        return GmailVectorStore(dim=dim, **kwargs)
+    if backend == "local":
+        from local_vector_store import LocalVectorStore
+        return LocalVectorStore(dim=dim, **kwargs)
+    raise ValueError(f"Unknown vector backend: {backend!r} (expected 'milvus' or 'local')")
+
+
+class GmailVectorStore(VectorStoreBackend):
+    cache_key = ("milvus", COLLECTION)
+    _generation_lock = threading.Lock()
+
+    def __init__(self, dim: int = 768, create: bool = True):
+        try:
+            from pymilvus import connections, Collection, utility
+        except ImportError:
+            raise ImportError("pymilvus is required for the Milvus backend (or use VECTOR_BACKEND=local)")
         connections.connect("default", host="127.0.0.1", port="19530")
         if not utility.has_collection(COLLECTION):
+            if not create:
+                raise LookupError(f"Milvus collection '{COLLECTION}' does not exist")
             self._create_collection(dim)
         self.col = Collection(COLLECTION)
+        self.fields = {f.name for f in self.col.schema.fields}
+        if "thread_id" not in self.fields:
+            print(f"⚠️ Collection '{COLLECTION}' uses the old schema (no metadata fields); "
+                  "drop and re-ingest it to enable filtered search.")
 
     def _create_collection(self, dim: int):
+        from pymilvus import Collection, FieldSchema, CollectionSchema, DataType
         fields = [
             FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=True),
             FieldSchema(name="subject", dtype=DataType.VARCHAR, max_length=1024),
             FieldSchema(name="from_email", dtype=DataType.VARCHAR, max_length=320),
             FieldSchema(name="body", dtype=DataType.VARCHAR, max_length=65535),
+            FieldSchema(name="message_id", dtype=DataType.VARCHAR, max_length=64),
+            FieldSchema(name="thread_id", dtype=DataType.VARCHAR, max_length=64),
+            FieldSchema(name="rfc_message_id", dtype=DataType.VARCHAR, max_length=998),
+            FieldSchema(name="sender_domain", dtype=DataType.VARCHAR, max_length=255),
+            FieldSchema(name="sender_email", dtype=DataType.VARCHAR, max_length=320),
+            FieldSchema(name="date_ts", dtype=DataType.INT64),  # seconds since epoch
+            FieldSchema(name="labels", dtype=DataType.ARRAY, element_type=DataType.VARCHAR,
+                        max_capacity=64, max_length=128),
+            FieldSchema(name="snippet", dtype=DataType.VARCHAR, max_length=1024),
             FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=dim),
         ]
         schema = CollectionSchema(fields, description="Gmail emails with embeddings")
         col = Collection(COLLECTION, schema)
         col.create_index(field_name="embedding",
                          index_params={"index_type": "AUTOINDEX", "metric_type": "COSINE"})
+        for field, index_type in SCALAR_INDEXES.items():
+            col.create_index(field_name=field, index_name=f"idx_{field}",
+                             index_params={"index_type": index_type})
         print("✅ Created Milvus collection:", COLLECTION)
 
-    def insert_email(self, subject: str, from_email: str, body: str, embedding: List[float]):
+    def insert_email(self, subject: str, from_email: str, body: str, embedding: List[float],
+                     message_id: str = "", thread_id: str = "", rfc_message_id: str = "",
+                     date_ts: int = 0, labels: Optional[Sequence[str]] = None, snippet: str = ""):
+        row = {
+            "subject": truncate_utf8(subject, 1024),
+            "from_email": truncate_utf8(from_email, 320),
+            "body": truncate_utf8(body, 65535),
+            "message_id": truncate_utf8(message_id, 64),
+            "thread_id": truncate_utf8(thread_id, 64),
+            "rfc_message_id": truncate_utf8(rfc_message_id, 998),
+            "sender_domain": truncate_utf8(sender_domain_of(from_email), 255),
+            "sender_email": truncate_utf8(sender_email_of(from_email), 320),
+            "date_ts": int(date_ts or 0),
+            "labels": [truncate_utf8(label, 128) for label in list(labels or [])[:64]],
+            "snippet": truncate_utf8(snippet, 1024),
+            "embedding": embedding,
+        }
+        from pymilvus import Collection
         col = Collection(COLLECTION)
-        col.insert([[subject], [from_email], [body], [embedding]])
-        col.flush()
+        with span("vector.insert", **{"db.system": "milvus", "body.bytes": len(row["body"])}):
+            col.insert([{k: v for k, v in row.items() if k in self.fields}])
+            col.flush()
+        # class attribute: every GmailVectorStore in the process shares the collection
+        with GmailVectorStore._generation_lock:
+            GmailVectorStore.generation += 1
         print(f"📥 Inserted email: {subject[:50]}...")
 
-    def search_similar(self, query_embedding: List[float], limit: int = 3):
+    def search_similar(self, query_embedding: List[float], limit: int = 3,
+                       since_days: Optional[float] = None, thread_id: Optional[str] = None,
+                       sender_domain: Optional[str] = None, labels: Optional[Sequence[str]] = None,
+                       expr: Optional[str] = None):
+        """
+        Cosine top-k search. The optional filters are pushed down to Milvus as a boolean
+        expression so candidates are pruned by the scalar indexes before the vector scan.
+        """
+        from pymilvus import Collection
         col = Collection(COLLECTION)
-        col.load()
-        res = col.search(
-            data=[query_embedding],
-            anns_field="embedding",
-            param={"metric_type": "COSINE", "params": {"nprobe": 10}},
-            limit=limit,
-            output_fields=["subject", "from_email", "body"],
-        )
+        with span("vector.load", **{"db.system": "milvus"}):
+            col.load()
+        filter_expr = build_filter_expr(since_days, thread_id, sender_domain, labels, expr) or None
+        with span("vector.search", **{"db.system": "milvus", "search.limit": limit,
+                                      "search.filtered": bool(filter_expr)}) as s:
+            res = col.search(
+                data=[query_embedding],
+                anns_field="embedding",
+                param={"metric_type": "COSINE", "params": {"nprobe": 10}},
+                limit=limit,
+                expr=filter_expr,
+                output_fields=[f for f in OUTPUT_FIELDS if f in self.fields],
+            )
+            s.set_attribute("search.hits", len(res[0]))
         return res[0]
+
+    def count_emails(self, sender: Optional[str] = None, since_days: Optional[float] = None,
+                     thread_id: Optional[str] = None, labels: Optional[Sequence[str]] = None) -> int:
+        addr = sender_email_of(sender)
+        if "sender_email" in self.fields:
+            expr = build_filter_expr(since_days, thread_id, None, labels, sender_email=addr or None)
+        else:
+            # collections created before sender_email existed: case-sensitive substring match
+            expr = build_filter_expr(since_days, thread_id, sender_domain_of(addr) or None, labels,
+                                     f"from_email like {_quote('%' + addr + '%')}" if addr else None)
+        from pymilvus import Collection
+        col = Collection(COLLECTION)
+        col.load()
+        with span("vector.count", **{"db.system": "milvus"}):
+            res = col.query(expr=expr, output_fields=["count(*)"])
+        return int(res[0]["count(*)"]) if res else 0
+
+    def existing_message_ids(self, message_ids: Sequence[str]) -> set:
+        ids = [m for m in dict.fromkeys(message_ids) if m]
+        if not ids:
+            return set()
+        from pymilvus import Collection
+        col = Collection(COLLECTION)
+        col.load()
+        res = col.query(expr=f"message_id in [{', '.join(_quote(m) for m in ids)}]",
+                        output_fields=["message_id"])
+        return {row["message_id"] for row in res}
+
+    def loaded(self) -> bool:
+        from pymilvus import utility
+        return utility.load_state(COLLECTION).name == "Loaded"
+
+    def iter_batches(self, batch_size: int = 1000, output_fields: Optional[Sequence[str]] = None):
+        """
+        Page through the whole collection with a query iterator: only batch_size rows are
+        held client-side at a time. The collection must be loaded (see loaded()).
+        """
+        from pymilvus import Collection
+        fields = [f for f in (output_fields or OUTPUT_FIELDS) if f in self.fields]
+        it = Collection(COLLECTION).query_iterator(batch_size=batch_size, expr="", output_fields=fields)
+        try:
+            while True:
+                page = it.next()
+                if not page:
+                    break
+                yield [dict(row) for row in page]
+        finally:
+            it.close()
+
+    def stats(self) -> dict:
+        """
+        Row count, per-segment layout of the loaded segments (rows, memory, state) and the
+        build progress of every index. Segment details need the collection to be loaded.
+        """
+        from pymilvus import Collection, utility
+        col = Collection(COLLECTION)
+        loaded = self.loaded()
+        segments = []
+        if loaded:
+            for seg in utility.get_query_segment_info(COLLECTION):
+                segments.append({"id": seg.segmentID, "partition": seg.partitionID, "rows": seg.num_rows,
+                                 "mem_bytes": seg.mem_size, "state": str(seg.state), "index": seg.index_name})
+        indexes = []
+        for index in col.indexes:
+            progress = utility.index_building_progress(COLLECTION, index_name=index.index_name)
+            indexes.append({"field": index.field_name, "name": index.index_name,
+                            "type": index.params.get("index_type"),
+                            "indexed_rows": progress.get("indexed_rows"),
+                            "total_rows": progress.get("total_rows"),
+                            "pending_rows": progress.get("pending_index_rows", 0)})
+        dim = next((f.params.get("dim") for f in col.schema.fields if f.name == "embedding"), None)
+        return {"backend": "milvus", "collection": COLLECTION, "rows": col.num_entities, "dim": dim,
+                "loaded": loaded, "segments": segments, "indexes": indexes}